@@ -0,0 +1,19 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from database import MONGO_URI
+
+# Non-blocking counterpart of database.py for `async def` routes.
+# Calling pymongo from a coroutine stalls the event loop for the whole
+# round trip, so async routes must use these collections instead.
+client = AsyncIOMotorClient(MONGO_URI)
+db = client["toepwar"]
+
+# Collections
+users_collection = db["users"]
+transactions_collection = db["transactions"]
+goals_collection = db["goals"]
+admins_collection = db["admins"]
+notifications_collection = db["notifications"]
+ledger_summaries_collection = db["ledger_summaries"]
+monthly_rollups_collection = db["monthly_rollups"]
+spending_stats_collection = db["spending_stats"]
+data_versions_collection = db["data_versions"]
@@ -0,0 +1,73 @@
+from datetime import datetime
+from pymongo import ReturnDocument, UpdateOne
+from database import data_versions_collection
+from response_cache import VERSION_TTL, cache_backend
+import async_database
+
+# One counter per user, bumped after every write to their transactions,
+# goals or notifications. Anything derived from that data and keyed by the
+# version, such as cached reports and responses, is invalidated by the next
+# write without being deleted.
+
+
+def _publish(user_id: str, version: int):
+    # Cached responses are looked up under this version from now on
+    if cache_backend is not None:
+        cache_backend.set_version(user_id, version, VERSION_TTL)
+
+
+def bump_data_version(user_id: str) -> int:
+    """Record a write to the user's data. Call after the write. Returns the new version."""
+    document = data_versions_collection.find_one_and_update(
+        {"_id": user_id},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _publish(user_id, document["version"])
+    return document["version"]
+
+
+def bump_data_versions(user_ids) -> dict:
+    """bump_data_version for many users in one bulk_write and one read. Returns the new versions."""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    now = datetime.utcnow()
+    data_versions_collection.bulk_write([
+        UpdateOne({"_id": user_id}, {"$inc": {"version": 1}, "$set": {"updated_at": now}}, upsert=True)
+        for user_id in user_ids
+    ], ordered=False)
+    versions = {
+        document["_id"]: document["version"]
+        for document in data_versions_collection.find({"_id": {"$in": user_ids}}, {"version": 1})
+    }
+    for user_id, version in versions.items():
+        _publish(user_id, version)
+    return versions
+
+
+def get_data_version(user_id: str) -> int:
+    document = data_versions_collection.find_one({"_id": user_id}, {"version": 1})
+    return document["version"] if document else 0
+
+
+def refresh_data_version(user_id: str) -> int:
+    """The user's version read from Mongo, published so cached responses are looked up under it"""
+    version = get_data_version(user_id)
+    # Never replaces a newer version published by a write meanwhile
+    _publish(user_id, version)
+    return version
+
+
+def get_cached_data_version(user_id: str) -> int:
+    """The user's version from the response cache, read from Mongo only when it isn't there"""
+    version = cache_backend.get_version(user_id) if cache_backend is not None else None
+    if version is None:
+        version = refresh_data_version(user_id)
+    return version
+
+
+async def get_data_version_async(user_id: str) -> int:
+    document = await async_database.data_versions_collection.find_one({"_id": user_id}, {"version": 1})
+    return document["version"] if document else 0
@@ -11,10 +11,25 @@ transactions_collection = db["transactions"]
 goals_collection = db["goals"]
 admins_collection = db["admins"]
 notifications_collection = db["notifications"]
+ledger_summaries_collection = db["ledger_summaries"]
+monthly_rollups_collection = db["monthly_rollups"]
+spending_stats_collection = db["spending_stats"]
+data_versions_collection = db["data_versions"]
+job_leases_collection = db["job_leases"]
+revoked_tokens_collection = db["revoked_tokens"]
+tombstones_collection = db["tombstones"]
 
-# Send a ping to confirm a successful connection
-try:
-    client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(e)
+
+def ping() -> bool:
+    """
+    Send a ping to confirm a successful connection.
+    Not run at import: MongoClient connects lazily, so importing this module
+    never blocks a worker. Called from the warm-up hook in main.py when enabled.
+    """
+    try:
+        client.admin.command('ping')
+        print("Pinged your deployment. You successfully connected to MongoDB!")
+        return True
+    except Exception as e:
+        print(e)
+        return False
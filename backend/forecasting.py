@@ -0,0 +1,124 @@
+from calendar import monthrange
+from datetime import datetime, timedelta
+import numpy as np
+
+
+def _month_number(date: datetime) -> int:
+    return date.year * 12 + date.month - 1
+
+
+def _month_end(month_number: int) -> datetime:
+    year, month = divmod(month_number, 12)
+    return datetime(year, month + 1, monthrange(year, month + 1)[1])
+
+
+def build_series_matrix(rollups: list) -> tuple:
+    """
+    Pivot monthly rollups into a month-by-series matrix.
+    Series are ('total', type) for the income and expense totals and
+    (type, category) for every category, in order of first appearance.
+    Returns (keys, first_month_number, amounts, has_data).
+    """
+    rollups = [rollup for rollup in rollups if rollup["type"] in ("income", "expense")]
+    keys = [("total", "income"), ("total", "expense")]
+    columns = {key: index for index, key in enumerate(keys)}
+    for rollup in rollups:
+        key = (rollup["type"], rollup["category"])
+        if key not in columns:
+            columns[key] = len(keys)
+            keys.append(key)
+
+    if not rollups:
+        return keys, 0, np.zeros((0, len(keys))), np.zeros((0, len(keys)), dtype=bool)
+
+    month_numbers = [_month_number(rollup["month"]) for rollup in rollups]
+    first_month = min(month_numbers)
+    amounts = np.zeros((max(month_numbers) - first_month + 1, len(keys)))
+    has_data = np.zeros(amounts.shape, dtype=bool)
+
+    for rollup, month_number in zip(rollups, month_numbers):
+        row = month_number - first_month
+        for key in (("total", rollup["type"]), (rollup["type"], rollup["category"])):
+            column = columns[key]
+            amounts[row, column] += rollup["sum"]
+            has_data[row, column] = True
+
+    return keys, first_month, amounts, has_data
+
+
+def forecast_matrix(amounts: np.ndarray, has_data: np.ndarray, first_month: int, forecast_months: int) -> list:
+    """
+    Fit a linear trend to every column at once and project it forward.
+
+    Each series spans from its first to its last month with data, with empty
+    months in between counted as 0, and is indexed 0..n-1 over that span,
+    exactly as the per-series LinearRegression fit was. The least-squares
+    normal equations are solved for all columns in one vectorized step.
+    Returns one list of {'date', 'amount'} per column.
+    """
+    month_count, series_count = amounts.shape
+    forecasts = []
+    if series_count == 0:
+        return forecasts
+
+    rows = np.arange(month_count)[:, None]
+    if month_count:
+        first = np.argmax(has_data, axis=0)
+        last = month_count - 1 - np.argmax(has_data[::-1], axis=0)
+        present = has_data.any(axis=0)
+    else:
+        first = last = np.zeros(series_count, dtype=int)
+        present = np.zeros(series_count, dtype=bool)
+
+    weights = ((rows >= first) & (rows <= last) & present).astype(float)
+    x = (rows - first) * weights
+    y = amounts * weights
+
+    n = weights.sum(axis=0)
+    sum_x = x.sum(axis=0)
+    sum_y = y.sum(axis=0)
+    sum_xx = (x * x).sum(axis=0)
+    sum_xy = (x * y).sum(axis=0)
+
+    fitted = n >= 2
+    denominator = np.where(fitted, n * sum_xx - sum_x ** 2, 1.0)
+    slope = np.where(fitted, (n * sum_xy - sum_x * sum_y) / denominator, 0.0)
+    intercept = np.where(n > 0, (sum_y - slope * sum_x) / np.maximum(n, 1), 0.0)
+
+    steps = np.arange(1, forecast_months + 1)[:, None]
+    predictions = np.maximum(intercept + slope * (n - 1 + steps), 0)
+
+    now = datetime.now()
+    for column in range(series_count):
+        if not fitted[column]:
+            # Not enough data for forecasting, return simple projection
+            average = float(intercept[column])
+            future_dates = [now + timedelta(days=30 * i) for i in range(forecast_months)]
+            forecasts.append([{'date': date.isoformat(), 'amount': average} for date in future_dates])
+            continue
+
+        last_date = _month_end(first_month + int(last[column]))
+        forecasts.append([
+            {'date': (last_date + timedelta(days=30 * i)).isoformat(), 'amount': float(amount)}
+            for i, amount in zip(range(1, forecast_months + 1), predictions[:, column])
+        ])
+
+    return forecasts
+
+
+def forecast_rollups(rollups: list, forecast_months: int) -> tuple:
+    """
+    Forecast total income, total expense and every category from monthly
+    rollups in a single batch.
+    Returns (income_forecast, expense_forecast, category_forecasts) in the
+    shape generate_insights_and_recommendations expects.
+    """
+    keys, first_month, amounts, has_data = build_series_matrix(rollups)
+    forecasts = forecast_matrix(amounts, has_data, first_month, forecast_months)
+
+    category_forecasts = {'income': {}, 'expense': {}}
+    for (group, name), forecast in zip(keys[2:], forecasts[2:]):
+        if group in category_forecasts:
+            category_forecasts[group][name] = forecast
+
+    return forecasts[0], forecasts[1], category_forecasts
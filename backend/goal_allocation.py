@@ -0,0 +1,186 @@
+from datetime import datetime
+from pymongo import UpdateOne
+from database import goals_collection
+from data_version import bump_data_version
+from sync_log import sync_stamp
+from ledger import get_summary
+from notification_outbox import outbox
+
+
+def check_goal_progress(goal: dict) -> dict | None:
+    """
+    Check if a goal has reached significant progress milestones
+    Returns notification data if a milestone is reached, None otherwise
+    """
+    progress = (goal["current_amount"] / goal["target_amount"]) * 100
+
+    # Define milestone thresholds
+    milestones = [25, 50, 75, 90, 100]
+
+    # Find the highest milestone reached
+    reached_milestone = None
+    for milestone in milestones:
+        if progress >= milestone:
+            reached_milestone = milestone
+
+    if reached_milestone:
+        message = (f"You've reached {reached_milestone}% of your goal '{goal['name']}'! "
+                  f"Current amount: K{goal['current_amount']:.2f}")
+
+        # Special message for completion
+        if reached_milestone == 100:
+            message = f"Congratulations! You've achieved your goal '{goal['name']}'!"
+
+        return {
+            "user_id": goal["user_id"],
+            "title": "Goal Progress Update",
+            "message": message,
+            "timestamp": datetime.utcnow(),  # UTC; served with a 'Z' suffix
+            "type": "goalProgress",
+            "isRead": False,
+            "requiresSystemNotification": True,  # Add this flag
+            "milestone": reached_milestone
+        }
+
+    return None
+
+
+def transaction_effect(transaction: dict | None) -> float:
+    """Signed amount a transaction contributes to the balance available for goals"""
+    if not transaction:
+        return 0.0
+    amount = float(transaction["amount"])
+    return amount if transaction["type"] == "income" else -amount
+
+
+def _open_goals(user_id: str) -> list:
+    return list(goals_collection.find({
+        "user_id": user_id,
+        "completed": {"$ne": True}
+    }).sort("deadline", 1))
+
+
+def plan_allocation(goals: list, delta: float) -> dict:
+    """
+    Compute the goal state after moving `delta` into (positive) or out of
+    (negative) the user's open goals, given sorted by deadline ascending.
+    Income funds the nearest deadlines first; expenses drain the furthest first.
+    Returns {goal_id: changes} for the goals that actually change.
+    """
+    changes_by_goal = {}
+
+    if delta > 0:
+        remaining_balance = delta
+        for goal in goals:
+            needed_amount = goal["target_amount"] - goal["current_amount"]
+
+            if remaining_balance >= needed_amount:
+                changes_by_goal[goal["_id"]] = {
+                    "current_amount": goal["target_amount"],
+                    "completed": True,
+                    "completion_date": datetime.utcnow()
+                }
+                remaining_balance -= needed_amount
+            elif remaining_balance > 0:
+                changes_by_goal[goal["_id"]] = {"current_amount": goal["current_amount"] + remaining_balance}
+                break
+
+    elif delta < 0:
+        remaining_decrement = -delta
+        for goal in reversed(goals):
+            current_amount = goal["current_amount"]
+
+            if current_amount >= remaining_decrement:
+                changes_by_goal[goal["_id"]] = {"current_amount": current_amount - remaining_decrement}
+                break
+            elif current_amount > 0:
+                changes_by_goal[goal["_id"]] = {"current_amount": 0}
+                remaining_decrement -= current_amount
+
+    return changes_by_goal
+
+
+def _apply_plan(goals: list, changes_by_goal: dict) -> list:
+    """
+    Write only the goals whose amount or completion actually changed, in one
+    bulk_write, and emit a milestone notification for each goal that grew.
+    Returns the emitted notifications ready for the response.
+    """
+    goal_updates = []
+    notifications = []
+
+    for goal in goals:
+        changes = changes_by_goal.get(goal["_id"])
+        if not changes:
+            continue
+        if (
+            changes["current_amount"] == goal["current_amount"]
+            and changes.get("completed", goal.get("completed", False)) == goal.get("completed", False)
+        ):
+            continue
+
+        grew = changes["current_amount"] > goal["current_amount"]
+        goal.update(changes)
+        goal_updates.append((goal["_id"], changes))
+
+        if grew:
+            notification_data = check_goal_progress(goal)
+            if notification_data:
+                notifications.append((goal, notification_data))
+
+    if goal_updates:
+        stamp = sync_stamp(goals[0]["user_id"])
+        goals_collection.bulk_write([
+            UpdateOne({"_id": goal_id}, {"$set": {**changes, **stamp}})
+            for goal_id, changes in goal_updates
+        ], ordered=False)
+        bump_data_version(goals[0]["user_id"])
+
+    # Queued after the goal writes; a milestone is announced once per cooldown
+    emitted = [
+        outbox.emit(notification, key=f"{goal['_id']}:{notification['milestone']}")
+        for goal, notification in notifications
+    ]
+    return [notification for notification in emitted if notification]
+
+
+def apply_goal_delta(user_id: str, delta: float) -> list:
+    """Move `delta` into or out of the user's open goals in one read and one write"""
+    if not delta:
+        return []
+    goals = _open_goals(user_id)
+    return _apply_plan(goals, plan_allocation(goals, delta))
+
+
+def reallocate_goals(user_id: str, old_transaction: dict | None = None, new_transaction: dict | None = None) -> list:
+    """
+    Reallocate goals for an edited, added or deleted transaction from the net
+    difference between its old and new versions, in a single pass.
+    Editing an income from 100 to 110 moves only 10 into the goals.
+    """
+    delta = transaction_effect(new_transaction) - transaction_effect(old_transaction)
+    return apply_goal_delta(user_id, delta)
+
+
+def rebuild_goals_from_ledger(user_id: str) -> list:
+    """
+    Recompute every open goal from the ledger balance in one pass.
+    Money held by completed goals stays there; the rest of the balance fills
+    open goals from zero in deadline order.
+    """
+    balance = get_summary(user_id)["balance"]
+    goals = list(goals_collection.find({"user_id": user_id}).sort("deadline", 1))
+
+    open_goals = [goal for goal in goals if goal.get("completed") is not True]
+    available = balance - sum(goal["current_amount"] for goal in goals if goal.get("completed") is True)
+
+    changes_by_goal = {}
+    for goal in open_goals:
+        funded = max(0.0, min(goal["target_amount"], available))
+        changes = {"current_amount": funded}
+        if funded >= goal["target_amount"]:
+            changes.update({"completed": True, "completion_date": datetime.utcnow()})
+        changes_by_goal[goal["_id"]] = changes
+        available -= funded
+
+    return _apply_plan(open_goals, changes_by_goal)
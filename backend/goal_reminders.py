@@ -0,0 +1,239 @@
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+import pytz
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from database import goals_collection, job_leases_collection
+from notification_outbox import outbox
+
+# Open goals evaluated per query, and reminders marked sent per bulk_write
+SWEEP_BATCH_SIZE = 1000
+SWEEP_WRITE_BATCH_SIZE = 500
+
+# Seconds between sweeps of the in-process scheduler; 0 disables it
+GOAL_REMINDER_INTERVAL = int(os.getenv("TOEPWAR_GOAL_REMINDER_INTERVAL", "3600"))
+
+# Reminder rules in priority order; a goal gets at most one per evaluation,
+# and each (goal, rule) is sent once, tracked in the goal's reminders_sent
+RULE_DEADLINE_WEEK = "deadline_7_days"
+RULE_DEADLINE_MONTH = "deadline_30_days"
+RULE_BEHIND_SCHEDULE = "behind_schedule"
+
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def deadline_utc(value) -> datetime:
+    """Goal deadlines as aware UTC datetimes, whether stored as datetimes or ISO strings"""
+    utc = pytz.UTC
+    if isinstance(value, str):
+        # Remove milliseconds if present and handle timezone
+        deadline_str = value.split('.')[0]
+        if deadline_str.endswith('Z'):
+            deadline_str = deadline_str[:-1] + '+00:00'
+        value = datetime.fromisoformat(deadline_str)
+    if value.tzinfo is None:
+        return utc.localize(value)
+    return value.astimezone(utc)
+
+
+def evaluate_reminders(goals: list, current_date: datetime) -> list:
+    """
+    Apply the reminder rules to a batch of goals at once.
+    Returns (goal, rule, message) for every goal that needs a reminder it
+    hasn't been sent yet.
+    """
+    # numpy is only needed once a sweep runs, so it stays out of worker startup
+    import numpy as np
+
+    rows = []
+    for goal in goals:
+        try:
+            rows.append((
+                goal,
+                deadline_utc(goal["deadline"]).timestamp(),
+                # For calculating total days, handle ObjectId generation time
+                goal["_id"].generation_time.timestamp(),
+                float(goal["current_amount"]),
+                float(goal["target_amount"])
+            ))
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            print(f"Error processing goal {goal.get('_id', 'unknown')}: {str(e)}")
+    if not rows:
+        return []
+
+    deadline = np.array([row[1] for row in rows])
+    start = np.array([row[2] for row in rows])
+    current_amount = np.array([row[3] for row in rows])
+    target_amount = np.array([row[4] for row in rows])
+    now = current_date.timestamp()
+
+    # Whole days, floored like timedelta.days
+    days_remaining = np.floor((deadline - now) / 86400).astype(int)
+    total_days = np.floor((deadline - start) / 86400).astype(int)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        progress = np.where(target_amount != 0, current_amount / target_amount * 100, np.inf)
+        time_percentage = np.where(total_days > 0, (total_days - days_remaining) / total_days * 100, 0)
+
+    eligible = (days_remaining > 0) & (total_days > 0)
+    week = eligible & (days_remaining <= 7) & (progress < 90)
+    month = eligible & ~week & (days_remaining <= 30) & (progress < 50)
+    behind = eligible & ~week & ~month & (progress < time_percentage - 10)
+
+    reminders = []
+    for index in np.flatnonzero(week | month | behind):
+        goal = rows[index][0]
+        days, goal_progress = int(days_remaining[index]), float(progress[index])
+        if week[index]:
+            rule = RULE_DEADLINE_WEEK
+            message = f"Only {days} days left to reach your goal '{goal['name']}'. Current progress: {goal_progress:.1f}%"
+        elif month[index]:
+            rule = RULE_DEADLINE_MONTH
+            message = f"{days} days remaining for goal '{goal['name']}' but only {goal_progress:.1f}% completed"
+        else:
+            rule = RULE_BEHIND_SCHEDULE
+            message = f"Your goal '{goal['name']}' is behind schedule. Current progress: {goal_progress:.1f}%"
+
+        if rule not in goal.get("reminders_sent", []):
+            reminders.append((goal, rule, message))
+    return reminders
+
+
+def _reminder_notification(goal: dict, rule: str, message: str, current_date: datetime) -> dict:
+    return {
+        "user_id": goal["user_id"],
+        "title": "Goal Reminder",
+        "message": message,
+        "timestamp": current_date,
+        "type": "goalReminder",
+        "isRead": False,
+        "requiresSystemNotification": True,
+        "goal_id": str(goal["_id"]),
+        "reminder": rule
+    }
+
+
+def _write_reminders(reminders: list, current_date: datetime) -> list:
+    """
+    Claim each (goal, rule) in one bulk_write and queue the notifications of
+    the claimed ones on the outbox, which writes them in batches across users.
+    A sweep on another worker or a /checkgoalreminders poll may evaluate the
+    same goal at the same time; only the write that adds the rule to
+    reminders_sent claims it, recognised by the claim id it stores.
+    Returns the queued notifications with their ids.
+    """
+    if not reminders:
+        return []
+    claim = str(ObjectId())
+    result = goals_collection.bulk_write([
+        UpdateOne(
+            {"_id": goal["_id"], "reminders_sent": {"$ne": rule}},
+            {"$addToSet": {"reminders_sent": rule}, "$set": {f"reminder_claims.{rule}": claim}}
+        )
+        for goal, rule, _ in reminders
+    ], ordered=False)
+    if result.modified_count < len(reminders):
+        claims = {
+            goal["_id"]: goal.get("reminder_claims", {})
+            for goal in goals_collection.find(
+                {"_id": {"$in": [goal["_id"] for goal, _, _ in reminders]}}, {"reminder_claims": 1}
+            )
+        }
+        reminders = [
+            (goal, rule, message) for goal, rule, message in reminders
+            if claims.get(goal["_id"], {}).get(rule) == claim
+        ]
+    emitted = [
+        outbox.emit(_reminder_notification(goal, rule, message, current_date), key=f"{goal['_id']}:{rule}")
+        for goal, rule, message in reminders
+    ]
+    return [notification for notification in emitted if notification]
+
+
+def check_user_goal_reminders(user_id: str) -> list:
+    """Send the reminders due for one user's open goals. Returns the notification ids."""
+    current_date = datetime.now(pytz.UTC)
+    goals = list(goals_collection.find({"user_id": user_id, "completed": False}))
+    notifications = _write_reminders(evaluate_reminders(goals, current_date), current_date)
+    return [notification["id"] for notification in notifications]
+
+
+def _acquire_lease(name: str, seconds: int) -> bool:
+    """
+    Take a named lease so only one worker runs a job per interval.
+    Held until it expires; the owner may renew it.
+    """
+    now = datetime.utcnow()
+    try:
+        job_leases_collection.update_one(
+            {"_id": name, "$or": [{"expires_at": {"$lte": now}}, {"owner": LEASE_OWNER}]},
+            {"$set": {"owner": LEASE_OWNER, "expires_at": now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        # The lease exists and is held by another worker
+        return False
+
+
+def sweep_goal_reminders() -> dict:
+    """
+    Walk every open goal with a future deadline in (deadline, _id) order over
+    the completed/deadline index, evaluate each batch in one vectorized pass
+    and write the due reminders across users in batched insert_many calls.
+    Goals with legacy string deadlines are only covered by /checkgoalreminders.
+    Returns counts and throughput.
+    """
+    started = time.perf_counter()
+    current_date = datetime.now(pytz.UTC)
+    query = {"completed": False, "deadline": {"$gt": current_date}}
+
+    goal_count = 0
+    notification_count = 0
+    pending = []
+    last = None
+
+    while True:
+        batch_query = dict(query)
+        if last is not None:
+            batch_query["$or"] = [
+                {"deadline": {"$gt": last["deadline"]}},
+                {"deadline": last["deadline"], "_id": {"$gt": last["_id"]}}
+            ]
+        goals = list(
+            goals_collection.find(batch_query)
+            .sort([("deadline", 1), ("_id", 1)])
+            .limit(SWEEP_BATCH_SIZE)
+        )
+        if not goals:
+            break
+
+        goal_count += len(goals)
+        last = goals[-1]
+        pending.extend(evaluate_reminders(goals, current_date))
+        if len(pending) >= SWEEP_WRITE_BATCH_SIZE:
+            notification_count += len(_write_reminders(pending, current_date))
+            pending = []
+
+    notification_count += len(_write_reminders(pending, current_date))
+
+    elapsed = time.perf_counter() - started
+    return {
+        "goals": goal_count,
+        "notifications": notification_count,
+        "seconds": elapsed,
+        "goals_per_second": goal_count / elapsed if elapsed > 0 else 0.0
+    }
+
+
+def run_scheduled_sweep() -> dict | None:
+    """One scheduler tick: sweep unless another worker holds this interval's lease"""
+    if not _acquire_lease("goal_reminders", GOAL_REMINDER_INTERVAL):
+        return None
+    stats = sweep_goal_reminders()
+    outbox.flush()
+    print(f"Goal reminder sweep: {stats['goals']} goals, {stats['notifications']} reminders "
+          f"in {stats['seconds']:.2f}s ({stats['goals_per_second']:.0f} goals/s)")
+    return stats
@@ -0,0 +1,127 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from database import db
+
+# Indexes every collection is expected to have, keyed by collection name.
+# Names are fixed so verification can match live indexes to the manifest.
+INDEX_MANIFEST = {
+    "users": [
+        {"name": "email_unique", "keys": [("email", ASCENDING)], "unique": True},
+        {"name": "username_unique", "keys": [("username", ASCENDING)], "unique": True},
+    ],
+    "transactions": [
+        # Also serves the (date, _id) keyset pagination of /gettransactions
+        {"name": "user_date", "keys": [("user_id", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]},
+        {"name": "user_type_date", "keys": [("user_id", ASCENDING), ("type", ASCENDING), ("date", DESCENDING)]},
+        {"name": "user_category_date", "keys": [("user_id", ASCENDING), ("category", ASCENDING), ("date", DESCENDING)]},
+        # Delta sync, see sync_log.py
+        {"name": "user_sync_seq", "keys": [("user_id", ASCENDING), ("sync_seq", ASCENDING)]},
+        # Ids the app gives transactions created offline; a replayed /sync/push add is rejected
+        {
+            "name": "user_client_id_unique",
+            "keys": [("user_id", ASCENDING), ("client_id", ASCENDING)],
+            "unique": True,
+            "partial_filter": {"client_id": {"$exists": True}}
+        },
+    ],
+    "goals": [
+        {"name": "user_completed_deadline", "keys": [("user_id", ASCENDING), ("completed", ASCENDING), ("deadline", ASCENDING)]},
+        # Batches of the goal reminder sweep across all users
+        {"name": "completed_deadline", "keys": [("completed", ASCENDING), ("deadline", ASCENDING), ("_id", ASCENDING)]},
+        {"name": "user_sync_seq", "keys": [("user_id", ASCENDING), ("sync_seq", ASCENDING)]},
+    ],
+    "notifications": [
+        # Feed pagination on (timestamp, _id); replaces the former user_timestamp index
+        {"name": "user_timestamp_id", "keys": [("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]},
+        # Unread badge count
+        {"name": "user_unread", "keys": [("user_id", ASCENDING), ("isRead", ASCENDING)]},
+        # Cooldown lookups of the notification outbox
+        {"name": "user_type_dedupe", "keys": [("user_id", ASCENDING), ("type", ASCENDING), ("dedupe_key", ASCENDING), ("created_at", DESCENDING)]},
+        # Stream replay after Last-Event-ID; replaces the former user_id_id index
+        {"name": "user_stream_seq_id", "keys": [("user_id", ASCENDING), ("stream_seq", ASCENDING), ("_id", ASCENDING)]},
+        {"name": "user_sync_seq", "keys": [("user_id", ASCENDING), ("sync_seq", ASCENDING)]},
+    ],
+    "monthly_rollups": [
+        {
+            "name": "user_month_type_category_unique",
+            "keys": [("user_id", ASCENDING), ("month", ASCENDING), ("type", ASCENDING), ("category", ASCENDING)],
+            "unique": True
+        },
+    ],
+    "spending_stats": [
+        # Documents are read by _id; this serves the per-user rebuild
+        {"name": "user_id", "keys": [("user_id", ASCENDING)]},
+    ],
+    "admins": [
+        {"name": "email_role", "keys": [("email", ASCENDING), ("role", ASCENDING)]},
+    ],
+    "revoked_tokens": [
+        # Incremental polling of revocations by every worker
+        {"name": "updated_at", "keys": [("updated_at", ASCENDING)]},
+        # Dropped once every token they cover has expired anyway
+        {"name": "expires_at_ttl", "keys": [("expires_at", ASCENDING)], "expire_after_seconds": 0},
+    ],
+    "tombstones": [
+        {"name": "user_sync_seq", "keys": [("user_id", ASCENDING), ("sync_seq", ASCENDING)]},
+        # Kept as long as a sync token stays valid, see sync_log.py
+        {"name": "expires_at_ttl", "keys": [("expires_at", ASCENDING)], "expire_after_seconds": 0},
+    ],
+}
+
+
+def _index_model(spec: dict) -> IndexModel:
+    options = {"name": spec["name"], "unique": spec.get("unique", False)}
+    if "expire_after_seconds" in spec:
+        options["expireAfterSeconds"] = spec["expire_after_seconds"]
+    if "partial_filter" in spec:
+        options["partialFilterExpression"] = spec["partial_filter"]
+    return IndexModel(spec["keys"], **options)
+
+
+def ensure_indexes() -> dict:
+    """
+    Create every index in the manifest. Creating an index that already exists
+    with the same definition is a no-op, so this is safe to run on every start.
+    Returns the errors per collection, if any.
+    """
+    errors = {}
+    for collection_name, specs in INDEX_MANIFEST.items():
+        try:
+            db[collection_name].create_indexes([_index_model(spec) for spec in specs])
+        except OperationFailure as e:
+            # e.g. a same-named index with other options, or duplicate keys
+            # preventing a unique index from being built
+            errors[collection_name] = str(e)
+    return errors
+
+
+def verify_indexes() -> dict:
+    """
+    Compare the live indexes with the manifest.
+    Returns missing, extra and mismatched index names per collection.
+    """
+    report = {}
+    for collection_name, specs in INDEX_MANIFEST.items():
+        live = {index["name"]: index for index in db[collection_name].list_indexes()}
+        live.pop("_id_", None)
+
+        missing, mismatched = [], []
+        for spec in specs:
+            index = live.pop(spec["name"], None)
+            if index is None:
+                missing.append(spec["name"])
+            elif (
+                list(index["key"].items()) != spec["keys"]
+                or index.get("unique", False) != spec.get("unique", False)
+                or index.get("expireAfterSeconds") != spec.get("expire_after_seconds")
+                or index.get("partialFilterExpression") != spec.get("partial_filter")
+            ):
+                mismatched.append(spec["name"])
+
+        if missing or mismatched or live:
+            report[collection_name] = {
+                "missing": missing,
+                "mismatched": mismatched,
+                "extra": sorted(live)
+            }
+    return report
@@ -0,0 +1,380 @@
+from calendar import monthrange
+from datetime import datetime, time, timezone
+from pymongo import UpdateOne
+from database import transactions_collection, ledger_summaries_collection, monthly_rollups_collection
+from spending_stats import apply_spending_delta, fold_expense
+from data_version import bump_data_version
+
+# Float drift tolerated between a summary and its transactions before
+# reconciliation reports it
+DRIFT_TOLERANCE = 0.005
+
+
+def _empty_summary(user_id: str) -> dict:
+    return {
+        "_id": user_id,
+        "total_income": 0.0,
+        "total_expense": 0.0,
+        "balance": 0.0,
+        "income_count": 0,
+        "expense_count": 0,
+        "transaction_count": 0,
+        "last_transaction_date": None,
+        "updated_at": datetime.utcnow()
+    }
+
+
+def _fold_group(summary: dict, result: dict):
+    """Fold one per-type $group result into a summary document"""
+    transaction_type = result["type"]
+    if transaction_type not in ("income", "expense"):
+        return
+    summary[f"total_{transaction_type}"] = float(result["total"])
+    summary[f"{transaction_type}_count"] = result["count"]
+    summary["transaction_count"] += result["count"]
+    if summary["last_transaction_date"] is None or result["last_date"] > summary["last_transaction_date"]:
+        summary["last_transaction_date"] = result["last_date"]
+    summary["balance"] = summary["total_income"] - summary["total_expense"]
+
+
+def compute_summary(user_id: str) -> dict:
+    """Build a ledger summary for one user straight from transactions_collection"""
+    summary = _empty_summary(user_id)
+    results = transactions_collection.aggregate([
+        {"$match": {"user_id": user_id}},
+        {
+            "$group": {
+                "_id": "$type",
+                "total": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+                "last_date": {"$max": "$date"}
+            }
+        }
+    ])
+
+    for result in results:
+        _fold_group(summary, {**result, "type": result["_id"]})
+    return summary
+
+
+def rebuild_summary(user_id: str) -> dict:
+    summary = compute_summary(user_id)
+    # $set rather than replace so flags such as rollups_ready survive
+    ledger_summaries_collection.update_one({"_id": user_id}, {"$set": summary}, upsert=True)
+    return summary
+
+
+def get_summary(user_id: str) -> dict:
+    """
+    Point read of the user's ledger summary.
+    Users that predate the summary collection get one built on first access.
+    """
+    summary = ledger_summaries_collection.find_one({"_id": user_id})
+    if summary is None:
+        summary = rebuild_summary(user_id)
+    return summary
+
+
+def new_delta() -> dict:
+    return {
+        "inc": {
+            "total_income": 0.0,
+            "total_expense": 0.0,
+            "balance": 0.0,
+            "income_count": 0,
+            "expense_count": 0,
+            "transaction_count": 0
+        },
+        "latest_added": None,
+        "latest_removed": None,
+        # (month, type, category) -> [sum, count]
+        "rollups": {},
+        # category -> decayed [count, sum, sum_sq, max] of expenses, as of as_of
+        "spending": {},
+        "as_of": datetime.utcnow()
+    }
+
+
+def accumulate_delta(delta: dict, removed: list = (), added: list = ()) -> dict:
+    """Add the effect of removed and added transactions to a pending delta"""
+    inc = delta["inc"]
+    for transaction, sign in [(t, -1) for t in removed] + [(t, 1) for t in added]:
+        if transaction["type"] not in ("income", "expense"):
+            continue
+        amount = float(transaction["amount"]) * sign
+        inc[f"total_{transaction['type']}"] += amount
+        inc[f"{transaction['type']}_count"] += sign
+        inc["transaction_count"] += sign
+        inc["balance"] += amount if transaction["type"] == "income" else -amount
+
+        # Dates read back from Mongo are naive and client dates may be aware
+        date = naive_utc(transaction["date"])
+        key = "latest_added" if sign > 0 else "latest_removed"
+        if delta[key] is None or date > delta[key]:
+            delta[key] = date
+
+        rollup = delta["rollups"].setdefault(
+            (month_start(date), transaction["type"], transaction["category"]),
+            [0.0, 0]
+        )
+        rollup[0] += amount
+        rollup[1] += sign
+
+        if transaction["type"] == "expense":
+            fold_expense(delta["spending"], transaction, sign, delta["as_of"])
+    return delta
+
+
+def apply_delta(user_id: str, delta: dict):
+    """
+    Apply a pending delta to the user's summary with a single atomic $inc.
+    Must be called after the transactions themselves have been written;
+    it bumps the user's data version last.
+    """
+    update = {"$set": {"updated_at": datetime.utcnow()}}
+    inc = {field: value for field, value in delta["inc"].items() if value}
+    if inc:
+        update["$inc"] = inc
+    if delta["latest_added"] is not None:
+        update["$max"] = {"last_transaction_date": delta["latest_added"]}
+
+    # No upsert: a missing summary has to be built from the full history,
+    # not from this delta alone
+    result = ledger_summaries_collection.update_one({"_id": user_id}, update)
+    if result.matched_count == 0:
+        rebuild_summary(user_id)
+        _apply_rollup_delta(user_id, delta["rollups"])
+        apply_spending_delta(user_id, delta["spending"], delta["as_of"])
+        bump_data_version(user_id)
+        return
+
+    _apply_rollup_delta(user_id, delta["rollups"])
+    apply_spending_delta(user_id, delta["spending"], delta["as_of"])
+
+    # $max cannot move the date backwards, so re-read the latest date when
+    # a removed transaction may have been the most recent one
+    latest_removed = delta["latest_removed"]
+    if latest_removed is not None and (delta["latest_added"] is None or latest_removed > delta["latest_added"]):
+        latest = transactions_collection.find_one(
+            {"user_id": user_id},
+            sort=[("date", -1)],
+            projection={"date": 1}
+        )
+        ledger_summaries_collection.update_one(
+            {"_id": user_id},
+            {"$set": {"last_transaction_date": latest["date"] if latest else None}}
+        )
+
+    bump_data_version(user_id)
+
+
+def record_transaction_change(user_id: str, removed: list = (), added: list = ()):
+    """Apply the net effect of removed and added transactions to the user's summary"""
+    apply_delta(user_id, accumulate_delta(new_delta(), removed, added))
+
+
+# Monthly rollups: one document per (user_id, month, type, category) holding
+# the sum and count of matching transactions. They are kept current by
+# apply_delta and let forecasts and category breakdowns scale with the
+# number of months instead of the number of transactions.
+
+def naive_utc(date: datetime) -> datetime:
+    """A date as naive UTC, the way Mongo returns stored dates"""
+    if date.tzinfo is not None:
+        return date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def month_start(date: datetime) -> datetime:
+    """First instant of the (UTC) month a date falls in"""
+    date = naive_utc(date)
+    return datetime(date.year, date.month, 1)
+
+
+def aligned_months(start: datetime | None, end: datetime | None) -> tuple | None:
+    """
+    Return (first_month, last_month) when [start, end] covers whole months
+    exactly, so the range can be answered from rollups. None otherwise.
+    """
+    if start is None or end is None or start.tzinfo is not None or end.tzinfo is not None:
+        return None
+    if start != month_start(start):
+        return None
+    if end.day != monthrange(end.year, end.month)[1] or end.time() < time(23, 59, 59):
+        return None
+    return start, month_start(end)
+
+
+def _apply_rollup_delta(user_id: str, rollups: dict):
+    updates = [
+        UpdateOne(
+            {"user_id": user_id, "month": month, "type": transaction_type, "category": category},
+            {"$inc": {"sum": amount_sum, "count": count}},
+            upsert=True
+        )
+        for (month, transaction_type, category), (amount_sum, count) in rollups.items()
+        if amount_sum or count
+    ]
+    if not updates:
+        return
+    monthly_rollups_collection.bulk_write(updates, ordered=False)
+
+    # Buckets emptied by edits or deletes are dropped
+    if any(count < 0 for _, count in rollups.values()):
+        monthly_rollups_collection.delete_many({"user_id": user_id, "count": {"$lte": 0}})
+
+
+def rebuild_rollups(user_id: str) -> int:
+    """
+    Recompute the user's rollups from transactions_collection and mark them ready.
+    Not guarded against writes landing meanwhile; see the comment below.
+    """
+    rollups = list(transactions_collection.aggregate([
+        {"$match": {"user_id": user_id, "type": {"$in": ["income", "expense"]}}},
+        {
+            "$group": {
+                "_id": {
+                    "month": {"$dateFromParts": {"year": {"$year": "$date"}, "month": {"$month": "$date"}}},
+                    "type": "$type",
+                    "category": "$category"
+                },
+                "sum": {"$sum": {"$toDouble": "$amount"}},
+                "count": {"$sum": 1}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "user_id": user_id,
+                "month": "$_id.month",
+                "type": "$_id.type",
+                "category": "$_id.category",
+                "sum": 1,
+                "count": 1
+            }
+        }
+    ]))
+
+    # Overwritten in place rather than deleted and reinserted, so there is
+    # never a moment without rollups for a concurrent write's $inc to land
+    # on. A write racing the rebuild can still be miscounted: its $inc is
+    # lost when it lands between the aggregate and this $set, and counted
+    # twice when its transaction was already aggregated but the $inc lands
+    # after. Rebuild when writes are quiet; backfill_rollups repairs drift.
+    if rollups:
+        monthly_rollups_collection.bulk_write([
+            UpdateOne(
+                {"user_id": user_id, "month": rollup["month"], "type": rollup["type"], "category": rollup["category"]},
+                {"$set": {"sum": rollup["sum"], "count": rollup["count"]}},
+                upsert=True
+            )
+            for rollup in rollups
+        ], ordered=False)
+    rebuilt = {(rollup["month"], rollup["type"], rollup["category"]) for rollup in rollups}
+    stale = [
+        rollup["_id"]
+        for rollup in monthly_rollups_collection.find({"user_id": user_id}, {"month": 1, "type": 1, "category": 1})
+        if (rollup["month"], rollup["type"], rollup["category"]) not in rebuilt
+    ]
+    if stale:
+        monthly_rollups_collection.delete_many({"_id": {"$in": stale}})
+    ledger_summaries_collection.update_one({"_id": user_id}, {"$set": {"rollups_ready": True}})
+    return len(rollups)
+
+
+def ensure_rollups(user_id: str):
+    """Build rollups on first use for users whose history predates them"""
+    if not get_summary(user_id).get("rollups_ready"):
+        rebuild_rollups(user_id)
+
+
+def get_rollups(user_id: str, transaction_type: str | None = None, months: tuple | None = None) -> list:
+    ensure_rollups(user_id)
+    query = {"user_id": user_id, "count": {"$gt": 0}}
+    if transaction_type:
+        query["type"] = transaction_type
+    if months:
+        query["month"] = {"$gte": months[0], "$lte": months[1]}
+    return list(monthly_rollups_collection.find(query, {"_id": 0}).sort("month", 1))
+
+
+def category_totals(rollups: list) -> list:
+    """Collapse rollups into [{category, amount}] like the category $group pipelines"""
+    totals = {}
+    for rollup in rollups:
+        totals[rollup["category"]] = totals.get(rollup["category"], 0) + rollup["sum"]
+    return [{"category": category, "amount": amount} for category, amount in totals.items()]
+
+
+def _drift(stored: dict, expected: dict) -> dict:
+    drift = {}
+    for field in ("total_income", "total_expense", "balance"):
+        if abs(stored.get(field, 0) - expected[field]) > DRIFT_TOLERANCE:
+            drift[field] = {"stored": stored.get(field, 0), "expected": expected[field]}
+    for field in ("income_count", "expense_count", "transaction_count", "last_transaction_date"):
+        if stored.get(field) != expected[field]:
+            drift[field] = {"stored": stored.get(field), "expected": expected[field]}
+    return drift
+
+
+def _expected_summaries():
+    """Yield a freshly computed summary per user from one grouped scan"""
+    results = transactions_collection.aggregate([
+        {
+            "$group": {
+                "_id": {"user_id": "$user_id", "type": "$type"},
+                "total": {"$sum": "$amount"},
+                "count": {"$sum": 1},
+                "last_date": {"$max": "$date"}
+            }
+        },
+        {"$sort": {"_id.user_id": 1}}
+    ], allowDiskUse=True)
+
+    summary = None
+    for result in results:
+        user_id = result["_id"]["user_id"]
+        if summary is None or summary["_id"] != user_id:
+            if summary is not None:
+                yield summary
+            summary = _empty_summary(user_id)
+        _fold_group(summary, {**result, "type": result["_id"]["type"]})
+
+    if summary is not None:
+        yield summary
+
+
+def reconcile_summaries(fix: bool = False) -> dict:
+    """
+    Rebuild every summary from transactions_collection and compare it with the
+    stored one. With fix=True, drifted or missing summaries are overwritten.
+    """
+    report = {"checked": 0, "missing": [], "drifted": {}, "orphaned": []}
+    seen = set()
+
+    for expected in _expected_summaries():
+        user_id = expected["_id"]
+        seen.add(user_id)
+        report["checked"] += 1
+        stored = ledger_summaries_collection.find_one({"_id": user_id})
+
+        if stored is None:
+            report["missing"].append(user_id)
+        else:
+            drift = _drift(stored, expected)
+            if not drift:
+                continue
+            report["drifted"][user_id] = drift
+
+        if fix:
+            ledger_summaries_collection.update_one({"_id": user_id}, {"$set": expected}, upsert=True)
+
+    # Summaries left behind for users that no longer have any transactions
+    for stored in ledger_summaries_collection.find({"_id": {"$nin": list(seen)}}):
+        user_id = stored["_id"]
+        if _drift(stored, _empty_summary(user_id)):
+            report["orphaned"].append(user_id)
+            if fix:
+                ledger_summaries_collection.update_one({"_id": user_id}, {"$set": _empty_summary(user_id)})
+
+    return report
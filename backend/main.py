@@ -1,7 +1,109 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException
-from routes import admin_routes, auth_routes, budget_plan_routes, notification_routes, user_routes, transaction_routes, goal_routes, dashboard_routes, report_routes, ai_routes, chart_routes
-
-app = FastAPI()
+from indexes import ensure_indexes
+from warmup import warm_up
+from goal_reminders import GOAL_REMINDER_INTERVAL, run_scheduled_sweep
+from notification_outbox import FLUSH_INTERVAL, outbox
+from notification_hub import STREAM_SOURCE, hub
+import async_database
+import report_rendering
+from principals import REVOCATION_POLL_INTERVAL, principals
+from routes import admin_routes, auth_routes, budget_plan_routes, notification_routes, user_routes, transaction_routes, goal_routes, dashboard_routes, report_routes, ai_routes, chart_routes, sync_routes
+
+# Set TOEPWAR_ENSURE_INDEXES=0 to skip index creation at startup
+# and manage indexes with scripts/ensure_indexes.py instead
+ENSURE_INDEXES_ON_STARTUP = os.getenv("TOEPWAR_ENSURE_INDEXES", "1") != "0"
+
+# Set TOEPWAR_WARMUP=1 to ping MongoDB, import numpy and start the report
+# render processes before serving. Off by default so workers start fast; the
+# first forecast or export then pays for it instead.
+WARMUP_ON_STARTUP = os.getenv("TOEPWAR_WARMUP", "0") == "1"
+
+
+async def goal_reminder_scheduler():
+    """Sweep goal reminders every GOAL_REMINDER_INTERVAL seconds until cancelled"""
+    while True:
+        try:
+            await asyncio.to_thread(run_scheduled_sweep)
+        except Exception as e:
+            # Keep the schedule alive; the next tick retries
+            print(f"Goal reminder sweep failed: {e}")
+        await asyncio.sleep(GOAL_REMINDER_INTERVAL)
+
+
+async def notification_flusher():
+    """Write queued notifications every FLUSH_INTERVAL seconds until cancelled"""
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        await asyncio.to_thread(outbox.flush)
+
+
+async def revocation_poller():
+    """Pick up token revocations made on other workers every REVOCATION_POLL_INTERVAL seconds"""
+    while True:
+        await asyncio.sleep(REVOCATION_POLL_INTERVAL)
+        try:
+            await asyncio.to_thread(principals.refresh_revocations)
+        except Exception as e:
+            print(f"Revocation poll failed: {e}")
+
+
+async def notification_watcher():
+    """Feed the stream hub from a change stream until cancelled, restarting on errors"""
+    while True:
+        try:
+            await hub.watch_inserts(async_database.notifications_collection)
+        except Exception as e:
+            print(f"Notification change stream failed: {e}")
+            await asyncio.sleep(5)
+
+
+async def _stop(task: asyncio.Task | None):
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if ENSURE_INDEXES_ON_STARTUP:
+        errors = ensure_indexes()
+        for collection_name, error in errors.items():
+            print(f"Failed to create indexes on {collection_name}: {error}")
+    if WARMUP_ON_STARTUP:
+        timings = await asyncio.to_thread(warm_up)
+        print("Warm-up finished in " + ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in timings.items()))
+
+    # Revocations made before this worker started apply to it too
+    try:
+        await asyncio.to_thread(principals.refresh_revocations)
+    except Exception as e:
+        print(f"Loading token revocations failed: {e}")
+    revocations = asyncio.create_task(revocation_poller())
+
+    # Set TOEPWAR_GOAL_REMINDER_INTERVAL=0 to turn the reminder sweep off
+    scheduler = asyncio.create_task(goal_reminder_scheduler()) if GOAL_REMINDER_INTERVAL > 0 else None
+    flusher = asyncio.create_task(notification_flusher())
+    # /notifications/stream delivers on this loop; flushes publish from worker threads
+    hub.bind(asyncio.get_running_loop())
+    watcher = asyncio.create_task(notification_watcher()) if STREAM_SOURCE == "changestream" else None
+    yield
+    await _stop(scheduler)
+    await _stop(flusher)
+    await _stop(watcher)
+    await _stop(revocations)
+    report_rendering.shutdown()
+    # Don't lose notifications queued since the last flush
+    await asyncio.to_thread(outbox.flush)
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.include_router(auth_routes.router, tags=["Authentication"])
@@ -15,21 +117,4 @@ app.include_router(budget_plan_routes.router, tags=["Budget Plan"])
 app.include_router(chart_routes.router, tags=["Charts"])
 app.include_router(admin_routes.router, prefix="/admin", tags=["Admin"])
 app.include_router(notification_routes.router, tags=["Notifications"])
-
-
-
-
-
-
-    
-
-
-
-
-
-
-
-
-
-
-
+app.include_router(sync_routes.router, tags=["Sync"])
@@ -0,0 +1,29 @@
+import threading
+from collections import defaultdict
+
+# In-process counters and gauges, per worker. Names follow the Prometheus
+# convention, labels are rendered into the key: notifications_emitted{type=balanceAlert}
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{label}={value}" for label, value in sorted(labels.items())) + "}"
+
+
+def increment(name: str, amount: float = 1, **labels):
+    with _lock:
+        _counters[_key(name, labels)] += amount
+
+
+def set_gauge(name: str, value: float, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {"counters": dict(sorted(_counters.items())), "gauges": dict(sorted(_gauges.items()))}
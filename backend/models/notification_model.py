@@ -0,0 +1,16 @@
+from pydantic import BaseModel, model_validator
+from typing import List, Optional
+
+class NotificationIds(BaseModel):
+    # The notifications a bulk action applies to
+    ids: Optional[List[str]] = None
+    # Must be sent as true to apply it to all of the user's notifications
+    all: bool = False
+
+    @model_validator(mode="after")
+    def check_selection(self):
+        if self.all and self.ids is not None:
+            raise ValueError("Send either ids or all, not both")
+        if not self.all and not self.ids:
+            raise ValueError("Send a non-empty list of ids, or all: true")
+        return self
@@ -0,0 +1,21 @@
+from pydantic import BaseModel
+from typing import List, Literal, Optional
+from models.transaction_model import Transaction
+
+class TransactionMutation(BaseModel):
+    op: Literal["add", "edit", "delete"]
+    # Generated by the app for each transaction it creates offline. An add
+    # replayed with a known client_id is not applied twice, and later
+    # mutations may refer to the transaction by it before it has a server id.
+    client_id: Optional[str] = None
+    # Server id of the transaction to edit or delete
+    transaction_id: Optional[str] = None
+    # New values, for add and edit
+    transaction: Optional[Transaction] = None
+    # sync_seq of the transaction when the app last synced it; an edit or
+    # delete of a transaction changed on the server since is rejected
+    base_seq: Optional[int] = None
+
+class SyncPush(BaseModel):
+    # Applied in order
+    mutations: List[TransactionMutation]
@@ -0,0 +1,83 @@
+import asyncio
+import os
+from collections import defaultdict
+import metrics
+
+# Notifications buffered per connection before it is dropped as too slow.
+# A dropped client reconnects with Last-Event-ID and catches up from Mongo.
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Seconds of silence after which a stream sends a heartbeat comment
+HEARTBEAT_INTERVAL = float(os.getenv("TOEPWAR_SSE_HEARTBEAT", "15"))
+
+# Where the hub learns about new notifications:
+#   "outbox"       - notifications flushed by this worker (single worker setups)
+#   "changestream" - a Mongo change stream on notifications, so every worker
+#                    sees every insert (needs a replica set, as on Atlas)
+STREAM_SOURCE = os.getenv("TOEPWAR_NOTIFICATION_STREAM_SOURCE", "outbox")
+
+# Put on a subscriber's queue when it overflowed; the stream then ends
+OVERFLOW = object()
+
+
+class NotificationHub:
+    """
+    Fans new notifications out to the open streams of their user.
+    Lives on the event loop; publish() may be called from any thread.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._subscribers = defaultdict(set)
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[user_id].add(queue)
+        metrics.increment("sse_connections_opened")
+        metrics.set_gauge("sse_connections", self.connection_count())
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+        metrics.set_gauge("sse_connections", self.connection_count())
+
+    def connection_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def publish(self, notifications: list):
+        """Hand stored notifications to the loop for delivery; safe from worker threads"""
+        if self._loop is None or self._loop.is_closed() or not notifications:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._deliver, notifications)
+        except RuntimeError:
+            pass  # Loop shutting down
+
+    def _deliver(self, notifications: list):
+        for notification in notifications:
+            for queue in list(self._subscribers.get(notification["user_id"], ())):
+                try:
+                    queue.put_nowait(notification)
+                except asyncio.QueueFull:
+                    # Too slow to keep up: end its stream rather than buffer without bound
+                    self.unsubscribe(notification["user_id"], queue)
+                    queue.get_nowait()
+                    queue.put_nowait(OVERFLOW)
+                    metrics.increment("sse_overflows")
+        metrics.increment("sse_notifications_published", len(notifications))
+
+    async def watch_inserts(self, collection):
+        """Publish every notification inserted into `collection` (Motor) until cancelled"""
+        async with collection.watch([{"$match": {"operationType": "insert"}}]) as stream:
+            async for change in stream:
+                self._deliver([change["fullDocument"]])
+
+
+hub = NotificationHub()
@@ -0,0 +1,153 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, PyMongoError
+import metrics
+from data_version import bump_data_versions
+from database import notifications_collection
+from notification_hub import STREAM_SOURCE, hub
+from sync_log import sync_stamps
+from utils import serialize_notification
+
+# Seconds within which a notification with the same (user, type, key) is
+# suppressed. Override per type with e.g.
+# TOEPWAR_NOTIFICATION_COOLDOWNS="balanceAlert=43200,expenseAlert=3600"
+DEFAULT_COOLDOWNS = {
+    "balanceAlert": 24 * 60 * 60,
+    "expenseAlert": 24 * 60 * 60,   # keyed by transaction
+    "goalProgress": 24 * 60 * 60,   # keyed by goal and milestone
+    "goalReminder": 0,              # deduped by the goal's reminders_sent
+}
+
+
+def _parse_cooldowns(value: str) -> dict:
+    cooldowns = dict(DEFAULT_COOLDOWNS)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        notification_type, _, seconds = item.partition("=")
+        cooldowns[notification_type.strip()] = int(seconds)
+    return cooldowns
+
+
+COOLDOWNS = _parse_cooldowns(os.getenv("TOEPWAR_NOTIFICATION_COOLDOWNS", ""))
+
+# The background flush runs this often; a batch this large flushes immediately
+FLUSH_INTERVAL = float(os.getenv("TOEPWAR_NOTIFICATION_FLUSH_INTERVAL", "0.5"))
+FLUSH_BATCH_SIZE = 500
+# Notifications kept for retry when Mongo is unavailable, oldest dropped first
+MAX_PENDING = 10000
+
+
+class NotificationOutbox:
+    """
+    Buffers notifications, drops repeats of the same (user, type, key) within
+    the type's cooldown and writes the rest with batched insert_many.
+
+    Ids are assigned on emit, so callers can return the notification at once;
+    it reaches notifications_collection on the next flush.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        # (user_id, type, key) -> time until which repeats are suppressed
+        self._cooling = {}
+
+    def _stored_within(self, dedupe: tuple, since: datetime) -> datetime | None:
+        """Time of a matching notification stored since `since`, e.g. by another worker or before a restart"""
+        user_id, notification_type, key = dedupe
+        stored = notifications_collection.find_one(
+            {"user_id": user_id, "type": notification_type, "dedupe_key": key, "created_at": {"$gte": since}},
+            {"created_at": 1},
+            sort=[("created_at", -1)]
+        )
+        return stored["created_at"] if stored else None
+
+    def emit(self, notification: dict, key: str = "") -> dict | None:
+        """
+        Queue a notification unless an identical one was emitted within the
+        cooldown for its type. Returns the notification as the API serves it
+        (with "id"), or None if it was suppressed.
+        """
+        notification_type = notification["type"]
+        dedupe = (notification["user_id"], notification_type, key)
+        cooldown = timedelta(seconds=COOLDOWNS.get(notification_type, 0))
+        now = datetime.utcnow()
+
+        if cooldown:
+            with self._lock:
+                cooling_until = self._cooling.get(dedupe)
+            if cooling_until is None:
+                # First time this worker sees the key: check what is already stored
+                stored_at = self._stored_within(dedupe, now - cooldown)
+                cooling_until = stored_at + cooldown if stored_at else now
+                with self._lock:
+                    self._cooling.setdefault(dedupe, cooling_until)
+
+        with self._lock:
+            if cooldown and self._cooling.get(dedupe, now) > now:
+                metrics.increment("notifications_suppressed", type=notification_type)
+                return None
+            if cooldown:
+                self._cooling[dedupe] = now + cooldown
+
+            notification.update({"_id": ObjectId(), "dedupe_key": key, "created_at": now})
+            self._pending.append(notification)
+            flush_now = len(self._pending) >= FLUSH_BATCH_SIZE
+
+        metrics.increment("notifications_emitted", type=notification_type)
+        if flush_now:
+            self.flush()
+
+        return serialize_notification(dict(notification))
+
+    def _requeue(self, notifications: list, error: Exception):
+        print(f"Notification flush failed, keeping {len(notifications)} for retry: {error}")
+        metrics.increment("notification_flush_errors")
+        with self._lock:
+            self._pending = (notifications + self._pending)[-MAX_PENDING:]
+
+    def flush(self) -> int:
+        """Write everything pending in batches. Returns the number written."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            # Forget expired cooldowns so the map stays bounded
+            now = datetime.utcnow()
+            self._cooling = {dedupe: until for dedupe, until in self._cooling.items() if until > now}
+
+        written = 0
+        for start in range(0, len(pending), FLUSH_BATCH_SIZE):
+            batch = pending[start:start + FLUSH_BATCH_SIZE]
+            try:
+                stamps = sync_stamps(notification["user_id"] for notification in batch)
+                for notification in batch:
+                    notification.update(stamps[notification["user_id"]])
+                    # Unlike sync_seq, kept when the notification is later updated
+                    notification["stream_seq"] = notification["sync_seq"]
+                notifications_collection.insert_many(batch, ordered=False)
+            except BulkWriteError as e:
+                # Duplicate ids are notifications a failed flush already wrote
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]) or e.details["writeConcernErrors"]:
+                    self._requeue(pending[start:], e)
+                    break
+            except PyMongoError as e:
+                self._requeue(pending[start:], e)
+                break
+            written += len(batch)
+            metrics.increment("notification_flush_batches")
+            if STREAM_SOURCE == "outbox":
+                # Only once stored, so a stream resuming from Mongo never misses them
+                hub.publish(batch)
+
+        if written:
+            metrics.increment("notifications_flushed", written)
+            try:
+                bump_data_versions(notification["user_id"] for notification in pending[:written])
+            except PyMongoError as e:
+                # Cached responses then stay valid until their version TTL
+                print(f"Bumping data versions after a notification flush failed: {e}")
+        metrics.set_gauge("notification_outbox_pending", len(self._pending))
+        return written
+
+
+outbox = NotificationOutbox()
@@ -0,0 +1,131 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
+import metrics
+from auth import ACCESS_TOKEN_EXPIRE_DAYS
+from database import admins_collection, users_collection, revoked_tokens_collection
+
+# Seconds a subject's role and status are trusted before they are read again.
+# Status changes made on this worker apply at once; other workers see them
+# through the revocation poll, which also drops their cached entry.
+PRINCIPAL_TTL = float(os.getenv("TOEPWAR_PRINCIPAL_TTL", "30"))
+
+# Seconds between polls of revoked_tokens by each worker
+REVOCATION_POLL_INTERVAL = float(os.getenv("TOEPWAR_REVOCATION_POLL_INTERVAL", "2"))
+
+# Re-read this much of the revocation history on every poll, so a write with
+# a slightly older updated_at from another worker's clock is not missed
+POLL_OVERLAP = timedelta(seconds=5)
+
+ROLE_ADMIN = "admin"
+ROLE_USER = "user"
+INACTIVE_STATUSES = ("suspended", "banned")
+
+
+class PrincipalCache:
+    """
+    Role and status per token subject, and the subjects whose tokens were
+    revoked, held in memory so authorizing a request doesn't touch Mongo.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (role, subject) -> (monotonic expiry, principal or None if not found)
+        self._entries = {}
+        # subject -> epoch seconds; tokens issued before it are rejected
+        self._revoked = {}
+        self._polled_until = None
+
+    def _load(self, role: str, subject: str) -> dict | None:
+        try:
+            object_id = ObjectId(subject)
+        except InvalidId:
+            return None
+        if role == ROLE_ADMIN:
+            admin = admins_collection.find_one({"_id": object_id}, {"role": 1})
+            if not admin or admin.get("role") != ROLE_ADMIN:
+                return None
+            return {"id": subject, "role": ROLE_ADMIN, "status": "active"}
+        user = users_collection.find_one({"_id": object_id}, {"status": 1})
+        if not user:
+            return None
+        return {"id": subject, "role": ROLE_USER, "status": user.get("status", "active")}
+
+    def get(self, role: str, subject: str) -> dict | None:
+        """The principal behind a token's role claim and subject, or None if it no longer exists"""
+        key = (role, subject)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] > now:
+            metrics.increment("principal_cache_hits")
+            return entry[1]
+
+        metrics.increment("principal_cache_misses")
+        principal = self._load(role, subject)
+        with self._lock:
+            self._entries[key] = (now + PRINCIPAL_TTL, principal)
+        return principal
+
+    def invalidate(self, subject: str):
+        with self._lock:
+            self._entries.pop((ROLE_USER, subject), None)
+            self._entries.pop((ROLE_ADMIN, subject), None)
+
+    def is_revoked(self, subject: str, issued_at: int | None) -> bool:
+        revoked_before = self._revoked.get(subject)
+        # Tokens from before iat was added can't be dated, so a revocation covers them
+        return revoked_before is not None and (issued_at is None or issued_at < revoked_before)
+
+    def revoke(self, subject: str):
+        """Reject every token issued to `subject` so far, on all workers within a poll interval"""
+        now = datetime.utcnow()
+        # Whole seconds like iat, rounded up so a token from this second is covered too
+        revoked_before = int(time.time()) + 1
+        revoked_tokens_collection.update_one(
+            {"_id": subject},
+            {"$set": {
+                "revoked_before": revoked_before,
+                "updated_at": now,
+                "expires_at": now + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
+            }},
+            upsert=True
+        )
+        with self._lock:
+            self._revoked[subject] = revoked_before
+        self.invalidate(subject)
+
+    def refresh_revocations(self) -> int:
+        """Load revocations written since the last poll. Returns how many were seen."""
+        started = datetime.utcnow()
+        query = {}
+        if self._polled_until is not None:
+            query["updated_at"] = {"$gt": self._polled_until - POLL_OVERLAP}
+        revocations = list(revoked_tokens_collection.find(query, {"revoked_before": 1}))
+
+        now = time.time()
+        with self._lock:
+            for revocation in revocations:
+                subject = revocation["_id"]
+                if self._revoked.get(subject) != revocation["revoked_before"]:
+                    self._revoked[subject] = revocation["revoked_before"]
+                    # The status probably changed with it
+                    self._entries.pop((ROLE_USER, subject), None)
+                    self._entries.pop((ROLE_ADMIN, subject), None)
+            # Tokens older than their lifetime are rejected by their exp anyway
+            oldest = now - ACCESS_TOKEN_EXPIRE_DAYS * 86400
+            self._revoked = {subject: before for subject, before in self._revoked.items() if before > oldest}
+            now_monotonic = time.monotonic()
+            self._entries = {key: entry for key, entry in self._entries.items() if entry[0] > now_monotonic}
+            revoked_count, cached_count = len(self._revoked), len(self._entries)
+
+        self._polled_until = started
+        metrics.set_gauge("revoked_subjects", revoked_count)
+        metrics.set_gauge("principal_cache_entries", cached_count)
+        return len(revocations)
+
+
+principals = PrincipalCache()
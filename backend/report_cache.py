@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import metrics
+
+# Rendered reports kept on local disk, shared by the workers on a host.
+# Least recently served files are removed once the total passes the limit.
+CACHE_DIR = os.getenv("TOEPWAR_REPORT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "toepwar_report_cache")
+CACHE_MAX_BYTES = int(os.getenv("TOEPWAR_REPORT_CACHE_BYTES", str(512 * 1024 * 1024)))
+
+
+def cache_key(user_id: str, report_format: str, version: int, start_date: str | None, end_date: str | None) -> str:
+    """
+    Content address of a report: the same user, period, format and data
+    version always render the same figures. A report without an end date
+    runs to "now", so it is keyed by the day and re-rendered daily.
+    """
+    end = end_date or f"open:{datetime.utcnow().date().isoformat()}"
+    raw = json.dumps([user_id, report_format, version, start_date or "", end])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ReportCache:
+    """
+    Files named by their cache key, with an LRU index by total bytes.
+    Each worker keeps its own index of the shared directory, seeded from the
+    files' modification times, which a hit refreshes.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # file name -> size, least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._lookups = 0
+        self._loaded = False
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._bytes += size
+        self._loaded = True
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def get(self, key: str, extension: str, report_format: str) -> str | None:
+        """Path of the cached report, or None"""
+        name = key + extension
+        path = self._path(name)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._lookups += 1
+            try:
+                # Also finds files another worker stored; touching keeps them recent for everyone
+                os.utime(path)
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                if name in self._entries:
+                    self._bytes -= self._entries.pop(name)
+                path = None
+            else:
+                if name not in self._entries:
+                    self._bytes += size
+                self._entries[name] = size
+                self._entries.move_to_end(name)
+                self._hits += 1
+            hit_ratio = self._hits / self._lookups
+
+        metrics.set_gauge("report_cache_hit_ratio", hit_ratio)
+        if path is None:
+            metrics.increment("report_cache_misses", format=report_format)
+        else:
+            metrics.increment("report_cache_hits", format=report_format)
+            metrics.increment("report_cache_bytes_served", size, format=report_format)
+        return path
+
+    def put(self, key: str, extension: str, rendered_path: str) -> str:
+        """Move a freshly rendered file into the cache. Returns its cached path."""
+        name = key + extension
+        path = self._path(name)
+        with self._lock:
+            if not self._loaded:
+                self._load()
+        # Moved under a dot name first so readers never see a partial file
+        staging = self._path(f".{name}.{os.getpid()}.{threading.get_ident()}")
+        shutil.move(rendered_path, staging)
+        os.replace(staging, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._bytes += size - self._entries.get(name, 0)
+            self._entries[name] = size
+            self._entries.move_to_end(name)
+            evicted = self._evict(keep=name)
+            total, count = self._bytes, len(self._entries)
+
+        if evicted:
+            metrics.increment("report_cache_evictions", evicted)
+        metrics.set_gauge("report_cache_bytes", total)
+        metrics.set_gauge("report_cache_entries", count)
+        return path
+
+    def _evict(self, keep: str) -> int:
+        """Remove least recently used files until under the limit. Call with the lock held."""
+        evicted = 0
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = next(iter(self._entries.items()))
+            if name == keep:
+                self._entries.move_to_end(name)
+                continue
+            del self._entries[name]
+            self._bytes -= size
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass  # Already evicted by another worker
+            evicted += 1
+        return evicted
+
+
+report_cache = ReportCache(CACHE_DIR, CACHE_MAX_BYTES)
@@ -0,0 +1,420 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from fastapi import HTTPException
+import metrics
+
+# Reports rendered at once per API worker, each in its own process so a
+# large export never holds the event loop. Requests beyond that wait, up to
+# REPORT_MAX_QUEUE of them; the rest get 503 with Retry-After.
+REPORT_WORKERS = int(os.getenv("TOEPWAR_REPORT_WORKERS", str(min(2, os.cpu_count() or 1))))
+REPORT_MAX_QUEUE = int(os.getenv("TOEPWAR_REPORT_MAX_QUEUE", "32"))
+
+# Rendered files are written here and removed once sent
+REPORT_TMPDIR = os.getenv("TOEPWAR_REPORT_TMPDIR") or None
+
+# Transactions fetched per round trip while the ledger sheet is written
+LEDGER_BATCH_SIZE = 5000
+# Width of a datetime cell in Excel's default format, yyyy-mm-dd h:mm:ss
+DATE_WIDTH = 19
+
+# openpyxl and reportlab are imported only in the pool processes, never in
+# the API worker: the functions below run there and import them on first use.
+
+
+class _ColumnWidths:
+    """Running maximum of the text length in each column, updated row by row"""
+
+    def __init__(self, lengths=()):
+        self.lengths = list(lengths)
+
+    def update(self, values):
+        for index, value in enumerate(values):
+            length = len(str(value)) if value is not None else 0
+            if index >= len(self.lengths):
+                self.lengths.append(length)
+            elif length > self.lengths[index]:
+                self.lengths[index] = length
+
+    def apply(self, ws):
+        from openpyxl.utils import get_column_letter
+        for index, length in enumerate(self.lengths, 1):
+            ws.column_dimensions[get_column_letter(index)].width = length + 2
+
+
+def _summary_rows(report_data):
+    """Rows of the Financial Report sheet as (values, style), style being None, "title" or "header" """
+    summary = report_data['summary']
+    rows = [
+        (["Report Period", f"{summary['period_start']} to {summary['period_end']}"], None),
+        ([], None),
+        (["Summary"], "title"),
+        (['Metric', 'Amount'], "header"),
+        (['Total Income', summary['total_income']], None),
+        (['Total Expenses', summary['total_expense']], None),
+        (['Net Income', summary['net_income']], None),
+        (['Savings Rate', f"{summary['savings_rate']:.2f}%"], None),
+        (["Income Breakdown"], "title"),
+        (['Category', 'Amount'], "header"),
+    ]
+    rows += [([income['category'], income['amount']], None) for income in report_data['income_by_category']]
+    rows += [([], None), (["Expense Breakdown"], "title"), (['Category', 'Amount'], "header")]
+    rows += [([expense['category'], expense['amount']], None) for expense in report_data['expense_by_category']]
+    rows += [([], None), (["Goals Summary"], "title"), (['Goal', 'Target Amount', 'Current Amount', 'Progress'], "header")]
+    rows += [
+        ([goal['name'], goal['target_amount'], goal['current_amount'], f"{goal['progress']:.2f}%"], None)
+        for goal in report_data['goals_summary']
+    ]
+    return rows
+
+
+LEDGER_HEADERS = ['Date', 'Type', 'Category', 'Amount']
+
+
+def create_financial_report_excel(report_data, output, transactions=None, ledger_widths=None):
+    """
+    Write the report to `output`, a path or binary file, as a write-only
+    workbook: rows go to disk as they are appended, so memory stays flat
+    however many there are. With `transactions`, an iterable of transaction
+    documents in date order, a Transactions sheet lists every one of them.
+    Write-only sheets need their column widths before the first row, so the
+    ledger's come from `ledger_widths`, the longest text in each column.
+    """
+    # Imported in the render process on its first export
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import PatternFill, Font
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Financial Report")
+
+    # Set headers style
+    header_fill = PatternFill(start_color="366092", end_color="366092", fill_type="solid")
+    header_font = Font(color="FFFFFF", bold=True)
+    title_font = Font(bold=True, size=12)
+
+    def styled(values, style):
+        if style is None:
+            return values
+        cells = []
+        for value in values:
+            cell = WriteOnlyCell(ws, value=value)
+            if style == "header":
+                cell.fill = header_fill
+                cell.font = header_font
+            else:
+                cell.font = title_font
+            cells.append(cell)
+        return cells
+
+    rows = _summary_rows(report_data)
+    widths = _ColumnWidths()
+    for values, _ in rows:
+        widths.update(values)
+    widths.apply(ws)
+    for values, style in rows:
+        ws.append(styled(values, style))
+
+    if transactions is not None:
+        ws = wb.create_sheet("Transactions")
+        widths = _ColumnWidths(
+            max(len(header), width) for header, width in zip(LEDGER_HEADERS, ledger_widths or [0] * len(LEDGER_HEADERS))
+        )
+        widths.apply(ws)
+        ws.append(styled(LEDGER_HEADERS, "header"))
+        # Rows are serialized on append, so one styled cell serves every row
+        amount = WriteOnlyCell(ws)
+        amount.number_format = '#,##0.00'
+        for transaction in transactions:
+            amount.value = float(transaction['amount'])
+            ws.append([transaction['date'], transaction['type'], transaction['category'], amount])
+
+    wb.save(output)
+
+
+def create_financial_report_pdf(report_data, output):
+    # Imported in the render process on its first export
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.units import inch
+
+    doc = SimpleDocTemplate(output, pagesize=letter)
+    story = []
+    styles = getSampleStyleSheet()
+    
+    # Title
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        spaceAfter=30
+    )
+    story.append(Paragraph("Financial Report", title_style))
+    
+    # Period
+    period_text = f"Report Period: {report_data['summary']['period_start']} to {report_data['summary']['period_end']}"
+    story.append(Paragraph(period_text, styles['Normal']))
+    story.append(Spacer(1, 20))
+    
+    # Summary Section
+    story.append(Paragraph("Summary", styles['Heading2']))
+    summary_data = [
+        ['Metric', 'Amount'],
+        ['Total Income', f"K{report_data['summary']['total_income']:,.2f}"],
+        ['Total Expenses', f"K{report_data['summary']['total_expense']:,.2f}"],
+        ['Net Income', f"K{report_data['summary']['net_income']:,.2f}"],
+        ['Savings Rate', f"{report_data['summary']['savings_rate']:.2f}%"]
+    ]
+    
+    summary_table = Table(summary_data, colWidths=[2*inch, 2*inch])
+    summary_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 1), (-1, -1), 12),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(summary_table)
+    story.append(Spacer(1, 20))
+    
+    # Income Breakdown
+    story.append(Paragraph("Income Breakdown", styles['Heading2']))
+    income_data = [['Category', 'Amount']]
+    for income in report_data['income_by_category']:
+        income_data.append([
+            income['category'],
+            f"K{income['amount']:,.2f}"
+        ])
+    
+    income_table = Table(income_data, colWidths=[2*inch, 2*inch])
+    income_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.green),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.lightgreen),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(income_table)
+    story.append(Spacer(1, 20))
+    
+    # Expense Breakdown
+    story.append(Paragraph("Expense Breakdown", styles['Heading2']))
+    expense_data = [['Category', 'Amount']]
+    for expense in report_data['expense_by_category']:
+        expense_data.append([
+            expense['category'],
+            f"K{expense['amount']:,.2f}"
+        ])
+    
+    expense_table = Table(expense_data, colWidths=[2*inch, 2*inch])
+    expense_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.red),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 14),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.pink),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    story.append(expense_table)
+    story.append(Spacer(1, 20))
+    
+    # Goals Summary
+    if report_data['goals_summary']:
+        story.append(Paragraph("Goals Summary", styles['Heading2']))
+        goals_data = [['Goal', 'Target', 'Current', 'Progress']]
+        for goal in report_data['goals_summary']:
+            goals_data.append([
+                goal['name'],
+                f"K{goal['target_amount']:,.2f}",
+                f"K{goal['current_amount']:,.2f}",
+                f"{goal['progress']:.2f}%"
+            ])
+        
+        goals_table = Table(goals_data, colWidths=[1.5*inch, 1.5*inch, 1.5*inch, 1.5*inch])
+        goals_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.blue),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 14),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.lightblue),
+            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        story.append(goals_table)
+    
+    # Build PDF
+    doc.build(story)
+
+
+def _ledger(user_id: str, report_data: dict):
+    """
+    Cursor over the transactions in the report period, in date order and
+    fetched LEDGER_BATCH_SIZE at a time, with the ledger's column widths
+    from one aggregation over the same range.
+    """
+    # Only render processes that build a ledger open a Mongo connection
+    from database import transactions_collection
+
+    query = {
+        "user_id": user_id,
+        "date": {
+            "$gte": datetime.fromisoformat(report_data['summary']['period_start']),
+            "$lte": datetime.fromisoformat(report_data['summary']['period_end'])
+        }
+    }
+    longest = list(transactions_collection.aggregate([
+        {"$match": query},
+        {
+            "$group": {
+                "_id": None,
+                "type": {"$max": {"$strLenCP": {"$toString": "$type"}}},
+                "category": {"$max": {"$strLenCP": {"$toString": "$category"}}},
+                "amount": {"$max": {"$abs": {"$toDouble": "$amount"}}}
+            }
+        }
+    ]))
+    widths = [DATE_WIDTH, 0, 0, 0]
+    if longest:
+        widths[1:] = [longest[0]["type"] or 0, longest[0]["category"] or 0, len(f"{longest[0]['amount'] or 0:,.2f}")]
+
+    transactions = transactions_collection.find(
+        query, {"_id": 0, "date": 1, "type": 1, "category": 1, "amount": 1}
+    ).sort([("date", 1), ("_id", 1)]).batch_size(LEDGER_BATCH_SIZE)
+    return transactions, widths
+
+
+def _render_to_file(write, suffix: str) -> str:
+    fd, path = tempfile.mkstemp(prefix="toepwar_report_", suffix=suffix, dir=REPORT_TMPDIR)
+    try:
+        with os.fdopen(fd, "wb") as output:
+            write(output)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def render_excel(report_data: dict, user_id: str | None = None) -> str:
+    """Render to a temporary .xlsx file, with the transaction ledger if a user is given. Returns its path."""
+    def write(output):
+        if user_id is None:
+            create_financial_report_excel(report_data, output)
+        else:
+            transactions, widths = _ledger(user_id, report_data)
+            create_financial_report_excel(report_data, output, transactions, widths)
+    return _render_to_file(write, ".xlsx")
+
+
+def render_pdf(report_data: dict, user_id: str | None = None) -> str:
+    """Render to a temporary .pdf file. Returns its path."""
+    return _render_to_file(lambda output: create_financial_report_pdf(report_data, output), ".pdf")
+
+
+def _import_renderers() -> int:
+    import openpyxl, reportlab.platypus  # noqa: F401
+    return os.getpid()
+
+
+RENDERERS = {"xlsx": render_excel, "pdf": render_pdf}
+
+_executor = None
+_slots = None
+_queued = 0
+_active = 0
+
+
+def _pool() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn, not fork: forking would copy the Mongo clients and event loop
+        _executor = ProcessPoolExecutor(max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _discard_rendered(future):
+    if not future.cancelled() and future.exception() is None:
+        os.remove(future.result())
+
+
+def _update_gauges():
+    metrics.set_gauge("report_render_queued", _queued)
+    metrics.set_gauge("report_render_active", _active)
+
+
+async def render_report(report_format: str, report_data: dict, user_id: str | None = None) -> str:
+    """
+    Render a report in the process pool, waiting for a free slot. Returns
+    the path of the rendered file, which the caller takes over.
+    """
+    global _slots, _queued, _active
+    if _slots is None:
+        _slots = asyncio.Semaphore(REPORT_WORKERS)
+    if _queued >= REPORT_MAX_QUEUE:
+        metrics.increment("report_render_rejected", format=report_format)
+        raise HTTPException(status_code=503, detail="Too many reports being generated, try again shortly",
+                            headers={"Retry-After": "5"})
+
+    _queued += 1
+    _update_gauges()
+    try:
+        await _slots.acquire()
+    finally:
+        _queued -= 1
+
+    _active += 1
+    _update_gauges()
+    started = time.perf_counter()
+    try:
+        future = asyncio.get_running_loop().run_in_executor(_pool(), RENDERERS[report_format], report_data, user_id)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The client went away; remove the file once the render finishes
+            future.add_done_callback(_discard_rendered)
+            raise
+    except BrokenProcessPool:
+        # A render process died (e.g. killed for memory); start a fresh pool for the next request
+        shutdown()
+        metrics.increment("report_render_errors", format=report_format)
+        raise HTTPException(status_code=500, detail="Report rendering failed")
+    finally:
+        _active -= 1
+        _slots.release()
+        _update_gauges()
+        metrics.increment("report_renders", format=report_format)
+        metrics.increment("report_render_seconds", time.perf_counter() - started, format=report_format)
+
+
+def warm_pool() -> list:
+    """Start every render process and import the renderers in it. Returns their pids."""
+    futures = [_pool().submit(_import_renderers) for _ in range(REPORT_WORKERS)]
+    return sorted({future.result() for future in futures})
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
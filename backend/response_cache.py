@@ -0,0 +1,226 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from fastapi import Response
+from fastapi.encoders import jsonable_encoder
+import metrics
+
+# Where cached responses and users' data versions live:
+#   unset           - in this worker's memory, bounded by RESPONSE_CACHE_BYTES
+#   redis://host... - a Redis-compatible server shared by every worker
+#   off             - no caching
+RESPONSE_CACHE_URL = os.getenv("TOEPWAR_RESPONSE_CACHE_URL", "")
+RESPONSE_CACHE_BYTES = int(os.getenv("TOEPWAR_RESPONSE_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+# Seconds a cached response is kept. A write moves the user to a new data
+# version, so older entries are unreachable and only wait to be evicted.
+RESPONSE_TTL = int(os.getenv("TOEPWAR_RESPONSE_CACHE_TTL", "3600"))
+
+# Seconds a user's data version is trusted without reading data_versions.
+# Writes through this code update it at once; this bounds how long a write
+# made elsewhere (another worker with the in-process cache, or a script)
+# goes unseen. With several workers and no Redis, keep it short or set 0.
+VERSION_TTL = int(os.getenv(
+    "TOEPWAR_RESPONSE_CACHE_VERSION_TTL",
+    "300" if RESPONSE_CACHE_URL.startswith(("redis://", "rediss://")) else "5"
+))
+
+
+class LocalBackend:
+    """In-process LRU bounded by the total size of the cached bodies"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (monotonic expiry, body, route), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # user_id -> (monotonic expiry, version)
+        self._versions = {}
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._bytes -= len(self._entries.pop(key)[1])
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, body: bytes, ttl: int, route: str):
+        evicted = {}
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[1])
+            self._entries[key] = (time.monotonic() + ttl, body, route)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, old_body, old_route) = self._entries.popitem(last=False)
+                self._bytes -= len(old_body)
+                evicted[old_route] = evicted.get(old_route, 0) + 1
+            total, count = self._bytes, len(self._entries)
+
+        for evicted_route, evictions in evicted.items():
+            metrics.increment("response_cache_evictions", evictions, route=evicted_route)
+        metrics.set_gauge("response_cache_bytes", total)
+        metrics.set_gauge("response_cache_entries", count)
+
+    def get_version(self, user_id: str) -> int | None:
+        entry = self._versions.get(user_id)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def set_version(self, user_id: str, version: int, ttl: int):
+        """Store a version unless a newer one is already known"""
+        with self._lock:
+            entry = self._versions.get(user_id)
+            if entry is not None and entry[0] > time.monotonic() and entry[1] > version:
+                return
+            self._versions[user_id] = (time.monotonic() + ttl, version)
+            if len(self._versions) > 100000:
+                now = time.monotonic()
+                self._versions = {user: entry for user, entry in self._versions.items() if entry[0] > now}
+
+
+class RedisBackend:
+    """
+    Entries in a Redis-compatible server, shared by every worker and kept
+    within bounds by the server's own maxmemory policy and the TTLs.
+    Errors count as misses, so an outage only costs the cache.
+    """
+
+    def __init__(self, url: str):
+        # Only needed when configured
+        import redis
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self._errors = redis.RedisError
+
+    def _failed(self, e: Exception):
+        print(f"Response cache error: {e}")
+        metrics.increment("response_cache_errors")
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            return self._client.get(key)
+        except self._errors as e:
+            self._failed(e)
+            return None
+
+    def set(self, key: str, body: bytes, ttl: int, route: str):
+        try:
+            self._client.set(key, body, ex=ttl)
+        except self._errors as e:
+            self._failed(e)
+
+    def get_version(self, user_id: str) -> int | None:
+        value = self.get(f"version:{user_id}")
+        return int(value) if value is not None else None
+
+    def set_version(self, user_id: str, version: int, ttl: int):
+        """Store a version unless a newer one is already known, atomically under WATCH"""
+        key = f"version:{user_id}"
+
+        def update(pipe):
+            current = pipe.get(key)
+            if current is not None and int(current) > version:
+                return
+            pipe.multi()
+            pipe.set(key, version, ex=ttl)
+
+        try:
+            self._client.transaction(update, key)
+        except self._errors as e:
+            self._failed(e)
+
+
+def _create_backend():
+    if RESPONSE_CACHE_URL == "off":
+        return None
+    if RESPONSE_CACHE_URL:
+        return RedisBackend(RESPONSE_CACHE_URL)
+    return LocalBackend(RESPONSE_CACHE_BYTES)
+
+
+cache_backend = _create_backend()
+
+# Whether a version read from the cache reflects writes made by every
+# worker, rather than only this one's until VERSION_TTL runs out
+VERSIONS_SHARED = isinstance(cache_backend, RedisBackend)
+
+
+def _cache_key(route: str, user_id: str, version: int, params: dict) -> str:
+    digest = hashlib.sha1(json.dumps(jsonable_encoder(params), sort_keys=True).encode()).hexdigest()
+    return f"response:{route}:{user_id}:{version}:{digest}"
+
+
+def _encode(result) -> bytes:
+    # Same rendering as FastAPI's JSONResponse
+    return json.dumps(
+        jsonable_encoder(result), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _response(body: bytes, status: str, kwargs: dict) -> Response:
+    response = Response(content=body, media_type="application/json", headers={"X-Cache": status})
+    # Returning a Response skips FastAPI's merge of headers set by dependencies, such as the ETag
+    if "response" in kwargs:
+        response.headers.update(kwargs["response"].headers)
+    return response
+
+
+def _lookup(route: str, kwargs: dict) -> tuple:
+    # Imported here: data_version reads and publishes versions through this module
+    from data_version import get_cached_data_version
+    user_id = kwargs["user_id"]
+    params = {name: value for name, value in kwargs.items() if name not in ("user_id", "response")}
+    key = _cache_key(route, user_id, get_cached_data_version(user_id), params)
+    body = cache_backend.get(key)
+    metrics.increment("response_cache_hits" if body is not None else "response_cache_misses", route=route)
+    return body, key
+
+
+def _store(route: str, key: str, result) -> bytes:
+    body = _encode(result)
+    cache_backend.set(key, body, RESPONSE_TTL, route)
+    return body
+
+
+def cached_route(route: str):
+    """
+    Cache a route's JSON response per user and data version. The route must
+    take `user_id`; its other arguments, except a `response` whose headers
+    are copied to the cached one, are part of the cache key. The
+    version is read before the route runs, so a write racing it leaves the
+    result under the older version.
+    """
+    def decorator(endpoint):
+        if cache_backend is None:
+            return endpoint
+
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def cached_endpoint(**kwargs):
+                body, key = await asyncio.to_thread(_lookup, route, kwargs)
+                if body is not None:
+                    return _response(body, "hit", kwargs)
+                result = await endpoint(**kwargs)
+                return _response(await asyncio.to_thread(_store, route, key, result), "miss", kwargs)
+        else:
+            @functools.wraps(endpoint)
+            def cached_endpoint(**kwargs):
+                body, key = _lookup(route, kwargs)
+                if body is not None:
+                    return _response(body, "hit", kwargs)
+                return _response(_store(route, key, endpoint(**kwargs)), "miss", kwargs)
+
+        return cached_endpoint
+    return decorator
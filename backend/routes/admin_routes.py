@@ -1,12 +1,15 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
 from pydantic import BaseModel
 from admin_schemas import AdminLogin, AdminResponse, AdminSignUp, UserListResponse, UserStatusUpdate
-from database import admins_collection, users_collection
+from async_database import admins_collection, users_collection
 from utils import get_current_admin
 from auth import hash_password, verify_password, create_access_token
 from bson import ObjectId
 from datetime import datetime
 from typing import List
+import metrics
+from principals import INACTIVE_STATUSES, ROLE_ADMIN, principals
 
 router = APIRouter()
 
@@ -21,7 +24,7 @@ async def admin_signup(admin: AdminSignUp):
         )
     
     # Check if admin already exists
-    if admins_collection.find_one({"email": admin.email, "role": "admin"}):
+    if await admins_collection.find_one({"email": admin.email, "role": "admin"}):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Admin already exists"
@@ -36,13 +39,13 @@ async def admin_signup(admin: AdminSignUp):
         "created_at": datetime.utcnow()
     }
     
-    result = admins_collection.insert_one(admin_doc)
+    result = await admins_collection.insert_one(admin_doc)
     admin_doc["id"] = str(result.inserted_id)
     return admin_doc
 
 @router.post("/login")
 async def admin_login(admin: AdminLogin):
-    admin_doc = admins_collection.find_one({
+    admin_doc = await admins_collection.find_one({
         "email": admin.email,
         "role": "admin"
     })
@@ -53,7 +56,7 @@ async def admin_login(admin: AdminLogin):
             detail="Invalid credentials"
         )
     
-    access_token = create_access_token({"sub": str(admin_doc["_id"]), "role": "admin"})
+    access_token = create_access_token({"sub": str(admin_doc["_id"]), "role": ROLE_ADMIN})
     return {"access_token": access_token, "token_type": "bearer"}
 
 # User management routes
@@ -68,12 +71,12 @@ async def get_all_users(admin: str = Depends(get_current_admin)):
             "status": user.get("status", "active"),
             "created_at": user["created_at"].strftime("%Y-%m-%d %H:%M:%S")
         }
-        for user in users
+        async for user in users
     ]
 
 @router.get("/users/{user_id}")
 async def get_user_details(user_id: str, admin: str = Depends(get_current_admin)):
-    user = users_collection.find_one({"_id": ObjectId(user_id)})
+    user = await users_collection.find_one({"_id": ObjectId(user_id)})
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -101,7 +104,7 @@ async def update_user_status(
             detail="Invalid status. Must be one of: active, suspended, banned"
         )
     
-    result = users_collection.update_one(
+    result = await users_collection.update_one(
         {"_id": ObjectId(user_id)},
         {"$set": {"status": status_update.status}}
     )
@@ -111,17 +114,29 @@ async def update_user_status(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
+
+    # Sign the user out everywhere on suspension or ban; any change drops the cached status
+    if status_update.status in INACTIVE_STATUSES:
+        await asyncio.to_thread(principals.revoke, user_id)
+    else:
+        principals.invalidate(user_id)
     
     return {"message": f"User status updated to {status_update.status}"}
 
 @router.delete("/users/{user_id}")
 async def delete_user(user_id: str, admin: str = Depends(get_current_admin)):
-    result = users_collection.delete_one({"_id": ObjectId(user_id)})
+    result = await users_collection.delete_one({"_id": ObjectId(user_id)})
     
     if result.deleted_count == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
+    await asyncio.to_thread(principals.revoke, user_id)
     
     return {"message": "User deleted successfully"}
+
+# Operational counters of this worker, e.g. notifications emitted and suppressed per type
+@router.get("/metrics")
+async def get_metrics(admin: str = Depends(get_current_admin)):
+    return metrics.snapshot()
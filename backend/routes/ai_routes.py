@@ -1,11 +1,9 @@
 from fastapi import APIRouter, HTTPException, Query, Depends
 from fastapi.responses import JSONResponse
-from database import transactions_collection, goals_collection
+from database import goals_collection
+from ledger import get_rollups
 from utils import get_current_user
 from datetime import datetime, timedelta
-from sklearn.linear_model import LinearRegression
-import numpy as np
-import pandas as pd
 
 router = APIRouter()
 
@@ -311,48 +309,15 @@ def get_financial_forecast(
     language: str = Query(default='en', regex='^(en|my)$')
 ):
     try:
-        # Get historical transactions
-        transactions = list(transactions_collection.find({"user_id": user_id}))
-        if not transactions:
+        # Monthly sums per (type, category); cost scales with months, not transactions
+        rollups = get_rollups(user_id)
+        if not rollups:
             raise HTTPException(status_code=404, detail="No transaction history found")
 
-        # Convert to DataFrame
-        df = pd.DataFrame(transactions)
-        df['date'] = pd.to_datetime(df['date'])
-        df['amount'] = df['amount'].astype(float)
-
-        # Separate income and expenses
-        income_df = df[df['type'] == 'income'].copy()
-        expense_df = df[df['type'] == 'expense'].copy()
-
-        # Group by month
-        monthly_income = income_df.groupby(pd.Grouper(key='date', freq='M'))['amount'].sum().reset_index()
-        monthly_expenses = expense_df.groupby(pd.Grouper(key='date', freq='M'))['amount'].sum().reset_index()
-
-        # Prepare data for forecasting
-        income_forecast = forecast_time_series(monthly_income, forecast_months)
-        expense_forecast = forecast_time_series(monthly_expenses, forecast_months)
-        
-        # Get category-wise forecasts
-        income_categories = income_df['category'].unique()
-        expense_categories = expense_df['category'].unique()
-        
-        category_forecasts = {
-            'income': {},
-            'expense': {}
-        }
-        
-        # Forecast for each income category
-        for category in income_categories:
-            cat_data = income_df[income_df['category'] == category]
-            monthly_cat = cat_data.groupby(pd.Grouper(key='date', freq='M'))['amount'].sum().reset_index()
-            category_forecasts['income'][category] = forecast_time_series(monthly_cat, forecast_months)
-            
-        # Forecast for each expense category
-        for category in expense_categories:
-            cat_data = expense_df[expense_df['category'] == category]
-            monthly_cat = cat_data.groupby(pd.Grouper(key='date', freq='M'))['amount'].sum().reset_index()
-            category_forecasts['expense'][category] = forecast_time_series(monthly_cat, forecast_months)
+        # Totals and every category are fitted together in one batch.
+        # forecasting pulls in numpy, so it is imported on first use (or at warm-up)
+        from forecasting import forecast_rollups
+        income_forecast, expense_forecast, category_forecasts = forecast_rollups(rollups, forecast_months)
 
         # Calculate savings forecast
         savings_forecast = []
@@ -406,42 +371,6 @@ def get_financial_forecast(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Forecast calculation failed: {str(e)}")
 
-def forecast_time_series(data: pd.DataFrame, forecast_months: int):
-    if len(data) < 2:
-        # Not enough data for forecasting, return simple projection
-        if len(data) == 0:
-            avg_amount = 0
-        else:
-            avg_amount = data['amount'].mean()
-        
-        future_dates = [datetime.now() + timedelta(days=30*i) for i in range(forecast_months)]
-        return [{'date': date.isoformat(), 'amount': avg_amount} for date in future_dates]
-
-    # Prepare features (X) and target (y)
-    X = np.arange(len(data)).reshape(-1, 1)
-    y = data['amount'].values
-
-    # Fit linear regression model
-    model = LinearRegression()
-    model.fit(X, y)
-
-    # Generate future dates
-    last_date = data['date'].iloc[-1]
-    future_dates = [last_date + timedelta(days=30*i) for i in range(1, forecast_months + 1)]
-    
-    # Predict future values
-    future_X = np.arange(len(data), len(data) + forecast_months).reshape(-1, 1)
-    predictions = model.predict(future_X)
-    
-    # Ensure no negative predictions for amounts
-    predictions = np.maximum(predictions, 0)
-
-    # Format results
-    return [
-        {'date': date.isoformat(), 'amount': float(amount)}
-        for date, amount in zip(future_dates, predictions)
-    ]
-
 def calculate_goal_probability(monthly_required: float, savings_forecast: list) -> float:
     if not savings_forecast:
         return 0.0
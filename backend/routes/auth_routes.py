@@ -1,17 +1,15 @@
 from datetime import datetime
 from fastapi import APIRouter, HTTPException, Depends
+from pymongo.errors import DuplicateKeyError
 from auth import hash_password, verify_password, create_access_token
 from database import users_collection
+from principals import INACTIVE_STATUSES, ROLE_USER
 from schemas import UserSignUp, UserLogin, Token
 
 router = APIRouter()
 
 @router.post("/register")
 def register(user: UserSignUp):
-    if users_collection.find_one({"email": user.email}):
-        raise HTTPException(status_code=400, detail="Email already registered")
-    if users_collection.find_one({"username": user.username}):
-        raise HTTPException(status_code=400, detail="Username already taken")
     hashed_password = hash_password(user.password)
     user_data = {
         "username": user.username,
@@ -20,7 +18,14 @@ def register(user: UserSignUp):
         "status": "active",
         "created_at": datetime.utcnow()
     }
-    users_collection.insert_one(user_data)
+    # Uniqueness is enforced by the email_unique and username_unique indexes
+    try:
+        users_collection.insert_one(user_data)
+    except DuplicateKeyError as e:
+        key_pattern = (e.details or {}).get("keyPattern", {})
+        if "username" in key_pattern:
+            raise HTTPException(status_code=400, detail="Username already taken")
+        raise HTTPException(status_code=400, detail="Email already registered")
     return {"message": "User registered successfully"}
 
 @router.post("/login", response_model=Token)
@@ -28,5 +33,7 @@ def login(user: UserLogin):
     db_user = users_collection.find_one({"email": user.email})
     if not db_user or not verify_password(user.password, db_user["password"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
-    token = create_access_token({"sub": str(db_user["_id"])})
+    if db_user.get("status") in INACTIVE_STATUSES:
+        raise HTTPException(status_code=403, detail=f"Account {db_user['status']}")
+    token = create_access_token({"sub": str(db_user["_id"]), "role": ROLE_USER})
     return {"access_token": token, "token_type": "bearer"}
@@ -2,10 +2,11 @@ from calendar import monthrange
 
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
-from database import transactions_collection
+from async_database import transactions_collection
 from datetime import datetime, timedelta
 from typing import Dict, List
 import statistics
+import time
 
 from fastapi import APIRouter, Depends, Query
 from models.budget_plan_model import BudgetPlan
@@ -50,16 +51,22 @@ TRANSLATIONS = {
 class AIBudgetService:
     def __init__(self, user_id: str):
         self.user_id = user_id
+        # Mongo round trips and time spent, reported by the route
+        self.round_trips = 0
+        self.db_seconds = 0.0
+        self.compute_seconds = 0.0
+
+    async def generate_budget_plan(self, period_type: str = 'monthly', language: str = 'en') -> BudgetPlan:
+        # Per-category and per-month totals, fetched once
+        history = await self._get_spending_history(period_type)
+
+        started = time.perf_counter()
 
-    def generate_budget_plan(self, period_type: str = 'monthly') -> BudgetPlan:
-        # Get historical transaction data
-        transactions = self._get_historical_transactions(period_type)
-        
         # Analyze spending patterns
-        spending_patterns = self._analyze_spending_patterns(transactions, period_type)
+        spending_patterns = self._analyze_spending_patterns(history["expense_by_category"], period_type)
         
         # Calculate total income and regular expenses based on period
-        period_income = self._calculate_period_income(transactions, period_type)
+        period_income = self._calculate_period_income(history["income_by_month"], period_type)
         
         # Generate category-wise budget allocations
         category_budgets = self._generate_category_budgets(
@@ -68,11 +75,12 @@ class AIBudgetService:
             period_type
         )
         
-        # Generate recommendations
+        # Generate recommendations from the same analysis, in the requested language
         recommendations = self._generate_recommendations(
             spending_patterns, 
             category_budgets,
-            period_type
+            period_type,
+            language=language
         )
 
         # Calculate start and end dates based on period type
@@ -93,7 +101,7 @@ class AIBudgetService:
             # End on last day of current year
             end_date = datetime(today.year, 12, 31, 23, 59, 59)
         
-        return BudgetPlan(
+        budget_plan = BudgetPlan(
             user_id=self.user_id,
             period_type=period_type,
             start_date=start_date,
@@ -103,8 +111,14 @@ class AIBudgetService:
             recommendations=recommendations,
             savings_target=period_income * 0.1
         )
+        self.compute_seconds += time.perf_counter() - started
+        return budget_plan
 
-    def _get_historical_transactions(self, period_type: str) -> List[Dict]:
+    async def _get_spending_history(self, period_type: str) -> Dict:
+        """
+        Fetch the analysis window in one aggregation: expense statistics per
+        category and income totals per calendar month.
+        """
         # Adjust analysis period based on budget period type
         if period_type == 'daily':
             months = 1  # Look at last month for daily patterns
@@ -114,13 +128,48 @@ class AIBudgetService:
             months = 12  # Look at last year
 
         start_date = datetime.utcnow() - timedelta(days=30 * months)
-        return list(transactions_collection.find({
-            "user_id": self.user_id,
-            "date": {"$gte": start_date}
-        }))
+        pipeline = [
+            {"$match": {"user_id": self.user_id, "date": {"$gte": start_date}}},
+            {
+                "$facet": {
+                    "expense_by_category": [
+                        {"$match": {"type": "expense"}},
+                        {
+                            "$group": {
+                                "_id": "$category",
+                                "total": {"$sum": "$amount"},
+                                "frequency": {"$sum": 1},
+                                "max": {"$max": "$amount"},
+                                "min": {"$min": "$amount"},
+                                # Kept for the median, bounded by the analysis window
+                                "amounts": {"$push": "$amount"},
+                                "first_id": {"$min": "$_id"}
+                            }
+                        },
+                        # Categories in the order they were first recorded
+                        {"$sort": {"first_id": 1}}
+                    ],
+                    "income_by_month": [
+                        {"$match": {"type": "income"}},
+                        {
+                            "$group": {
+                                "_id": {"year": {"$year": "$date"}, "month": {"$month": "$date"}},
+                                "total": {"$sum": "$amount"}
+                            }
+                        }
+                    ]
+                }
+            }
+        ]
+
+        started = time.perf_counter()
+        results = await transactions_collection.aggregate(pipeline).to_list(1)
+        self.db_seconds += time.perf_counter() - started
+        self.round_trips += 1
+        return results[0]
     
-    def _calculate_period_income(self, transactions: List[Dict], period_type: str) -> float:
-        monthly_income = self._calculate_monthly_income(transactions)
+    def _calculate_period_income(self, income_by_month: List[Dict], period_type: str) -> float:
+        monthly_income = self._calculate_monthly_income(income_by_month)
         
         # Convert monthly income to requested period
         if period_type == 'daily':
@@ -130,28 +179,20 @@ class AIBudgetService:
         else:  # yearly
             return monthly_income * 12
 
-    def _analyze_spending_patterns(self, transactions: List[Dict], period_type: str) -> Dict:
-        patterns = {}
-        for transaction in transactions:
-            if transaction["type"] == "expense":
-                category = transaction["category"]
-                if category not in patterns:
-                    patterns[category] = []
-                patterns[category].append(transaction["amount"])
-        
+    def _analyze_spending_patterns(self, expense_by_category: List[Dict], period_type: str) -> Dict:
         # Calculate statistics for each category
         analysis = {}
-        for category, amounts in patterns.items():
+        for group in expense_by_category:
             # Adjust statistics based on period type
-            divisor = self._get_period_divisor(len(amounts), period_type)
+            divisor = self._get_period_divisor(group["frequency"], period_type)
             
-            analysis[category] = {
-                "average": statistics.mean(amounts) / divisor,
-                "median": statistics.median(amounts) / divisor,
-                "max": max(amounts),
-                "min": min(amounts),
-                "total": sum(amounts),
-                "frequency": len(amounts)
+            analysis[group["_id"]] = {
+                "average": group["total"] / group["frequency"] / divisor,
+                "median": statistics.median(group["amounts"]) / divisor,
+                "max": group["max"],
+                "min": group["min"],
+                "total": group["total"],
+                "frequency": group["frequency"]
             }
         return analysis
     
@@ -164,28 +205,9 @@ class AIBudgetService:
         else:  # yearly
             return 1/12  # Convert monthly to yearly
 
-    def _calculate_monthly_income(self, transactions: List[Dict]) -> float:
-        monthly_incomes = []
-        current_month = None
-        month_total = 0
-
-        for transaction in sorted(transactions, key=lambda x: x["date"]):
-            if transaction["type"] == "income":
-                transaction_month = transaction["date"].strftime("%Y-%m")
-                
-                if current_month is None:
-                    current_month = transaction_month
-                
-                if transaction_month != current_month:
-                    monthly_incomes.append(month_total)
-                    month_total = transaction["amount"]
-                    current_month = transaction_month
-                else:
-                    month_total += transaction["amount"]
-        
-        if month_total > 0:
-            monthly_incomes.append(month_total)
-        
+    def _calculate_monthly_income(self, income_by_month: List[Dict]) -> float:
+        # Average over the months that had any income
+        monthly_incomes = [month["total"] for month in income_by_month if month["total"] > 0]
         return statistics.mean(monthly_incomes) if monthly_incomes else 0
 
     def _generate_category_budgets(
@@ -530,18 +552,14 @@ async def get_budget_plan(
     language: str = Query(default='en', regex='^(en|my)$')
 ):
     service = AIBudgetService(user_id)
-    budget_plan = service.generate_budget_plan(period_type)
-    
-    # Add language-specific recommendations
-    budget_plan.recommendations = service._generate_recommendations(
-        spending_patterns=service._analyze_spending_patterns(
-            service._get_historical_transactions(period_type), 
-            period_type
-        ),
-        category_budgets=budget_plan.category_budgets,
-        period_type=period_type,
-        language=language
-    )
+    budget_plan = await service.generate_budget_plan(period_type, language)
     
     # Convert the budget_plan to a dictionary that can be JSON serialized
-    return JSONResponse(content=jsonable_encoder(budget_plan), media_type="application/json; charset=utf-8")
\ No newline at end of file
+    return JSONResponse(
+        content=jsonable_encoder(budget_plan),
+        media_type="application/json; charset=utf-8",
+        headers={
+            "X-Mongo-Round-Trips": str(service.round_trips),
+            "Server-Timing": f"db;dur={service.db_seconds * 1000:.1f}, compute;dur={service.compute_seconds * 1000:.1f}"
+        }
+    )
@@ -1,11 +1,28 @@
 from fastapi import APIRouter, HTTPException, Query, Depends
 from database import transactions_collection, goals_collection
+from ledger import aligned_months, category_totals, get_rollups
+from response_cache import cached_route
 from utils import get_current_user
 from datetime import datetime, timedelta
 
 router = APIRouter()
 
+
+def _categories_from_rollups(user_id: str, transaction_type: str, start: datetime | None, end: datetime | None):
+    """
+    Answer a category breakdown from monthly rollups when the range is all time
+    or whole months. Returns None when the raw transactions are needed.
+    """
+    months = None
+    if start is not None:
+        months = aligned_months(start, end)
+        if months is None:
+            return None
+    return category_totals(get_rollups(user_id, transaction_type, months))
+
+
 @router.get("/expense-categories")
+@cached_route("expense-categories")
 def get_expense_categories(
     user_id: str = Depends(get_current_user),
     start_date: str | None = None,
@@ -16,6 +33,7 @@ def get_expense_categories(
         "user_id": user_id,
         "type": "expense"
     }
+    start = end = None
     
     # Add date filtering if dates are provided
     if start_date and end_date:
@@ -34,6 +52,10 @@ def get_expense_categories(
             "$lte": end
         }
     
+    categories = _categories_from_rollups(user_id, "expense", start, end)
+    if categories is not None:
+        return categories
+
     # Aggregate expenses by category
     pipeline = [
         {
@@ -60,6 +82,7 @@ def get_expense_categories(
 
 
 @router.get("/income-categories")
+@cached_route("income-categories")
 def get_income_categories(
     user_id: str = Depends(get_current_user),
     start_date: str | None = None,
@@ -70,6 +93,7 @@ def get_income_categories(
         "user_id": user_id,
         "type": "income"
     }
+    start = end = None
     
     # Add date filtering if dates are provided
     if start_date and end_date:
@@ -88,6 +112,10 @@ def get_income_categories(
             "$lte": end
         }
     
+    categories = _categories_from_rollups(user_id, "income", start, end)
+    if categories is not None:
+        return categories
+
     # Aggregate incomes by category
     pipeline = [
         {
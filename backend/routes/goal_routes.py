@@ -1,8 +1,12 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response
 from database import goals_collection
+from data_version import bump_data_version
+from response_cache import cached_route
 from models.goal_model import Goal
 from routes.notification_routes import check_goal_reminders
-from utils import get_current_user
+from goal_reminders import deadline_utc
+from sync_log import record_deletions, sync_stamp
+from utils import conditional_get, get_current_user
 from bson import ObjectId
 from bson.errors import InvalidId
 
@@ -12,13 +16,16 @@ router = APIRouter()
 def set_goal(goal: Goal, user_id: str = Depends(get_current_user)):
     goal_data = goal.dict()
     goal_data["user_id"] = user_id
+    goal_data.update(sync_stamp(user_id))
     result = goals_collection.insert_one(goal_data)
+    bump_data_version(user_id)
     created_goal = goals_collection.find_one({"_id": result.inserted_id})
     created_goal["_id"] = str(created_goal["_id"])
     return created_goal
 
-@router.get("/goals")
-def get_goals(user_id: str = Depends(get_current_user)):
+@router.get("/goals", dependencies=[Depends(conditional_get("goals"))])
+@cached_route("goals")
+def get_goals(response: Response, user_id: str = Depends(get_current_user)):
     goals = goals_collection.find({"user_id": user_id})
     goals_list = []
     for goal in goals:
@@ -41,6 +48,8 @@ def delete_goal(goal_id: str, user_id: str = Depends(get_current_user)):
                 status_code=404,
                 detail="Goal not found or unauthorized"
             )
+        record_deletions(user_id, "goals", [goal_object_id])
+        bump_data_version(user_id)
             
         return {"message": "Goal deleted successfully"}
         
@@ -79,6 +88,15 @@ def update_goal(
         update_data["current_amount"] = existing_goal["current_amount"]
         update_data["completed"] = existing_goal["completed"]
         update_data["completion_date"] = existing_goal.get("completion_date")
+
+        # Reminders sent for the old deadline or target don't apply to the new ones
+        if (
+            deadline_utc(goal.deadline) != deadline_utc(existing_goal["deadline"])
+            or goal.target_amount != existing_goal["target_amount"]
+        ):
+            update_data["reminders_sent"] = []
+            update_data["reminder_claims"] = {}
+        update_data.update(sync_stamp(user_id))
         
         result = goals_collection.update_one(
             {"_id": goal_object_id, "user_id": user_id},
@@ -90,6 +108,7 @@ def update_goal(
                 status_code=400,
                 detail="Goal update failed"
             )
+        bump_data_version(user_id)
             
         updated_goal = goals_collection.find_one({"_id": goal_object_id})
         updated_goal["_id"] = str(updated_goal["_id"])
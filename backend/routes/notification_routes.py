@@ -1,183 +1,93 @@
+import asyncio
+import json
 from bson import ObjectId
-from fastapi import APIRouter, Depends, HTTPException
-import pytz
-from database import transactions_collection, notifications_collection, goals_collection
-from utils import get_current_user
-from datetime import datetime, timedelta
-from typing import List
-import statistics
+from bson.errors import InvalidId
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+import async_database
+from database import notifications_collection
+from models.notification_model import NotificationIds
+from utils import conditional_get, decode_cursor, encode_cursor, get_current_user, keyset_after, serialize_notification
+from datetime import datetime
+from typing import List, Optional
+import math
+from spending_stats import MIN_HISTORY_WEIGHT, UNUSUAL_EXPENSE_SCOPE, get_spending_stats
+from goal_reminders import check_user_goal_reminders
+from ledger import get_summary
+from notification_outbox import outbox
+from data_version import bump_data_version
+from sync_log import record_deletions, sync_stamp
+from notification_hub import HEARTBEAT_INTERVAL, OVERFLOW, hub
 
 router = APIRouter()
 
 
 def check_goal_reminders(user_id: str):
     """
-    Check if any goals need reminders based on progress and deadline
+    Check if any goals need reminders based on progress and deadline.
+    Each reminder is sent once per goal and rule, so polling doesn't duplicate them.
     """
-    # Use UTC for all datetime operations
-    utc = pytz.UTC
-    current_date = datetime.now(utc)
-    
-    goals = goals_collection.find({
-        "user_id": user_id,
-        "completed": False
-    })
-    
-    notifications = []
-    for goal in goals:
-        try:
-            # Handle both datetime objects and ISO strings
-            if isinstance(goal['deadline'], str):
-                # Remove milliseconds if present and handle timezone
-                deadline_str = goal['deadline'].split('.')[0]
-                if deadline_str.endswith('Z'):
-                    deadline_str = deadline_str[:-1] + '+00:00'
-                deadline = datetime.fromisoformat(deadline_str)
-                if deadline.tzinfo is None:
-                    deadline = utc.localize(deadline)
-            else:
-                deadline = goal['deadline']
-                if deadline.tzinfo is None:
-                    deadline = utc.localize(deadline)
-            
-            days_remaining = (deadline - current_date).days
-            progress = (goal['current_amount'] / goal['target_amount']) * 100
-            
-            # Only proceed if days_remaining is positive
-            if days_remaining > 0:
-                # For calculating total days, handle ObjectId generation time
-                start_date = goal['_id'].generation_time.replace(tzinfo=utc)
-                total_days = (deadline - start_date).days
-                
-                if total_days > 0:  # Prevent division by zero
-                    time_percentage = ((total_days - days_remaining) / total_days) * 100
-                    
-                    should_remind = False
-                    message = ""
-                    
-                    if days_remaining <= 7 and progress < 90:
-                        should_remind = True
-                        message = f"Only {days_remaining} days left to reach your goal '{goal['name']}'. Current progress: {progress:.1f}%"
-                    elif days_remaining <= 30 and progress < 50:
-                        should_remind = True
-                        message = f"{days_remaining} days remaining for goal '{goal['name']}' but only {progress:.1f}% completed"
-                    elif progress < time_percentage - 10:
-                        should_remind = True
-                        message = f"Your goal '{goal['name']}' is behind schedule. Current progress: {progress:.1f}%"
-                    
-                    if should_remind:
-                        notification = {
-                            "user_id": user_id,
-                            "title": "Goal Reminder",
-                            "message": message,
-                            "timestamp": current_date,
-                            "type": "goalReminder",
-                            "isRead": False,
-                            "requiresSystemNotification": True
-                        }
-                        notifications.append(notification)
-                        
-        except (ValueError, KeyError, TypeError) as e:
-            print(f"Error processing goal {goal.get('_id', 'unknown')}: {str(e)}")
-            continue
-    
-    # Insert all notifications
-    if notifications:
-        notifications_collection.insert_many(notifications)
-    
-    return [str(notif['_id']) for notif in notifications]
-
-def detect_unusual_expense(user_id: str, transaction: dict):
+    return check_user_goal_reminders(user_id)
+
+def detect_unusual_expense(user_id: str, transaction: dict, scope: str | None = None):
     """
     Detect if an expense is unusually large compared to recent spending patterns
     Returns True if the expense is unusual, False otherwise
+
+    Compares against the running spending stats in a single read, so it must
+    run before the transaction is recorded in the ledger. `scope` is "all" to
+    compare with every recent expense or "category" to compare with recent
+    expenses in the same category (falling back to all while the category has
+    too little history); defaults to TOEPWAR_UNUSUAL_EXPENSE_SCOPE.
     """
-    print(f"Starting unusual expense detection for transaction: {transaction}")
-    
     try:
         # Only proceed if this is an expense transaction
         if transaction.get('type') != 'expense':
-            print("Not an expense transaction, skipping unusual detection")
             return False
 
         # Get amount from transaction, with validation
         amount = transaction.get('amount')
         if not isinstance(amount, (int, float)) or amount <= 0:
-            print(f"Invalid transaction amount: {amount}")
             return False
 
-        # Check expenses in the last 30 days, EXCLUDING the current transaction
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        
-        # Add query condition to exclude current transaction if it has an _id
-        query = {
-            "user_id": user_id,
-            "type": "expense",
-            "date": {"$gte": thirty_days_ago}
-        }
-        
-        # If the transaction has an _id, exclude it from the comparison
-        if '_id' in transaction:
-            query['_id'] = {'$ne': transaction['_id']}
-            
-        recent_expenses = list(transactions_collection.find(query))
-
-        print(f"Found {len(recent_expenses)} recent expenses (excluding current)")
+        scope = scope or UNUSUAL_EXPENSE_SCOPE
+        overall, by_category = get_spending_stats(
+            user_id,
+            transaction.get('category') if scope == "category" else None
+        )
+        stats = by_category if by_category and by_category[0] >= MIN_HISTORY_WEIGHT else overall
+        count, total, total_sq, max_previous = stats
 
         # If this is the first expense or no recent expenses
-        if not recent_expenses:
+        if count < MIN_HISTORY_WEIGHT:
             # For first transaction, flag as unusual if over threshold
             is_unusual = amount > 1000  # Adjust threshold as needed
-            print(f"No previous expenses. Amount {amount} > 1000: {is_unusual}")
-            return is_unusual
-
-        # Calculate mean of recent expenses
-        expense_amounts = [expense['amount'] for expense in recent_expenses]
-        mean_expense = statistics.mean(expense_amounts)
-        print(f"Mean expense: {mean_expense}")
-
-        # For cases with few transactions (less than 5)
-        if len(expense_amounts) < 5:
-            # Find the largest previous expense
-            max_previous = max(expense_amounts)
-            print(f"Few transactions. Max previous expense: {max_previous}")
-            
-            # Consider unusual if:
-            # 1. Amount is more than 2x the largest previous expense, OR
-            # 2. Amount is more than 3x the mean expense
-            is_unusual = (
-                amount > (max_previous * 2) or 
-                amount > (mean_expense * 3)
-            )
-            print(f"Few transactions comparison - Amount: {amount}")
-            print(f"Threshold 1 (2x max previous): {max_previous * 2}")
-            print(f"Threshold 2 (3x mean): {mean_expense * 3}")
-            print(f"Is unusual: {is_unusual}")
-            return is_unusual
-
-        # Calculate standard deviation for more data points
-        try:
-            std_dev = statistics.stdev(expense_amounts)
-            print(f"Standard deviation: {std_dev}")
-        except statistics.StatisticsError as e:
-            print(f"Error calculating standard deviation: {e}")
-            # Fallback to simple comparison if std_dev calculation fails
-            is_unusual = amount > (mean_expense * 3)
-            print(f"Fallback comparison. Amount {amount} > {mean_expense * 3}: {is_unusual}")
-            return is_unusual
-
-        # Define unusual expense as more than 2 standard deviations above mean
-        # or more than 3x the average
-        is_unusual = (
-            amount > (mean_expense + 2 * std_dev) or 
-            amount > (mean_expense * 3)
-        )
-        
-        print(f"Final unusual check. Amount: {amount}")
-        print(f"Threshold 1 (mean + 2*std): {mean_expense + 2 * std_dev}")
-        print(f"Threshold 2 (mean * 3): {mean_expense * 3}")
-        print(f"Is unusual: {is_unusual}")
-        
+        else:
+            mean_expense = total / count
+            if max_previous is None:
+                # No expense within the last month to compare the peak with
+                max_previous = mean_expense
+
+            if count < 5:
+                # For cases with few transactions, consider unusual if:
+                # 1. Amount is more than 2x the largest previous expense, OR
+                # 2. Amount is more than 3x the mean expense
+                is_unusual = (
+                    amount > (max_previous * 2) or
+                    amount > (mean_expense * 3)
+                )
+            else:
+                # Define unusual expense as more than 2 standard deviations above mean
+                # or more than 3x the average
+                std_dev = math.sqrt(max(0.0, (total_sq - total * mean_expense) / (count - 1)))
+                is_unusual = (
+                    amount > (mean_expense + 2 * std_dev) or
+                    amount > (mean_expense * 3)
+                )
+
+        if is_unusual:
+            print(f"Unusual {transaction.get('category')} expense of {amount} for user {user_id} "
+                  f"(scope={scope}, history weight={count:.1f})")
         return is_unusual
 
     except Exception as e:
@@ -188,18 +98,19 @@ def detect_unusual_expense(user_id: str, transaction: dict):
 def create_expense_alert_notification(user_id: str, transaction: dict):
     """
     Create both in-app and system notifications for an unusual expense
+    Returns the notification, or None if one was already sent for this transaction
     """
     notification = {
         "user_id": user_id,
         "title": "Unusual Expense Alert",
         "message": f"Large {transaction['category']} expense of K{transaction['amount']:.2f} detected",
-        "timestamp": datetime.utcnow().isoformat() + 'Z',  # Add 'Z' to indicate UTC
+        "timestamp": datetime.utcnow(),  # UTC; served with a 'Z' suffix
         "type": "expenseAlert",
         "isRead": False,
         "requiresSystemNotification": True  # Add this flag
     }
-    result = notifications_collection.insert_one(notification)
-    return str(result.inserted_id)
+    # At most one alert per transaction
+    return outbox.emit(notification, key=str(transaction.get("_id", "")))
 
 
 def check_low_balance(user_id: str, balance: float) -> bool:
@@ -213,41 +124,213 @@ def check_low_balance(user_id: str, balance: float) -> bool:
 def create_balance_alert_notification(user_id: str, balance: float):
     """
     Create both in-app and system notifications for low balance
+    Returns the notification, or None while an earlier alert is cooling down
     """
     notification = {
         "user_id": user_id,
         "title": "Low Balance Alert",
         "message": f"Your current balance is K{balance:.2f}. Consider adding funds to your account.",
-        "timestamp": datetime.utcnow().isoformat() + 'Z',  # Add 'Z' to indicate UTC
+        "timestamp": datetime.utcnow(),  # UTC; served with a 'Z' suffix
         "type": "balanceAlert",
         "isRead": False,
         "requiresSystemNotification": True
     }
-    result = notifications_collection.insert_one(notification)
-    return str(result.inserted_id)
+    # One alert per cooldown however often the balance is checked
+    return outbox.emit(notification)
+
+
+def check_balance_alert(user_id: str) -> list:
+    """
+    Alert on a low balance after a write changed it.
+    Returns the alert in a list, or an empty list if none was emitted.
+    """
+    balance = get_summary(user_id)["balance"]
+    if not check_low_balance(user_id, balance):
+        return []
+    notification = create_balance_alert_notification(user_id, balance)
+    return [notification] if notification else []
+
+
+@router.get("/getnotifications", dependencies=[Depends(conditional_get("notifications"))])
+def get_notifications(
+    response: Response,
+    user_id: str = Depends(get_current_user),
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    unread_only: bool = Query(False)
+):
+    """
+    Notifications latest first. Without a limit the full history is returned.
+    With a limit, the cursor for the next page is sent in the X-Next-Cursor header.
+    """
+    query = {"user_id": user_id}
+    if unread_only:
+        query["isRead"] = False
+    if cursor:
+        last_timestamp, last_id = decode_cursor(cursor)
+        query = {"$and": [query, keyset_after("timestamp", last_timestamp, last_id)]}
+
+    notifications = notifications_collection.find(query).sort([("timestamp", -1), ("_id", -1)])
+    if limit:
+        # Fetch one extra to know whether another page exists
+        notifications = list(notifications.limit(limit + 1))
+        if len(notifications) > limit:
+            notifications = notifications[:limit]
+            last = notifications[-1]
+            response.headers["X-Next-Cursor"] = encode_cursor(last["timestamp"], last["_id"])
+
+    return [serialize_notification(notification) for notification in notifications]
+
+
+# Most notifications replayed to a stream resuming from Last-Event-ID;
+# a client further behind than this should refetch /getnotifications
+STREAM_RESUME_LIMIT = 500
+
+
+def _stream_position(notification: dict) -> tuple:
+    return notification.get("stream_seq", 0), notification["_id"]
+
+
+def _sse_event(notification: dict, position: tuple) -> str:
+    # The id is the furthest position sent so far, which a reconnect resumes after
+    event_id = f"{position[0]}-{position[1]}"
+    notification = serialize_notification(dict(notification))
+    return f"id: {event_id}\nevent: notification\ndata: {json.dumps(notification)}\n\n"
+
+
+def _parse_stream_position(value: str) -> tuple:
+    """An event id, or a bare notification id as sent before stream_seq existed"""
+    try:
+        if "-" in value:
+            seq, object_id = value.split("-", 1)
+            return int(seq), ObjectId(object_id)
+        return None, ObjectId(value)
+    except (ValueError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid event ID")
+
+
+@router.get("/notifications/stream")
+async def stream_notifications(
+    user_id: str = Depends(get_current_user),
+    last_event_id: Optional[str] = Header(None),
+    resume_from: Optional[str] = Query(None, description="Last event id seen, for clients that can't set Last-Event-ID")
+):
+    """
+    Server-sent events: each new notification as a "notification" event, and
+    a comment every HEARTBEAT_INTERVAL seconds while idle. Reconnecting with
+    Last-Event-ID first replays what was stored since.
+
+    Notifications are ordered by stream_seq, the user's sync counter when
+    they were stored, then by _id. ObjectIds alone don't order inserts made
+    by different workers, and either may feed the stream with the
+    changestream source. Live events can still arrive slightly out of that
+    order, so they are deduplicated by id rather than compared.
+    """
+    last_seen = last_event_id or resume_from
+    position = _parse_stream_position(last_seen) if last_seen else None
+
+    async def events():
+        nonlocal position
+        # Subscribe before reading the backlog so nothing stored in between is missed
+        queue = hub.subscribe(user_id)
+        try:
+            yield "retry: 3000\n: connected\n\n"
+            replayed = set()
+            if position is not None:
+                seq, last_id = position
+                if seq is None:
+                    query = {"user_id": user_id, "_id": {"$gt": last_id}}
+                    position = (0, last_id)
+                else:
+                    query = {"user_id": user_id, "$or": [
+                        {"stream_seq": {"$gt": seq}},
+                        {"stream_seq": seq, "_id": {"$gt": last_id}}
+                    ]}
+                backlog = async_database.notifications_collection.find(query).sort(
+                    [("stream_seq", 1), ("_id", 1)]
+                ).limit(STREAM_RESUME_LIMIT)
+                async for notification in backlog:
+                    replayed.add(notification["_id"])
+                    position = max(position, _stream_position(notification))
+                    yield _sse_event(notification, position)
+
+            while True:
+                try:
+                    notification = await asyncio.wait_for(queue.get(), HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                if notification is OVERFLOW:
+                    # Dropped for falling behind; the client resumes from its last id
+                    return
+                if notification["_id"] in replayed:
+                    continue  # Already replayed from the backlog
+                current = _stream_position(notification)
+                position = current if position is None else max(position, current)
+                yield _sse_event(notification, position)
+        finally:
+            hub.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/notifications/unread-count")
+def get_unread_count(user_id: str = Depends(get_current_user)):
+    # Counted on the (user_id, isRead) index without reading the documents
+    return {"unread": notifications_collection.count_documents({"user_id": user_id, "isRead": False})}
+
+
+def _bulk_filter(user_id: str, selection: NotificationIds) -> dict:
+    query = {"user_id": user_id}
+    if not selection.all:
+        try:
+            query["_id"] = {"$in": [ObjectId(notification_id) for notification_id in selection.ids]}
+        except InvalidId:
+            raise HTTPException(status_code=400, detail="Invalid notification ID format")
+    return query
+
+
+@router.put("/notifications/mark-read")
+def mark_notifications_as_read(selection: NotificationIds, user_id: str = Depends(get_current_user)):
+    """Mark the given notifications, or all of them with all: true, as read"""
+    query = _bulk_filter(user_id, selection)
+    query["isRead"] = False
+    result = notifications_collection.update_many(query, {"$set": {"isRead": True, **sync_stamp(user_id)}})
+    if result.modified_count:
+        bump_data_version(user_id)
+    return {"modified": result.modified_count}
+
 
+@router.post("/notifications/delete")
+def delete_notifications(selection: NotificationIds, user_id: str = Depends(get_current_user)):
+    """Delete the given notifications, or all of them with all: true"""
+    query = _bulk_filter(user_id, selection)
+    # Read first: each deleted id needs a tombstone
+    notification_ids = [notification["_id"] for notification in notifications_collection.find(query, {"_id": 1})]
+    if not notification_ids:
+        return {"deleted": 0}
+    result = notifications_collection.delete_many({"_id": {"$in": notification_ids}, "user_id": user_id})
+    if result.deleted_count:
+        record_deletions(user_id, "notifications", notification_ids)
+        bump_data_version(user_id)
+    return {"deleted": result.deleted_count}
 
-@router.get("/getnotifications")
-def get_notifications(user_id: str = Depends(get_current_user)):
-    notifications = list(notifications_collection.find({"user_id": user_id}).sort("timestamp", -1))
-    
-    # Convert ObjectId to string
-    for notification in notifications:
-        notification['id'] = str(notification['_id'])
-        del notification['_id']
-    
-    return notifications
 
 @router.put("/marknotification/{notification_id}")
 def mark_notification_as_read(notification_id: str, user_id: str = Depends(get_current_user)):
     try:
         result = notifications_collection.update_one(
             {"_id": ObjectId(notification_id), "user_id": user_id},
-            {"$set": {"isRead": True}}
+            {"$set": {"isRead": True, **sync_stamp(user_id)}}
         )
         
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Notification not found")
+        bump_data_version(user_id)
         
         return {"message": "Notification marked as read"}
     except Exception as e:
@@ -263,6 +346,8 @@ def delete_notification(notification_id: str, user_id: str = Depends(get_current
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Notification not found")
+        record_deletions(user_id, "notifications", [notification_id])
+        bump_data_version(user_id)
         
         return {"message": "Notification deleted successfully"}
     except Exception as e:
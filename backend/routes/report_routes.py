@@ -1,78 +1,23 @@
-from io import BytesIO
-from fastapi import APIRouter, HTTPException, Query, Depends
-from fastapi.responses import StreamingResponse
-from database import transactions_collection, goals_collection
-from utils import create_financial_report_excel, create_financial_report_pdf, get_current_user
+import asyncio
+from fastapi import APIRouter, Header, HTTPException, Query, Depends, Response
+from fastapi.responses import FileResponse
+import metrics
+from async_database import transactions_collection, goals_collection, ledger_summaries_collection, monthly_rollups_collection
+from ledger import aligned_months, category_totals, naive_utc
+from data_version import get_data_version_async
+from report_cache import cache_key, report_cache
+from response_cache import cached_route
+from report_rendering import render_report
+from utils import etag_matches, get_current_user
 from datetime import datetime, timedelta
 from typing import Optional
 
 router = APIRouter()
 
-@router.get("/financial-report")
-def get_financial_report(
-    user_id: str = Depends(get_current_user),
-    start_date: Optional[str] = Query(None),
-    end_date: Optional[str] = Query(None)
-):
-    # If no end date specified, use current date
-    if not end_date:
-        end = datetime.now()
-    else:
-        end = datetime.fromisoformat(end_date)
-    
-   # If no start date specified, get the date of first transaction
-    if not start_date:
-        first_transaction = transactions_collection.find_one(
-            {"user_id": user_id},
-            sort=[("date", 1)]  # Sort by date ascending
-        )
-        start = first_transaction["date"] if first_transaction else end - timedelta(days=30)
-    else:
-        start = datetime.fromisoformat(start_date)
-    
-    # Create match condition for the date range
-    match_condition = {
-        "user_id": user_id,
-        "date": {
-            "$gte": start,
-            "$lte": end
-        }
-    }
 
-    # Use aggregation pipeline to calculate totals
-    pipeline = [
-        {"$match": match_condition},
-        {
-            "$group": {
-                "_id": "$type",
-                "total": {"$sum": {"$toDouble": "$amount"}}
-            }
-        }
-    ]
-    
-    results = list(transactions_collection.aggregate(pipeline))
-    
-    # Initialize totals
-    income_total = 0.0
-    expense_total = 0.0
-    
-    # Process results
-    for result in results:
-        if result["_id"] == "income":
-            income_total = result["total"]
-        elif result["_id"] == "expense":
-            expense_total = result["total"]
-    
-    net_income = income_total - expense_total
-    
-    # Calculate category breakdowns using aggregation
-    income_pipeline = [
-        {
-            "$match": {
-                **match_condition,
-                "type": "income"
-            }
-        },
+def _category_breakdown(transaction_type: str) -> list:
+    return [
+        {"$match": {"type": transaction_type}},
         {
             "$group": {
                 "_id": "$category",
@@ -87,40 +32,125 @@ def get_financial_report(
             }
         }
     ]
-    
-    expense_pipeline = [
-        {
-            "$match": {
-                **match_condition,
-                "type": "expense"
-            }
-        },
-        {
-            "$group": {
-                "_id": "$category",
-                "amount": {"$sum": {"$toDouble": "$amount"}}
-            }
-        },
+
+
+def _in_range(value, start: datetime, end: datetime) -> bool:
+    return value is not None and start <= value <= end
+
+
+async def _fetch_goals(user_id: str, start: Optional[datetime], end: datetime) -> list:
+    # Without a start date the lower bound is only known once the facet has
+    # found the earliest transaction, so the caller filters on it afterwards
+    goal_range = {"$lte": end} if start is None else {"$gte": start, "$lte": end}
+    return await goals_collection.find({
+        "user_id": user_id,
+        "$or": [
+            {"deadline": goal_range},
+            {"completion_date": goal_range}
+        ]
+    }).to_list(None)
+
+
+async def _facet_from_rollups(user_id: str, months: tuple) -> dict | None:
+    """Build the facet result from monthly rollups, or None if they aren't built yet"""
+    summary = await ledger_summaries_collection.find_one({"_id": user_id}, {"rollups_ready": 1})
+    if not summary or not summary.get("rollups_ready"):
+        return None
+
+    rollups = await monthly_rollups_collection.find({
+        "user_id": user_id,
+        "month": {"$gte": months[0], "$lte": months[1]},
+        "count": {"$gt": 0}
+    }).to_list(None)
+
+    totals = {}
+    for rollup in rollups:
+        totals[rollup["type"]] = totals.get(rollup["type"], 0.0) + rollup["sum"]
+
+    return {
+        "totals": [{"_id": transaction_type, "total": total} for transaction_type, total in totals.items()],
+        "income_by_category": category_totals([r for r in rollups if r["type"] == "income"]),
+        "expense_by_category": category_totals([r for r in rollups if r["type"] == "expense"]),
+        "earliest": []
+    }
+
+
+async def _run_facet(user_id: str, start: Optional[datetime], end: datetime, pipeline: list) -> dict:
+    # Whole-month ranges are answered from rollups without touching transactions
+    months = aligned_months(start, end)
+    if months is not None:
+        facet = await _facet_from_rollups(user_id, months)
+        if facet is not None:
+            return facet
+
+    results = await transactions_collection.aggregate(pipeline).to_list(1)
+    return results[0]
+
+
+async def build_financial_report(user_id: str, start_date: Optional[str], end_date: Optional[str]) -> dict:
+    # If no end date specified, use current date
+    if not end_date:
+        end = datetime.now()
+    else:
+        # Naive UTC like the stored dates it is compared with
+        end = naive_utc(datetime.fromisoformat(end_date))
+
+    # If no start date specified, the report starts at the first transaction
+    start = naive_utc(datetime.fromisoformat(start_date)) if start_date else None
+
+    date_range = {"$lte": end}
+    if start is not None:
+        date_range["$gte"] = start
+
+    # Totals, both category breakdowns and the earliest date in one scan
+    pipeline = [
+        {"$match": {"user_id": user_id, "date": date_range}},
         {
-            "$project": {
-                "category": "$_id",
-                "amount": 1,
-                "_id": 0
+            "$facet": {
+                "totals": [
+                    {
+                        "$group": {
+                            "_id": "$type",
+                            "total": {"$sum": {"$toDouble": "$amount"}}
+                        }
+                    }
+                ],
+                "income_by_category": _category_breakdown("income"),
+                "expense_by_category": _category_breakdown("expense"),
+                "earliest": [
+                    {"$group": {"_id": None, "date": {"$min": "$date"}}}
+                ]
             }
         }
     ]
+
+    # Goals don't depend on the aggregation, so fetch them alongside it
+    facet, goals = await asyncio.gather(
+        _run_facet(user_id, start, end, pipeline),
+        _fetch_goals(user_id, start, end)
+    )
+
+    if start is None:
+        earliest = facet["earliest"]
+        start = earliest[0]["date"] if earliest else end - timedelta(days=30)
+        goals = [
+            goal for goal in goals
+            if _in_range(goal.get("deadline"), start, end)
+            or _in_range(goal.get("completion_date"), start, end)
+        ]
+
+    # Initialize totals
+    income_total = 0.0
+    expense_total = 0.0
     
-    income_by_category = list(transactions_collection.aggregate(income_pipeline))
-    expense_by_category = list(transactions_collection.aggregate(expense_pipeline))
+    # Process results
+    for result in facet["totals"]:
+        if result["_id"] == "income":
+            income_total = result["total"]
+        elif result["_id"] == "expense":
+            expense_total = result["total"]
     
-    # Get goals progress
-    goals = goals_collection.find({
-        "user_id": user_id,
-        "$or": [
-            {"deadline": {"$gte": start, "$lte": end}},
-            {"completion_date": {"$gte": start, "$lte": end}}
-        ]
-    })
+    net_income = income_total - expense_total
     
     goals_summary = []
     for goal in goals:
@@ -149,62 +179,83 @@ def get_financial_report(
             "net_income": net_income,
             "savings_rate": savings_rate
         },
-        "income_by_category": income_by_category,
-        "expense_by_category": expense_by_category,
+        "income_by_category": facet["income_by_category"],
+        "expense_by_category": facet["expense_by_category"],
         "goals_summary": goals_summary
     }
 
 
-@router.get("/export-financial-report")
-async def export_financial_report(
+@router.get("/financial-report")
+@cached_route("financial-report")
+async def get_financial_report(
     user_id: str = Depends(get_current_user),
     start_date: Optional[str] = Query(None),
     end_date: Optional[str] = Query(None)
 ):
-    # Get the financial report data using the existing function
-    report_data = get_financial_report(user_id, start_date, end_date)
-    
-    # Create Excel workbook
-    wb = create_financial_report_excel(report_data)
-    
-    # Save to bytes buffer
-    buffer = BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-    
+    return await build_financial_report(user_id, start_date, end_date)
+
+
+EXPORT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+    "pdf": ("application/pdf", ".pdf"),
+}
+
+
+async def _export(
+    user_id: str,
+    start_date: Optional[str],
+    end_date: Optional[str],
+    if_none_match: Optional[str],
+    report_format: str,
+    include_transactions: bool = False
+):
+    """
+    Serve an export from the report cache, rendering it on a miss.
+    The ETag is the cache key, so a client holding the current file gets a
+    304 after a single version lookup.
+    """
+    media_type, extension = EXPORT_FORMATS[report_format]
+    cache_format = report_format + ("+ledger" if include_transactions else "")
+
+    # Read the version before the data: a write during rendering then files
+    # the result under the old version, never under the new one
+    version = await get_data_version_async(user_id)
+    key = cache_key(user_id, cache_format, version, start_date, end_date)
+    headers = {"ETag": f'"{key}"', "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, headers["ETag"]):
+        metrics.increment("report_cache_not_modified", format=cache_format)
+        return Response(status_code=304, headers=headers)
+
+    path = await asyncio.to_thread(report_cache.get, key, extension, cache_format)
+    if path is None:
+        # Get the financial report data using the existing function
+        report_data = await build_financial_report(user_id, start_date, end_date)
+        # Render in the pool, off the event loop
+        rendered = await render_report(report_format, report_data, user_id if include_transactions else None)
+        path = await asyncio.to_thread(report_cache.put, key, extension, rendered)
+
     # Generate filename with current timestamp
-    filename = f"financial_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    
-    # Return the Excel file as a downloadable response
-    return StreamingResponse(
-        buffer,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}"
-        }
-    )
+    filename = f"financial_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}"
+    headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+
+@router.get("/export-financial-report")
+async def export_financial_report(
+    user_id: str = Depends(get_current_user),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    include_transactions: bool = Query(True, description="Add a sheet listing every transaction in the period"),
+    if_none_match: Optional[str] = Header(None)
+):
+    return await _export(user_id, start_date, end_date, if_none_match, "xlsx", include_transactions)
 
 
 @router.get("/export-financial-report-pdf")
 async def export_financial_report_pdf(
     user_id: str = Depends(get_current_user),
     start_date: Optional[str] = Query(None),
-    end_date: Optional[str] = Query(None)
+    end_date: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None)
 ):
-    # Get the financial report data using the existing function
-    report_data = get_financial_report(user_id, start_date, end_date)
-    
-    # Generate PDF
-    pdf_buffer = create_financial_report_pdf(report_data)
-    
-    # Generate filename with current timestamp
-    filename = f"financial_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    
-    # Return the PDF file as a downloadable response
-    return StreamingResponse(
-        pdf_buffer,
-        media_type="application/pdf",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}"
-        }
-    )
+    return await _export(user_id, start_date, end_date, if_none_match, "pdf")
@@ -0,0 +1,356 @@
+import base64
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+from database import goals_collection, notifications_collection, tombstones_collection, transactions_collection
+from goal_allocation import apply_goal_delta
+from ledger import accumulate_delta, apply_delta, naive_utc, new_delta
+from models.sync_model import SyncPush, TransactionMutation
+from routes.notification_routes import check_balance_alert, create_expense_alert_notification, detect_unusual_expense
+from spending_stats import ensure_spending_stats
+from sync_log import SYNC_SETTLE, SYNCED_COLLECTIONS, TOMBSTONE_RETENTION, record_deletions, sync_stamp
+from utils import get_current_user, serialize_notification, serialize_transaction
+
+router = APIRouter()
+
+# Most changed documents sent for one token; a client further behind gets a
+# 410 and fetches everything again without `since`
+SYNC_MAX_CHANGES = int(os.getenv("TOEPWAR_SYNC_MAX_CHANGES", "5000"))
+
+# Most mutations accepted in one /sync/push
+SYNC_MAX_PUSH = int(os.getenv("TOEPWAR_SYNC_MAX_PUSH", "500"))
+
+
+def _serialize_goal(goal: dict) -> dict:
+    goal["_id"] = str(goal["_id"])
+    return goal
+
+
+SERIALIZERS = {
+    "transactions": (transactions_collection, serialize_transaction),
+    "goals": (goals_collection, _serialize_goal),
+    "notifications": (notifications_collection, serialize_notification),
+}
+
+
+def encode_sync_token(seq: int, issued_at: datetime) -> str:
+    payload = json.dumps({"seq": seq, "at": issued_at.isoformat()})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_sync_token(token: str) -> tuple[int, datetime]:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return int(payload["seq"]), datetime.fromisoformat(payload["at"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+
+
+@router.get("/sync/changes")
+def get_changes(
+    since: Optional[str] = Query(None, description="Token from the previous sync; omit for everything"),
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Transactions, goals and notifications written since a token, and the ids
+    of those deleted since, with the token for the next call. Without a
+    token everything is sent and `full` is true: the client replaces its
+    copy instead of merging. Apply `changed` before `deleted`.
+    """
+    now = datetime.utcnow()
+    query = {"user_id": user_id}
+    since_seq = 0
+    if since:
+        since_seq, issued_at = decode_sync_token(since)
+        # Deletions older than the tombstones kept can't be replayed
+        if now - issued_at > TOMBSTONE_RETENTION - SYNC_SETTLE:
+            raise HTTPException(status_code=410, detail="Sync token expired, sync again without since")
+        query["sync_seq"] = {"$gt": since_seq}
+
+    changed = {}
+    stamps = []
+    for name in SYNCED_COLLECTIONS:
+        collection, serialize = SERIALIZERS[name]
+        documents = collection.find(query).sort("sync_seq", 1)
+        if since:
+            documents = documents.limit(SYNC_MAX_CHANGES + 1)
+        documents = list(documents)
+        if since and sum(len(listed) for listed in changed.values()) + len(documents) > SYNC_MAX_CHANGES:
+            raise HTTPException(status_code=410, detail="Too many changes, sync again without since")
+        # Documents from before sync stamps existed only come with a full sync
+        stamps.extend((document["sync_seq"], document["sync_at"]) for document in documents if "sync_seq" in document)
+        changed[name] = [serialize(document) for document in documents]
+
+    deleted = {name: [] for name in SYNCED_COLLECTIONS}
+    if since:
+        for tombstone in tombstones_collection.find(query, {"collection": 1, "document_id": 1, "sync_seq": 1, "sync_at": 1}):
+            deleted[tombstone["collection"]].append(tombstone["document_id"])
+            stamps.append((tombstone["sync_seq"], tombstone["sync_at"]))
+
+    # Move past what has settled, but not past anything recent: a write that
+    # reserved a lower seq may still be landing behind it
+    settled_before = now - SYNC_SETTLE
+    next_seq = max([since_seq] + [seq for seq, stamped_at in stamps if stamped_at <= settled_before])
+    unsettled = [seq for seq, stamped_at in stamps if stamped_at > settled_before]
+    if unsettled:
+        next_seq = max(since_seq, min(next_seq, min(unsettled) - 1))
+
+    return {
+        "full": not since,
+        "changed": changed,
+        "deleted": deleted,
+        "token": encode_sync_token(next_seq, now)
+    }
+
+
+def _target_id(mutation: TransactionMutation, client_ids: dict):
+    """Server id a mutation refers to, by transaction_id or by client_id"""
+    if mutation.transaction_id:
+        return ObjectId(mutation.transaction_id)
+    return client_ids.get(mutation.client_id)
+
+
+def _invalid_values(mutation: TransactionMutation) -> str | None:
+    if mutation.transaction is None:
+        return "transaction is required"
+    if mutation.transaction.type not in ("income", "expense"):
+        return "type must be income or expense"
+    return None
+
+
+@router.post("/sync/push")
+def push_changes(batch: SyncPush, user_id: str = Depends(get_current_user)):
+    """
+    Apply transactions added, edited and deleted offline, in order, with one
+    result per mutation. The batch is replayed in memory and each
+    transaction gets one net write, all in a single bulk_write; the ledger,
+    goals, unusual-expense and balance checks then run once for the batch.
+    Each write only applies to the version of the row read at the start, so
+    a change landing meanwhile, e.g. from another device's push, is never
+    overwritten and only confirmed writes reach the ledger.
+    A result's status is applied, duplicate (the add was already applied),
+    conflict (changed on the server since base_seq, or during this push;
+    the server's copy is returned), not_found, invalid or error (the write
+    failed).
+    """
+    mutations = batch.mutations
+    if len(mutations) > SYNC_MAX_PUSH:
+        raise HTTPException(status_code=400, detail=f"At most {SYNC_MAX_PUSH} mutations per push")
+
+    # Every stored transaction the batch refers to, in one read
+    referenced_ids = set()
+    for mutation in mutations:
+        if mutation.transaction_id:
+            try:
+                referenced_ids.add(ObjectId(mutation.transaction_id))
+            except InvalidId:
+                pass
+    referenced_client_ids = [mutation.client_id for mutation in mutations if mutation.client_id]
+    stored = {}
+    if referenced_ids or referenced_client_ids:
+        stored = {
+            transaction["_id"]: transaction
+            for transaction in transactions_collection.find({"user_id": user_id, "$or": [
+                {"_id": {"$in": list(referenced_ids)}},
+                {"client_id": {"$in": referenced_client_ids}}
+            ]})
+        }
+    client_ids = {transaction["client_id"]: object_id for object_id, transaction in stored.items() if "client_id" in transaction}
+
+    # Each transaction's state after the batch so far; None once deleted
+    current = dict(stored)
+    results = []
+    targets = []
+    for mutation in mutations:
+        result = {"client_id": mutation.client_id, "transaction_id": mutation.transaction_id, "status": "applied"}
+        results.append(result)
+        targets.append(None)
+
+        if mutation.op == "add":
+            detail = "client_id is required" if not mutation.client_id else _invalid_values(mutation)
+            if detail:
+                result.update(status="invalid", detail=detail)
+            elif mutation.client_id in client_ids:
+                result.update(status="duplicate", transaction_id=str(client_ids[mutation.client_id]))
+            else:
+                transaction = mutation.transaction.dict()
+                transaction.update(_id=ObjectId(), user_id=user_id, client_id=mutation.client_id)
+                current[transaction["_id"]] = transaction
+                client_ids[mutation.client_id] = transaction["_id"]
+                result["transaction_id"] = str(transaction["_id"])
+                targets[-1] = transaction["_id"]
+            continue
+
+        try:
+            target_id = _target_id(mutation, client_ids)
+        except InvalidId:
+            result.update(status="invalid", detail="Invalid transaction ID format")
+            continue
+        detail = _invalid_values(mutation) if mutation.op == "edit" else None
+        if detail:
+            result.update(status="invalid", detail=detail)
+        elif current.get(target_id) is None:
+            result["status"] = "not_found"
+        elif (
+            mutation.base_seq is not None
+            and target_id in stored
+            and stored[target_id].get("sync_seq", 0) != mutation.base_seq
+        ):
+            result.update(status="conflict", transaction=serialize_transaction(dict(stored[target_id])))
+        else:
+            if mutation.op == "edit":
+                transaction = mutation.transaction.dict()
+                transaction.update(_id=target_id, user_id=user_id)
+                if "client_id" in current[target_id]:
+                    transaction["client_id"] = current[target_id]["client_id"]
+                current[target_id] = transaction
+            else:
+                current[target_id] = None
+            result["transaction_id"] = str(target_id)
+            targets[-1] = target_id
+
+    # The net write per transaction: an add edited offline is inserted
+    # once with its final values, and one added and deleted is never written
+    changed = [
+        object_id for object_id, transaction in current.items()
+        if transaction is not stored.get(object_id) and not (transaction is None and object_id not in stored)
+    ]
+    notifications = []
+    if not changed:
+        return {"results": results, "notifications": notifications}
+
+    # The unusual-expense check compares with the stats from before the batch
+    ensure_spending_stats(user_id)
+    # sync_stamp reserves a seq no other write shares, so a row carrying it
+    # proves this push's write landed
+    stamp = sync_stamp(user_id)
+    operations = []
+    for object_id in changed:
+        transaction = current[object_id]
+        if object_id not in stored:
+            operations.append(InsertOne({**transaction, **stamp}))
+            continue
+        # Only while the row is still the version read above; a write landing
+        # in between makes this one a conflict instead of overwriting it
+        seq = stored[object_id].get("sync_seq")
+        unchanged = {"_id": object_id, "user_id": user_id, "sync_seq": seq if seq is not None else {"$exists": False}}
+        if transaction is None:
+            # Deletes are claimed by stamping first and removed below
+            operations.append(UpdateOne(unchanged, {"$set": stamp}))
+        else:
+            values = {field: value for field, value in transaction.items() if field != "_id"}
+            operations.append(UpdateOne(unchanged, {"$set": {**values, **stamp}}))
+
+    failed = {}
+    try:
+        matched = transactions_collection.bulk_write(operations, ordered=False).matched_count
+    except BulkWriteError as e:
+        # Unordered: everything else was written
+        failed = {changed[error["index"]]: error["code"] for error in e.details["writeErrors"]}
+        matched = e.details["nMatched"]
+        if e.details["writeConcernErrors"]:
+            print(f"Write concern errors in a sync push: {e.details['writeConcernErrors']}")
+
+    def unconfirmed(object_ids: list, expected_seq: int) -> set:
+        """Of object_ids, those not carrying expected_seq anymore or gone"""
+        confirmed = {
+            transaction["_id"]
+            for transaction in transactions_collection.find({"_id": {"$in": object_ids}, "sync_seq": expected_seq}, {"_id": 1})
+        }
+        return set(object_ids) - confirmed
+
+    # Rows changed by someone else since they were read
+    conflicts = set()
+    stored_ids = [object_id for object_id in changed if object_id in stored]
+    if matched < len(stored_ids):
+        conflicts = unconfirmed(stored_ids, stamp["sync_seq"])
+
+    claimed = [object_id for object_id in stored_ids if current[object_id] is None and object_id not in conflicts]
+    if claimed:
+        removed_count = transactions_collection.delete_many(
+            {"_id": {"$in": claimed}, "sync_seq": stamp["sync_seq"]}
+        ).deleted_count
+        if removed_count < len(claimed):
+            # Rows still present were rewritten after the claim; missing ones were deleted here
+            still_present = {
+                transaction["_id"] for transaction in transactions_collection.find({"_id": {"$in": claimed}}, {"_id": 1})
+            }
+            conflicts |= still_present
+
+    removed, added, deleted_ids = [], [], []
+    for object_id in changed:
+        if object_id in failed or object_id in conflicts:
+            continue
+        if object_id in stored:
+            removed.append(stored[object_id])
+        if current[object_id] is None:
+            deleted_ids.append(object_id)
+        else:
+            added.append(current[object_id])
+
+    if conflicts:
+        server_copies = {
+            transaction["_id"]: transaction
+            for transaction in transactions_collection.find({"_id": {"$in": list(conflicts)}})
+        }
+        for result, target_id in zip(results, targets):
+            if target_id in conflicts:
+                result["status"] = "conflict"
+                if target_id in server_copies:
+                    result["transaction"] = serialize_transaction(dict(server_copies[target_id]))
+                else:
+                    result["detail"] = "Deleted on the server"
+
+    if failed:
+        for result, target_id in zip(results, targets):
+            if target_id in failed:
+                # A duplicate client_id is an add another push applied first
+                result["status"] = "duplicate" if failed[target_id] == 11000 else "error"
+        duplicates = [current[object_id]["client_id"] for object_id, code in failed.items() if code == 11000]
+        if duplicates:
+            existing = transactions_collection.find({"user_id": user_id, "client_id": {"$in": duplicates}}, {"client_id": 1})
+            existing_ids = {transaction["client_id"]: str(transaction["_id"]) for transaction in existing}
+            for result in results:
+                if result["status"] == "duplicate" and result["client_id"] in existing_ids:
+                    result["transaction_id"] = existing_ids[result["client_id"]]
+
+    if not (removed or added):
+        return {"results": results, "notifications": notifications}
+
+    record_deletions(user_id, "transactions", deleted_ids)
+
+    # Only the largest recent new expense is worth checking, as in an import
+    recent_cutoff = datetime.utcnow() - timedelta(days=30)
+    new_expenses = [
+        transaction for transaction in added
+        if transaction["_id"] not in stored
+        and transaction["type"] == "expense"
+        and naive_utc(transaction["date"]) >= recent_cutoff
+    ]
+    largest_expense = max(new_expenses, key=lambda transaction: transaction["amount"], default=None)
+    unusual_expense = False
+    try:
+        unusual_expense = largest_expense is not None and detect_unusual_expense(user_id, largest_expense)
+    except Exception as e:
+        # Only the alert is lost; the batch is already written
+        print(f"Error checking pushed expenses: {str(e)}")
+
+    delta = accumulate_delta(new_delta(), removed=removed, added=added)
+    apply_delta(user_id, delta)
+
+    # One allocation pass for the net amount of the whole batch
+    notifications.extend(apply_goal_delta(user_id, delta["inc"]["balance"]))
+    if unusual_expense:
+        notification = create_expense_alert_notification(user_id, largest_expense)
+        if notification:
+            notifications.append(notification)
+    notifications.extend(check_balance_alert(user_id))
+
+    return {"results": results, "notifications": notifications}
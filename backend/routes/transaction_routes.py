@@ -1,62 +1,38 @@
-from fastapi import APIRouter, HTTPException, Depends
-from database import transactions_collection, goals_collection, notifications_collection
+import csv
+import io
+import json
+from fastapi import APIRouter, HTTPException, Depends, File, Query, Response, UploadFile
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from database import transactions_collection
 from models.transaction_model import Transaction
 from bson import ObjectId
-from routes.notification_routes import create_expense_alert_notification, detect_unusual_expense
-from utils import get_current_user
-from datetime import datetime
-from utils import serialize_transaction
-from routes.dashboard_routes import get_dashboard
+from routes.notification_routes import check_balance_alert, create_expense_alert_notification, detect_unusual_expense
+from utils import conditional_get, get_current_user
+from datetime import datetime, timedelta
+from typing import Optional
+from utils import decode_cursor, encode_cursor, keyset_after, serialize_transaction
+from ledger import accumulate_delta, apply_delta, naive_utc, new_delta, record_transaction_change
+from goal_allocation import apply_goal_delta, reallocate_goals, rebuild_goals_from_ledger
+from spending_stats import ensure_spending_stats
+from sync_log import record_deletions, sync_stamp
 
 from bson.errors import InvalidId
 
 router = APIRouter()
 
 
-def check_goal_progress(goal: dict) -> dict | None:
-    """
-    Check if a goal has reached significant progress milestones
-    Returns notification data if a milestone is reached, None otherwise
-    """
-    progress = (goal["current_amount"] / goal["target_amount"]) * 100
-    
-    # Define milestone thresholds
-    milestones = [25, 50, 75, 90, 100]
-    
-    # Find the highest milestone reached
-    reached_milestone = None
-    for milestone in milestones:
-        if progress >= milestone:
-            reached_milestone = milestone
-    
-    if reached_milestone:
-        message = (f"You've reached {reached_milestone}% of your goal '{goal['name']}'! "
-                  f"Current amount: K{goal['current_amount']:.2f}")
-        
-        # Special message for completion
-        if reached_milestone == 100:
-            message = f"Congratulations! You've achieved your goal '{goal['name']}'!"
-        
-        return {
-            "user_id": goal["user_id"],
-            "title": "Goal Progress Update",
-            "message": message,
-            "timestamp": datetime.utcnow().isoformat() + 'Z',  # Add 'Z' to indicate UTC
-            "type": "goalProgress",
-            "isRead": False,
-            "requiresSystemNotification": True,  # Add this flag
-            "milestone": reached_milestone
-        }
-    
-    return None
-
 @router.post("/addtransactions")
 def add_transaction(transaction: Transaction, user_id: str = Depends(get_current_user)):
     print("Received transaction:", transaction.dict())
     transaction_data = transaction.dict()
     transaction_data["user_id"] = user_id
+    # Judged against the spending stats before this expense becomes part of them
+    is_unusual = transaction.type == "expense" and detect_unusual_expense(user_id, transaction_data)
+    transaction_data.update(sync_stamp(user_id))
     result = transactions_collection.insert_one(transaction_data)
     created_transaction = transactions_collection.find_one({"_id": result.inserted_id})
+    record_transaction_change(user_id, added=[transaction_data])
     
     # Initialize notifications list
     notifications = []
@@ -68,15 +44,15 @@ def add_transaction(transaction: Transaction, user_id: str = Depends(get_current
     elif transaction.type == "expense":
         update_goals_for_expense(user_id, transaction.amount)
         
-        # Check for unusual expense and create notification if needed
-        if detect_unusual_expense(user_id, transaction_data):
-            notification_id = create_expense_alert_notification(user_id, transaction_data)
-            notification = notifications_collection.find_one({"_id": ObjectId(notification_id)})
+        # Create a notification if the expense was unusual
+        if is_unusual:
+            notification = create_expense_alert_notification(user_id, transaction_data)
             if notification:
-                notification['id'] = str(notification['_id'])
-                del notification['_id']
                 notifications.append(notification)
 
+    # Low balance is alerted when a write changes the balance, not on reads
+    notifications.extend(check_balance_alert(user_id))
+
     # Return both transaction and notifications data
     response_data = {
         "transaction": serialize_transaction(created_transaction),
@@ -87,148 +63,15 @@ def add_transaction(transaction: Transaction, user_id: str = Depends(get_current
 
 
 def update_goals_for_income(user_id: str, amount: float):
-    remaining_balance = amount
-    goals = goals_collection.find({
-        "user_id": user_id,
-        "completed": {"$ne": True}
-    }).sort("deadline", 1)
-
-    notifications_to_send = []  # Create a list to store notifications
-
-    for goal in goals:
-        target_amount = goal["target_amount"]
-        current_amount = goal["current_amount"]
-        needed_amount = target_amount - current_amount
-
-        if remaining_balance >= needed_amount:
-            goals_collection.update_one(
-                {"_id": goal["_id"]},
-                {
-                    "$set": {
-                        "current_amount": target_amount,
-                        "completed": True,
-                        "completion_date": datetime.utcnow()
-                    }
-                }
-            )
-            
-            updated_goal = goals_collection.find_one({"_id": goal["_id"]})
-            notification_data = check_goal_progress(updated_goal)
-            if notification_data:
-                notification_id = notifications_collection.insert_one(notification_data).inserted_id
-                notification = notifications_collection.find_one({"_id": notification_id})
-                if notification:
-                    notification["id"] = str(notification["_id"])
-                    del notification["_id"]
-                    notifications_to_send.append(notification)
-                
-            remaining_balance -= needed_amount
-        elif remaining_balance > 0:
-            new_amount = current_amount + remaining_balance
-            goals_collection.update_one(
-                {"_id": goal["_id"]},
-                {"$set": {"current_amount": new_amount}}
-            )
-            
-            updated_goal = goals_collection.find_one({"_id": goal["_id"]})
-            notification_data = check_goal_progress(updated_goal)
-            if notification_data:
-                notification_id = notifications_collection.insert_one(notification_data).inserted_id
-                notification = notifications_collection.find_one({"_id": notification_id})
-                if notification:
-                    notification["id"] = str(notification["_id"])
-                    del notification["_id"]
-                    notifications_to_send.append(notification)
-            
-            break
-
-    return notifications_to_send 
+    return apply_goal_delta(user_id, amount)
 
 
 def update_goals_for_expense(user_id: str, amount: float):
-    remaining_decrement = amount
-
-    goals = goals_collection.find({
-        "user_id": user_id,
-        "completed": {"$ne": True}
-    }).sort("deadline", -1)
-
-    for goal in goals:
-        current_amount = goal["current_amount"]
-
-        if current_amount >= remaining_decrement:
-            goals_collection.update_one(
-                {"_id": goal["_id"]},
-                {"$set": {"current_amount": current_amount - remaining_decrement}}
-            )
-            break
-        else:
-            goals_collection.update_one(
-                {"_id": goal["_id"]},
-                {"$set": {"current_amount": 0}}
-            )
-            remaining_decrement -= current_amount
-
-
-def revert_transaction_impact(transaction: dict):
-    """Reverse the impact of a transaction on goals before updating/deleting it"""
-    if transaction["type"] == "income":
-        # For income, we need to decrease goal amounts
-        update_goals_for_expense(transaction["user_id"], transaction["amount"])
-    else:
-        # For expense, we need to increase goal amounts
-        update_goals_for_income(transaction["user_id"], transaction["amount"])
-
-def apply_new_transaction_impact(transaction_data: dict):
-    """Apply the impact of a new or updated transaction on goals"""
-    if transaction_data["type"] == "income":
-        update_goals_for_income(transaction_data["user_id"], transaction_data["amount"])
-    else:
-        update_goals_for_expense(transaction_data["user_id"], transaction_data["amount"])
+    apply_goal_delta(user_id, -amount)
 
 
 def update_goals_from_balance(user_id: str):
-    # Get current balance
-    dashboard = get_dashboard(user_id)
-    current_balance = dashboard["balance"]
-    
-    # Get all active goals
-    goals = goals_collection.find({
-        "user_id": user_id,
-        "completed": {"$ne": True}  # Only get uncompleted goals
-    }).sort("deadline", 1)  # Sort by deadline ascending
-    
-    remaining_balance = current_balance
-    
-    for goal in goals:
-        target_amount = goal["target_amount"]
-        current_amount = goal["current_amount"]
-        needed_amount = target_amount - current_amount
-        
-        if remaining_balance >= needed_amount:
-            # Complete this goal
-            goals_collection.update_one(
-                {"_id": goal["_id"]},
-                {
-                    "$set": {
-                        "current_amount": target_amount,
-                        "completed": True,
-                        "completion_date": datetime.utcnow()
-                    }
-                }
-            )
-            remaining_balance -= needed_amount
-        elif remaining_balance > 0:
-            # Partially fund this goal
-            new_amount = current_amount + remaining_balance
-            goals_collection.update_one(
-                {"_id": goal["_id"]},
-                {"$set": {"current_amount": new_amount}}
-            )
-            remaining_balance = 0
-        
-        if remaining_balance <= 0:
-            break
+    rebuild_goals_from_ledger(user_id)
 
 
 @router.put("/edittransactions/{transaction_id}")
@@ -252,12 +95,10 @@ def update_transaction(
                 detail=f"Transaction {transaction_id} not found for user {user_id}"
             )
         
-        # First, revert the impact of the old transaction
-        revert_transaction_impact(existing_transaction)
-        
         # Update the transaction
         update_data = transaction.dict()
         update_data["user_id"] = user_id
+        update_data.update(sync_stamp(user_id))
         
         result = transactions_collection.update_one(
             {"_id": transaction_object_id, "user_id": user_id},
@@ -265,15 +106,16 @@ def update_transaction(
         )
         
         if result.modified_count == 0:
-            # If update failed, reapply old transaction impact
-            apply_new_transaction_impact(existing_transaction)
             raise HTTPException(
                 status_code=400,
                 detail="Transaction update failed - no modifications made"
             )
         
-        # Apply the impact of the new transaction
-        apply_new_transaction_impact(update_data)
+        record_transaction_change(user_id, removed=[existing_transaction], added=[update_data])
+
+        # Move only the difference between the old and new transaction
+        reallocate_goals(user_id, old_transaction=existing_transaction, new_transaction=update_data)
+        check_balance_alert(user_id)
         
         # Return the updated transaction
         updated_transaction = transactions_collection.find_one({"_id": transaction_object_id})
@@ -292,10 +134,78 @@ def update_transaction(
         )
 
 
+# Fields a client may ask for with fields=; _id is always returned
+TRANSACTION_FIELDS = {"type", "amount", "category", "date", "user_id"}
+
+
+def _parse_date_param(value: str, name: str) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: {value}")
+
+
 # Get Transaction History
-@router.get("/gettransactions")
-def get_transaction_history(user_id: str = Depends(get_current_user)):
-    transactions = transactions_collection.find({"user_id": user_id}).sort("date", -1)  # Sort by date, latest first
+@router.get("/gettransactions", dependencies=[Depends(conditional_get("transactions"))])
+def get_transaction_history(
+    response: Response,
+    user_id: str = Depends(get_current_user),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    transaction_type: Optional[str] = Query(None, alias="type", regex='^(income|expense)$'),
+    category: Optional[str] = Query(None),
+    start_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    min_amount: Optional[float] = Query(None),
+    max_amount: Optional[float] = Query(None),
+    fields: Optional[str] = Query(None)
+):
+    """
+    Transactions latest first. Without a limit the full history is returned.
+    With a limit, the cursor for the next page is sent in the X-Next-Cursor header.
+    """
+    query = {"user_id": user_id}
+    if transaction_type:
+        query["type"] = transaction_type
+    if category:
+        query["category"] = category
+
+    if start_date or end_date:
+        query["date"] = {}
+        if start_date:
+            query["date"]["$gte"] = _parse_date_param(start_date, "start_date")
+        if end_date:
+            query["date"]["$lte"] = _parse_date_param(end_date, "end_date")
+
+    if min_amount is not None or max_amount is not None:
+        query["amount"] = {}
+        if min_amount is not None:
+            query["amount"]["$gte"] = min_amount
+        if max_amount is not None:
+            query["amount"]["$lte"] = max_amount
+
+    if cursor:
+        last_date, last_id = decode_cursor(cursor)
+        query = {"$and": [query, keyset_after("date", last_date, last_id)]}
+
+    projection = None
+    if fields:
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = requested - TRANSACTION_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+        # date is kept so the next cursor can be built from the last row
+        projection = {field: 1 for field in requested | {"date"}}
+
+    transactions = transactions_collection.find(query, projection).sort([("date", -1), ("_id", -1)])
+    if limit:
+        # Fetch one extra row to know whether another page exists
+        transactions = list(transactions.limit(limit + 1))
+        if len(transactions) > limit:
+            transactions = transactions[:limit]
+            last = transactions[-1]
+            response.headers["X-Next-Cursor"] = encode_cursor(last["date"], last["_id"])
+
     serialized_transactions = [serialize_transaction(txn) for txn in transactions]  # Serialize each transaction
     return serialized_transactions
 
@@ -317,9 +227,6 @@ def delete_transaction(transaction_id: str, user_id: str = Depends(get_current_u
                 detail=f"Transaction {transaction_id} not found for user {user_id}"
             )
         
-        # Revert the impact of the transaction before deletion
-        revert_transaction_impact(transaction)
-        
         # Delete the transaction
         result = transactions_collection.delete_one({
             "_id": transaction_object_id,
@@ -327,12 +234,15 @@ def delete_transaction(transaction_id: str, user_id: str = Depends(get_current_u
         })
         
         if result.deleted_count == 0:
-            # If deletion failed, reapply transaction impact
-            apply_new_transaction_impact(transaction)
             raise HTTPException(
                 status_code=400,
                 detail="Transaction deletion failed"
             )
+
+        record_transaction_change(user_id, removed=[transaction])
+        record_deletions(user_id, "transactions", [transaction_object_id])
+        reallocate_goals(user_id, old_transaction=transaction)
+        check_balance_alert(user_id)
         
         return {"message": "Transaction deleted successfully"}
         
@@ -347,4 +257,162 @@ def delete_transaction(transaction_id: str, user_id: str = Depends(get_current_u
             status_code=500,
             detail=f"Failed to delete transaction: {str(e)}"
         )
-    
\ No newline at end of file
+
+
+# Rows written per insert_many during an import
+IMPORT_CHUNK_SIZE = 1000
+# Row errors listed in an import response; the rest are only counted
+MAX_REPORTED_IMPORT_ERRORS = 1000
+
+
+def _iter_import_rows(upload: UploadFile, file_format: str):
+    """Yield (row_number, raw_row) from a CSV or JSON lines upload without loading it whole"""
+    text = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+    if file_format == "csv":
+        for row_number, row in enumerate(csv.DictReader(text), 1):
+            yield row_number, row
+        return
+
+    for row_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            yield row_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, e
+
+
+def _validate_import_row(raw_row) -> dict:
+    if isinstance(raw_row, Exception):
+        raise ValueError(f"Invalid JSON: {raw_row}")
+    if not isinstance(raw_row, dict):
+        raise ValueError("Row must be an object")
+    try:
+        transaction = Transaction(**raw_row)
+    except ValidationError as e:
+        raise ValueError("; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            for error in e.errors()
+        ))
+    if transaction.type not in ("income", "expense"):
+        raise ValueError("type: must be income or expense")
+    return transaction.dict()
+
+
+@router.post("/transactions/import")
+def import_transactions(
+    file: UploadFile = File(...),
+    file_format: Optional[str] = Query(None, alias="format", regex='^(csv|jsonl)$'),
+    user_id: str = Depends(get_current_user)
+):
+    """
+    Import transactions from a CSV (type,amount,category,date columns) or JSON lines file.
+    Valid rows are written in chunks; goals and the unusual-expense check run once
+    over the net effect of the whole file instead of once per row.
+    If the file can't be read to the end, the rows written before that point are
+    kept and reported, with the reason in `stopped`.
+    """
+    if file_format is None:
+        filename = (file.filename or "").lower()
+        file_format = "jsonl" if filename.endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+    imported = 0
+    errors = []
+    error_count = 0
+    delta = new_delta()
+    chunk = []
+    # Only the largest recent expense is worth checking for an alert
+    recent_cutoff = datetime.utcnow() - timedelta(days=30)
+    largest_recent_expense = None
+    unusual_expense = False
+    stopped = None
+    # The largest expense is judged against the stats as they were before the import
+    ensure_spending_stats(user_id)
+
+    def record(committed: list):
+        """Count rows as soon as they are written, so a later failure can't lose them"""
+        nonlocal imported, largest_recent_expense
+        imported += len(committed)
+        accumulate_delta(delta, added=committed)
+        for transaction_data in committed:
+            if (
+                transaction_data["type"] == "expense"
+                and naive_utc(transaction_data["date"]) >= recent_cutoff
+                and (largest_recent_expense is None or transaction_data["amount"] > largest_recent_expense["amount"])
+            ):
+                largest_recent_expense = transaction_data
+
+    def flush():
+        if chunk:
+            stamp = sync_stamp(user_id)
+            for transaction_data in chunk:
+                transaction_data.update(stamp)
+            try:
+                transactions_collection.insert_many(chunk)
+            except BulkWriteError as e:
+                # Inserts are ordered: the rows before the failing one were written
+                record(chunk[:e.details["nInserted"]])
+                raise
+            record(chunk)
+            chunk.clear()
+
+    try:
+        try:
+            for row_number, raw_row in _iter_import_rows(file, file_format):
+                try:
+                    transaction_data = _validate_import_row(raw_row)
+                except ValueError as e:
+                    error_count += 1
+                    if len(errors) < MAX_REPORTED_IMPORT_ERRORS:
+                        errors.append({"row": row_number, "error": str(e)})
+                    continue
+
+                transaction_data["user_id"] = user_id
+                chunk.append(transaction_data)
+
+                if len(chunk) >= IMPORT_CHUNK_SIZE:
+                    flush()
+        except UnicodeDecodeError:
+            stopped = "File must be UTF-8 encoded"
+        # Rows read before an undecodable byte are imported like the rest
+        flush()
+    except Exception as e:
+        # Chunks written before the failure stay written and are finished below
+        if not imported:
+            raise
+        print(f"Import stopped after {imported} rows: {str(e)}")
+        stopped = f"Import failed: {str(e)}"
+
+    if stopped and not imported:
+        raise HTTPException(status_code=400, detail=stopped)
+
+    if imported:
+        try:
+            # Before apply_delta adds this file's expenses to the spending stats
+            unusual_expense = (
+                largest_recent_expense is not None
+                and detect_unusual_expense(user_id, largest_recent_expense)
+            )
+        except Exception as e:
+            # Only the alert is lost; the rows are already written
+            print(f"Error checking imported expenses: {str(e)}")
+        # Whatever was written must be reflected in the ledger summary
+        apply_delta(user_id, delta)
+
+    # One allocation pass for the net amount of the whole file
+    notifications = apply_goal_delta(user_id, delta["inc"]["balance"])
+
+    if unusual_expense:
+        notification = create_expense_alert_notification(user_id, largest_recent_expense)
+        if notification:
+            notifications.append(notification)
+
+    notifications.extend(check_balance_alert(user_id))
+
+    return {
+        "imported": imported,
+        "failed": error_count,
+        "errors": errors,
+        "stopped": stopped,
+        "notifications": notifications
+    }
@@ -0,0 +1,40 @@
+"""
+Build monthly rollups for every user from transactions_collection.
+
+Rollups are maintained incrementally by the transaction write paths; this
+rebuilds them for history written before they existed, or repairs them.
+Users are rebuilt one at a time, so run it when write traffic is low.
+
+Run from the backend directory:
+    python -m scripts.backfill_rollups
+    python -m scripts.backfill_rollups --user-id <id>
+"""
+import argparse
+import time
+
+from database import transactions_collection
+from ledger import get_summary, rebuild_rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", action="append", help="only rebuild these users (repeatable)")
+    args = parser.parse_args()
+
+    user_ids = args.user_id or sorted(transactions_collection.distinct("user_id"))
+
+    started = time.perf_counter()
+    total_rollups = 0
+    for count, user_id in enumerate(user_ids, 1):
+        # The ready flag lives on the ledger summary, so make sure it exists
+        get_summary(user_id)
+        total_rollups += rebuild_rollups(user_id)
+        if count % 100 == 0:
+            print(f"{count}/{len(user_ids)} users")
+
+    elapsed = time.perf_counter() - started
+    print(f"Rebuilt {total_rollups} rollups for {len(user_ids)} users in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Measure event-loop lag while report exports run concurrently.
+
+The app is served in-process over httpx's ASGI transport, so a probe task
+sleeping on the same loop sees exactly the stalls the routes cause.
+Run it on two revisions to compare, e.g. before and after a change:
+
+    python -m scripts.bench_event_loop_lag --user-id <id> --concurrency 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from auth import create_access_token
+from main import app
+
+PROBE_INTERVAL = 0.01
+
+
+async def probe_lag(samples: list, stop: asyncio.Event):
+    """Record how late each short sleep wakes up"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        samples.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+
+async def run(user_id: str, path: str, concurrency: int, rounds: int):
+    token = create_access_token({"sub": user_id})
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers, timeout=None) as client:
+        # Warm up connections and imports outside the measured window
+        await client.get(path)
+
+        samples = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_lag(samples, stop))
+
+        latencies = []
+
+        async def one_request():
+            started = time.perf_counter()
+            response = await client.get(path)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            await asyncio.gather(*(one_request() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await probe
+
+    samples.sort()
+    print(f"{path}: {concurrency} concurrent x {rounds} rounds in {elapsed:.2f}s")
+    print(f"  request latency p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"max={max(latencies) * 1000:.1f}ms")
+    if samples:
+        p99 = samples[int(len(samples) * 0.99) - 1] if len(samples) >= 100 else samples[-1]
+        print(f"  loop lag p50={statistics.median(samples) * 1000:.1f}ms "
+              f"p99={p99 * 1000:.1f}ms max={samples[-1] * 1000:.1f}ms ({len(samples)} probes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", required=True, help="user whose data the reports are built from")
+    parser.add_argument("--path", default="/export-financial-report")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.user_id, args.path, args.concurrency, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Time the Excel export and measure its peak memory by ledger size.
+
+Each size runs in a fresh process that writes a report with that many
+synthetic transactions, generated one at a time like a Mongo cursor
+yields them, so the peak RSS is the renderer's own. With the write-only
+workbook it should stay flat from 1k to 1M rows.
+
+Run from the backend directory:
+    python -m scripts.bench_excel_export
+    python -m scripts.bench_excel_export --rows 1000 100000 1000000 --keep
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from report_rendering import LEDGER_HEADERS, create_financial_report_excel
+
+CATEGORIES = ["Food", "Transport", "Rent", "Utilities", "Entertainment", "Healthcare", "Salary", "Freelance"]
+
+REPORT_DATA = {
+    "summary": {
+        "period_start": "2024-01-01T00:00:00",
+        "period_end": "2024-12-31T23:59:59",
+        "total_income": 48000.0,
+        "total_expense": 31250.5,
+        "net_income": 16749.5,
+        "savings_rate": 34.9
+    },
+    "income_by_category": [{"category": "Salary", "amount": 42000.0}, {"category": "Freelance", "amount": 6000.0}],
+    "expense_by_category": [{"category": category, "amount": 5208.4} for category in CATEGORIES[:6]],
+    "goals_summary": [
+        {"name": "Emergency fund", "target_amount": 10000.0, "current_amount": 6500.0, "progress": 65.0,
+         "completed": False, "completion_date": None}
+    ]
+}
+
+
+def synthetic_transactions(count: int):
+    start = datetime(2024, 1, 1)
+    step = timedelta(days=365) / max(count, 1)
+    for i in range(count):
+        category = CATEGORIES[i % len(CATEGORIES)]
+        yield {
+            "date": start + step * i,
+            "type": "income" if category in ("Salary", "Freelance") else "expense",
+            "category": category,
+            "amount": float(i % 9973) + 0.25
+        }
+
+
+def run_one(rows: int, keep: bool) -> dict:
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    widths = [19, len("expense"), max(len(category) for category in CATEGORIES), len(f"{9972.25:,.2f}")]
+    assert len(widths) == len(LEDGER_HEADERS)
+
+    started = time.perf_counter()
+    create_financial_report_excel(REPORT_DATA, path, synthetic_transactions(rows), widths)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_second": rows / elapsed if elapsed > 0 else 0.0,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "file_mb": os.path.getsize(path) / 1024 / 1024,
+        "path": path
+    }
+    if not keep:
+        os.remove(path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--keep", action="store_true", help="keep the generated workbooks")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(run_one(args.worker, args.keep)))
+        return
+
+    print(f"{'rows':>9}  {'seconds':>8}  {'rows/s':>9}  {'peak RSS':>9}  {'file':>8}")
+    for rows in args.rows:
+        command = [sys.executable, "-m", "scripts.bench_excel_export", "--worker", str(rows)]
+        if args.keep:
+            command.append("--keep")
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"{rows:>9}  failed:\n{completed.stderr}")
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        print(f"{result['rows']:>9}  {result['seconds']:>8.2f}  {result['rows_per_second']:>9.0f}  "
+              f"{result['peak_rss_mb']:>7.1f}MB  {result['file_mb']:>6.1f}MB"
+              + (f"  {result['path']}" if args.keep else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Compare the batch forecaster with the per-series LinearRegression loop it replaced.
+
+Synthetic monthly rollups are generated for users with 5, 50 and 200
+categories; both implementations forecast them and the script reports the
+time per forecast and the largest difference between their outputs.
+Needs pandas and scikit-learn for the reference loop.
+
+Run from the backend directory:
+    python -m scripts.bench_forecast
+    python -m scripts.bench_forecast --categories 5 50 200 --months 36 --repeat 20
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+
+from forecasting import forecast_rollups
+
+
+def make_rollups(category_count: int, months: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    rollups = []
+    for index in range(category_count):
+        transaction_type = "income" if index % 5 == 0 else "expense"
+        base = rng.uniform(50, 5000)
+        trend = rng.uniform(-20, 20)
+        # Categories start at different months and skip some, like real data
+        first = rng.randrange(0, months // 2)
+        for month in range(first, months):
+            if rng.random() < 0.15:
+                continue
+            year, month_index = divmod(2021 * 12 + month, 12)
+            rollups.append({
+                "month": datetime(year, month_index + 1, 1),
+                "type": transaction_type,
+                "category": f"category-{index}",
+                "sum": max(0.0, base + trend * month + rng.gauss(0, base * 0.1)),
+                "count": rng.randint(1, 30)
+            })
+    rollups.sort(key=lambda rollup: rollup["month"])
+    return rollups
+
+
+# Reference implementation: one pandas regroup and one sklearn fit per series
+
+def legacy_forecast_time_series(data: pd.DataFrame, forecast_months: int):
+    if len(data) < 2:
+        avg_amount = 0 if len(data) == 0 else data['amount'].mean()
+        future_dates = [datetime.now() + timedelta(days=30 * i) for i in range(forecast_months)]
+        return [{'date': date.isoformat(), 'amount': avg_amount} for date in future_dates]
+
+    X = np.arange(len(data)).reshape(-1, 1)
+    y = data['amount'].values
+    model = LinearRegression()
+    model.fit(X, y)
+
+    last_date = data['date'].iloc[-1]
+    future_dates = [last_date + timedelta(days=30 * i) for i in range(1, forecast_months + 1)]
+    future_X = np.arange(len(data), len(data) + forecast_months).reshape(-1, 1)
+    predictions = np.maximum(model.predict(future_X), 0)
+    return [{'date': date.isoformat(), 'amount': float(amount)} for date, amount in zip(future_dates, predictions)]
+
+
+def legacy_forecast(rollups: list, forecast_months: int) -> tuple:
+    df = pd.DataFrame(rollups)
+    df['date'] = pd.to_datetime(df['month'])
+    df['amount'] = df['sum'].astype(float)
+    income_df = df[df['type'] == 'income']
+    expense_df = df[df['type'] == 'expense']
+
+    def monthly(frame):
+        return frame.groupby(pd.Grouper(key='date', freq='M'))['amount'].sum().reset_index()
+
+    income_forecast = legacy_forecast_time_series(monthly(income_df), forecast_months)
+    expense_forecast = legacy_forecast_time_series(monthly(expense_df), forecast_months)
+    category_forecasts = {'income': {}, 'expense': {}}
+    for name, frame in (('income', income_df), ('expense', expense_df)):
+        for category in frame['category'].unique():
+            category_forecasts[name][category] = legacy_forecast_time_series(
+                monthly(frame[frame['category'] == category]), forecast_months
+            )
+    return income_forecast, expense_forecast, category_forecasts
+
+
+def max_difference(legacy: tuple, batch: tuple) -> float:
+    pairs = [(legacy[0], batch[0]), (legacy[1], batch[1])]
+    for name in ('income', 'expense'):
+        for category, forecast in legacy[2][name].items():
+            pairs.append((forecast, batch[2][name][category]))
+    return max(
+        abs(a['amount'] - b['amount'])
+        for expected, actual in pairs
+        for a, b in zip(expected, actual)
+    )
+
+
+def timed(function, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--categories", type=int, nargs="+", default=[5, 50, 200])
+    parser.add_argument("--months", type=int, default=36)
+    parser.add_argument("--forecast-months", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'categories':>10} {'rollups':>8} {'loop ms':>10} {'batch ms':>10} {'speedup':>8} {'max diff':>10}")
+    for category_count in args.categories:
+        rollups = make_rollups(category_count, args.months)
+        legacy = legacy_forecast(rollups, args.forecast_months)
+        batch = forecast_rollups(rollups, args.forecast_months)
+
+        loop_time = timed(lambda: legacy_forecast(rollups, args.forecast_months), args.repeat)
+        batch_time = timed(lambda: forecast_rollups(rollups, args.forecast_months), args.repeat)
+        print(f"{category_count:>10} {len(rollups):>8} {loop_time * 1000:>10.2f} {batch_time * 1000:>10.2f} "
+              f"{loop_time / batch_time:>7.1f}x {max_difference(legacy, batch):>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Measure /dashboard latency while report exports run concurrently.
+
+The app is served in-process over httpx's ASGI transport. Dashboard
+requests are timed first on their own, then while --exports clients keep
+requesting exports for --duration seconds, so a render that holds the
+event loop shows up directly as dashboard latency. Run it on two revisions
+to compare, or with different TOEPWAR_REPORT_WORKERS. Every export asks
+for a different end date so it renders; --cached lets the report cache
+answer repeats instead.
+
+    python -m scripts.bench_report_exports --user-id <id> --exports 8
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime
+
+import httpx
+
+import report_rendering
+from auth import create_access_token
+from main import app
+
+EXPORT_PATHS = ("/export-financial-report", "/export-financial-report-pdf")
+
+
+def percentile(samples: list, fraction: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def report(label: str, latencies: list):
+    print(f"  {label}: {len(latencies)} requests, p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p95={percentile(latencies, 0.95) * 1000:.1f}ms max={max(latencies) * 1000:.1f}ms")
+
+
+async def poll_dashboard(client: httpx.AsyncClient, latencies: list, stop: asyncio.Event, interval: float):
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get("/dashboard")
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(interval)
+
+
+async def export_loop(client: httpx.AsyncClient, path: str, counts: dict, stop: asyncio.Event, cached: bool):
+    while not stop.is_set():
+        # A new end date is a new cache key
+        params = {} if cached else {"end_date": datetime.now().isoformat()}
+        started = time.perf_counter()
+        response = await client.get(path, params=params)
+        if response.status_code == 503:
+            counts["rejected"] += 1
+            await asyncio.sleep(0.5)
+            continue
+        response.raise_for_status()
+        counts["exports"] += 1
+        counts["bytes"] += len(response.content)
+        counts["seconds"].append(time.perf_counter() - started)
+
+
+async def run(user_id: str, exports: int, dashboards: int, duration: float, interval: float, cached: bool):
+    token = create_access_token({"sub": user_id})
+    headers = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", headers=headers, timeout=None) as client:
+        # Start the render processes and warm the routes outside the measured windows
+        await asyncio.to_thread(report_rendering.warm_pool)
+        for path in ("/dashboard",) + EXPORT_PATHS:
+            (await client.get(path)).raise_for_status()
+
+        print(f"Report workers: {report_rendering.REPORT_WORKERS}, "
+              f"{exports} export clients, {dashboards} dashboard clients, {duration:.0f}s per phase")
+
+        idle = []
+        stop = asyncio.Event()
+        pollers = [asyncio.create_task(poll_dashboard(client, idle, stop, interval)) for _ in range(dashboards)]
+        await asyncio.sleep(duration)
+        stop.set()
+        await asyncio.gather(*pollers)
+        report("dashboard, no exports", idle)
+
+        busy = []
+        counts = {"exports": 0, "rejected": 0, "bytes": 0, "seconds": []}
+        stop = asyncio.Event()
+        tasks = [asyncio.create_task(poll_dashboard(client, busy, stop, interval)) for _ in range(dashboards)]
+        tasks += [
+            asyncio.create_task(export_loop(client, EXPORT_PATHS[i % len(EXPORT_PATHS)], counts, stop, cached))
+            for i in range(exports)
+        ]
+        await asyncio.sleep(duration)
+        stop.set()
+        await asyncio.gather(*tasks)
+        report("dashboard, during exports", busy)
+        if counts["seconds"]:
+            report("exports", counts["seconds"])
+        print(f"  {counts['exports']} exports ({counts['bytes'] / 1024 / 1024:.1f}MB), "
+              f"{counts['rejected']} rejected with 503")
+
+    report_rendering.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", required=True, help="user whose data the reports are built from")
+    parser.add_argument("--exports", type=int, default=8, help="concurrent export clients")
+    parser.add_argument("--dashboards", type=int, default=4, help="concurrent dashboard clients")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per phase")
+    parser.add_argument("--interval", type=float, default=0.05, help="pause between a client's dashboard requests")
+    parser.add_argument("--cached", action="store_true", help="repeat the same export so the report cache serves it")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.user_id, args.exports, args.dashboards, args.duration, args.interval, args.cached))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Measure worker cold start: import time, lifespan startup time and RSS.
+
+Every sample is a fresh interpreter that imports main (as uvicorn does) and
+then runs the app's lifespan startup, so nothing is shared between samples.
+Run it on two revisions to compare before and after, and with --warmup to
+see what TOEPWAR_WARMUP=1 moves from the first request into startup:
+
+    python -m scripts.bench_startup --samples 5
+    python -m scripts.bench_startup --samples 5 --warmup
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ("numpy", "pandas", "sklearn", "openpyxl", "reportlab", "grpc")
+
+# Runs inside each fresh interpreter and prints one JSON line
+WORKER = """
+import asyncio, json, resource, sys, time
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+started = time.perf_counter()
+from main import app
+imported = time.perf_counter()
+rss_after_import = rss_mb()
+
+async def startup():
+    async with app.router.lifespan_context(app):
+        pass
+
+asyncio.run(startup())
+ready = time.perf_counter()
+
+print(json.dumps({
+    "import_s": imported - started,
+    "startup_s": ready - imported,
+    "rss_import_mb": rss_after_import,
+    "rss_ready_mb": rss_mb(),
+    "heavy": [name for name in HEAVY_MODULES if name in sys.modules]
+}))
+"""
+
+
+def run_sample(env: dict) -> dict:
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", f"HEAVY_MODULES = {HEAVY_MODULES!r}\n{WORKER}"],
+        cwd=backend_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Worker failed to start:\n{result.stderr}")
+    # The app may print during startup; the measurement is the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--warmup", action="store_true", help="set TOEPWAR_WARMUP=1 in the workers")
+    parser.add_argument("--ensure-indexes", action="store_true", help="include index creation in startup")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env["TOEPWAR_WARMUP"] = "1" if args.warmup else "0"
+    env["TOEPWAR_ENSURE_INDEXES"] = "1" if args.ensure_indexes else "0"
+
+    samples = [run_sample(env) for _ in range(args.samples)]
+
+    def summary(key: str, scale: float = 1.0) -> str:
+        values = [sample[key] * scale for sample in samples]
+        return f"median={statistics.median(values):.1f} max={max(values):.1f}"
+
+    print(f"{args.samples} workers, warmup={'on' if args.warmup else 'off'}")
+    print(f"  import      ms  {summary('import_s', 1000)}")
+    print(f"  startup     ms  {summary('startup_s', 1000)}")
+    print(f"  rss import  MB  {summary('rss_import_mb')}")
+    print(f"  rss ready   MB  {summary('rss_ready_mb')}")
+    print(f"  heavy modules loaded: {', '.join(samples[-1]['heavy']) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Check that writes with timezone-aware dates keep the ledger in step.
+
+Dates read back from Mongo are naive UTC, while a client may send one with
+an offset ("...Z"). Each case below writes a throwaway transaction for the
+user through the API, mixing the two, and must get a success response with
+the stored ledger summary matching one computed from the transactions.
+The transactions are deleted again at the end.
+
+Run from the backend directory against a test database:
+    python -m scripts.check_aware_dates --user-id <id>
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import asyncio
+import sys
+
+import httpx
+
+from auth import create_access_token
+from ledger import compute_summary, get_summary
+from main import app
+
+SUMMARY_FIELDS = ("total_income", "total_expense", "transaction_count", "last_transaction_date")
+
+
+def _summary_drift(user_id: str) -> dict:
+    stored, expected = get_summary(user_id), compute_summary(user_id)
+    return {
+        field: (stored.get(field), expected[field])
+        for field in SUMMARY_FIELDS
+        if stored.get(field) != expected[field]
+    }
+
+
+def _report(name: str, response: httpx.Response, user_id: str) -> bool:
+    drift = _summary_drift(user_id)
+    passed = response.is_success and not drift
+    print(f"{'ok  ' if passed else 'FAIL'} {name}: {response.status_code}{f', drift {drift}' if drift else ''}")
+    return passed
+
+
+async def check_edit(client: httpx.AsyncClient, user_id: str, created: list) -> bool:
+    """Edit a transaction stored with a naive date to a later date sent with Z"""
+    transaction = {"type": "expense", "amount": 1, "category": "check_aware_dates", "date": "2100-01-01T00:00:00"}
+    response = await client.post("/addtransactions", json=transaction)
+    response.raise_for_status()
+    transaction_id = response.json()["transaction"]["_id"]
+    created.append(transaction_id)
+
+    response = await client.put(
+        f"/edittransactions/{transaction_id}",
+        json={**transaction, "amount": 2, "date": "2100-01-02T00:00:00Z"}
+    )
+    return _report("edit with a Z date", response, user_id)
+
+
+async def check_push(client: httpx.AsyncClient, user_id: str, created: list) -> bool:
+    """Push an edit with a Z date to a row stored with a naive one, and an add with an offset"""
+    transaction = {"type": "income", "amount": 1, "category": "check_aware_dates", "date": "2100-01-01T00:00:00"}
+    response = await client.post("/addtransactions", json=transaction)
+    response.raise_for_status()
+    transaction_id = response.json()["transaction"]["_id"]
+    created.append(transaction_id)
+
+    response = await client.post("/sync/push", json={"mutations": [
+        {"op": "edit", "transaction_id": transaction_id,
+         "transaction": {**transaction, "amount": 2, "date": "2100-01-03T00:00:00Z"}},
+        {"op": "add", "client_id": f"check_aware_dates-{transaction_id}",
+         "transaction": {**transaction, "date": "2100-01-02T01:00:00+02:00"}}
+    ]})
+    results = response.json()["results"] if response.is_success else []
+    # The add's server id, so it is deleted again
+    created.extend(result["transaction_id"] for result in results[1:] if result["status"] == "applied")
+    if any(result["status"] != "applied" for result in results):
+        print(f"FAIL push results: {results}")
+        return False
+    return _report("push with Z and offset dates", response, user_id)
+
+
+async def run(user_id: str) -> bool:
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': user_id, 'role': 'user'})}"}
+    transport = httpx.ASGITransport(app=app)
+    created = []
+    ok = True
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://check", headers=headers) as client:
+        try:
+            for check in (check_edit, check_push):
+                ok = await check(client, user_id, created) and ok
+        finally:
+            for transaction_id in created:
+                await client.delete(f"/deletetransactions/{transaction_id}")
+
+    passed = not _summary_drift(user_id)
+    print(f"{'ok  ' if passed else 'FAIL'} summary after cleanup")
+    return ok and passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", required=True, help="user the throwaway transactions are written for")
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(run(args.user_id)) else 1)
+
+
+if __name__ == "__main__":
+    main()
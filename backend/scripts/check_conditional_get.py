@@ -0,0 +1,103 @@
+"""
+Check what conditional GETs of a user's data cost in Mongo round trips.
+
+Every command sent to Mongo, by pymongo or Motor, is counted with a
+command listener. Each route is fetched once to get its ETag and warm the
+principal and version caches, then again with If-None-Match: the second
+request must be answered with a 304. With a shared response cache
+(TOEPWAR_RESPONSE_CACHE_URL=redis://...) no command may be sent; without
+one, only the user's data_versions lookup. Then a goal is added and
+deleted again, which must change every ETag.
+
+    TOEPWAR_RESPONSE_CACHE_URL=redis://localhost:6379 python -m scripts.check_conditional_get --user-id <id>
+
+Exits non-zero if any check fails.
+"""
+import argparse
+import asyncio
+import sys
+import threading
+
+import httpx
+from pymongo import monitoring
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = []
+
+    def started(self, event):
+        with self._lock:
+            self.commands.append((event.command_name, event.command.get(event.command_name)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def take(self) -> list:
+        with self._lock:
+            commands, self.commands = self.commands, []
+        return commands
+
+
+# Listeners only apply to clients created after they are registered
+counter = CommandCounter()
+monitoring.register(counter)
+
+from auth import create_access_token  # noqa: E402
+from main import app  # noqa: E402
+from response_cache import VERSIONS_SHARED  # noqa: E402
+
+PATHS = ("/dashboard", "/goals", "/gettransactions", "/gettransactions?limit=20", "/getnotifications")
+
+
+async def run(user_id: str) -> bool:
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': user_id, 'role': 'user'})}"}
+    transport = httpx.ASGITransport(app=app)
+    ok = True
+
+    # Without a shared cache the version is read on every request
+    allowed = [] if VERSIONS_SHARED else [("find", "data_versions")]
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://check", headers=headers) as client:
+        etags = {}
+        for path in PATHS:
+            response = await client.get(path)
+            response.raise_for_status()
+            etags[path] = response.headers.get("etag")
+            counter.take()
+
+            response = await client.get(path, headers={"If-None-Match": etags[path]})
+            commands = counter.take()
+            passed = response.status_code == 304 and commands == allowed and not response.content
+            ok = ok and passed
+            print(f"{'ok  ' if passed else 'FAIL'} {path}: {response.status_code}, ETag {etags[path]}, "
+                  f"{len(commands)} Mongo commands {commands if commands else ''}")
+
+        # Any write moves the user to a new data version
+        goal = {"name": "check_conditional_get", "target_amount": 1, "deadline": "2100-01-01T00:00:00Z"}
+        response = await client.post("/goal", json=goal)
+        response.raise_for_status()
+        (await client.delete(f"/deletegoals/{response.json()['_id']}")).raise_for_status()
+        for path in PATHS:
+            response = await client.get(path, headers={"If-None-Match": etags[path]})
+            passed = response.status_code == 200 and response.headers.get("etag") != etags[path]
+            ok = ok and passed
+            print(f"{'ok  ' if passed else 'FAIL'} {path} after a write: {response.status_code}")
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user-id", required=True, help="user whose data is fetched")
+    args = parser.parse_args()
+
+    sys.exit(0 if asyncio.run(run(args.user_id)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Create the indexes listed in indexes.INDEX_MANIFEST and report drift.
+
+Run from the backend directory:
+    python -m scripts.ensure_indexes            # create, then verify
+    python -m scripts.ensure_indexes --verify   # verify only
+"""
+import argparse
+
+from indexes import ensure_indexes, verify_indexes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--verify", action="store_true", help="only compare live indexes with the manifest")
+    args = parser.parse_args()
+
+    if not args.verify:
+        errors = ensure_indexes()
+        for collection_name, error in errors.items():
+            print(f"Failed to create indexes on {collection_name}: {error}")
+
+    report = verify_indexes()
+    if not report:
+        print("All indexes match the manifest")
+        return 0
+
+    for collection_name, drift in report.items():
+        print(f"{collection_name}:")
+        for kind in ("missing", "mismatched", "extra"):
+            if drift[kind]:
+                print(f"  {kind}: {', '.join(drift[kind])}")
+
+    # Extra indexes are reported but don't fail the check
+    return 1 if any(drift["missing"] or drift["mismatched"] for drift in report.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,80 @@
+"""
+Convert notification timestamps stored as ISO strings into datetimes.
+
+Older alerts stored "timestamp" as an ISO string with a 'Z' suffix while
+goal reminders stored datetimes, so sorting on it mixed the two types. The
+paginated /getnotifications feed needs them all to be datetimes; run this
+once before clients start paging. It also drops the former user_timestamp
+index, replaced by user_timestamp_id, and creates the notification indexes.
+
+Run from the backend directory:
+    python -m scripts.normalize_notification_timestamps --dry-run
+    python -m scripts.normalize_notification_timestamps
+"""
+import argparse
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from database import notifications_collection
+from indexes import ensure_indexes
+
+BATCH_SIZE = 1000
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ISO 8601 string, with 'Z' or an offset or naive UTC, as a naive UTC datetime"""
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="count what would change without writing")
+    args = parser.parse_args()
+
+    converted = 0
+    unparseable = []
+    updates = []
+    for notification in notifications_collection.find({"timestamp": {"$type": "string"}}, {"timestamp": 1}):
+        try:
+            timestamp = parse_timestamp(notification["timestamp"])
+        except ValueError:
+            unparseable.append(str(notification["_id"]))
+            continue
+        # Matching the string too leaves documents rewritten meanwhile alone
+        updates.append(UpdateOne(
+            {"_id": notification["_id"], "timestamp": notification["timestamp"]},
+            {"$set": {"timestamp": timestamp}}
+        ))
+        if len(updates) >= BATCH_SIZE:
+            if not args.dry_run:
+                notifications_collection.bulk_write(updates, ordered=False)
+            converted += len(updates)
+            updates = []
+
+    if updates and not args.dry_run:
+        notifications_collection.bulk_write(updates, ordered=False)
+    converted += len(updates)
+
+    print(f"{'Would convert' if args.dry_run else 'Converted'} {converted} timestamps")
+    if unparseable:
+        print(f"Left {len(unparseable)} unparseable timestamps: {', '.join(unparseable[:20])}")
+
+    if not args.dry_run:
+        try:
+            notifications_collection.drop_index("user_timestamp")
+            print("Dropped index user_timestamp")
+        except OperationFailure:
+            pass  # Already gone
+        for collection_name, error in ensure_indexes().items():
+            print(f"Failed to create indexes on {collection_name}: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Rebuild ledger summaries from transactions_collection and report drift.
+
+Run from the backend directory:
+    python -m scripts.reconcile_ledger          # report only
+    python -m scripts.reconcile_ledger --fix    # overwrite drifted summaries
+"""
+import argparse
+import json
+
+from ledger import reconcile_summaries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fix", action="store_true", help="overwrite missing or drifted summaries")
+    args = parser.parse_args()
+
+    report = reconcile_summaries(fix=args.fix)
+
+    print(f"Checked {report['checked']} users")
+    print(f"Missing summaries: {len(report['missing'])}")
+    print(f"Drifted summaries: {len(report['drifted'])}")
+    print(f"Orphaned summaries: {len(report['orphaned'])}")
+    for user_id, drift in report["drifted"].items():
+        print(f"  {user_id}: {json.dumps(drift, default=str)}")
+    if args.fix and (report["missing"] or report["drifted"] or report["orphaned"]):
+        print("Summaries rebuilt")
+
+    # Non-zero exit lets a cron job alert on drift
+    return 1 if report["drifted"] and not args.fix else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
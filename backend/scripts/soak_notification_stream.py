@@ -0,0 +1,207 @@
+"""
+Hold thousands of /notifications/stream connections open against a server.
+
+Connections are spread over --users soak users, inserted into the users
+collection for the run and deleted afterwards, so point the server and
+this script at a test database. Tokens are signed locally, so SECRET_KEY
+must match the server's. Every connection must keep receiving heartbeats;
+the script reports how many stayed connected, connect latency, heartbeat
+gaps and the server's memory per connection.
+
+Start a local server and soak it, with short heartbeats so gaps show up:
+
+    python -m scripts.soak_notification_stream --spawn-server --connections 5000 --duration 300
+
+or soak one already running:
+
+    python -m scripts.soak_notification_stream --url http://localhost:8000 --pid <server pid>
+
+Each connection is a file descriptor on both ends; raise `ulimit -n` first.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from auth import create_access_token
+from database import users_collection
+
+
+def rss_mb(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+class Stats:
+    def __init__(self):
+        self.connected = 0
+        self.connect_seconds = []
+        self.heartbeats = 0
+        self.events = 0
+        self.max_gap = 0.0
+        self.errors = {}
+        self.dropped = 0
+
+    def error(self, e: Exception):
+        name = type(e).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+async def hold(client: httpx.AsyncClient, user_id: str, stats: Stats, stop: asyncio.Event):
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': user_id, 'role': 'user'})}"}
+    started = time.perf_counter()
+    try:
+        async with client.stream("GET", "/notifications/stream", headers=headers) as response:
+            response.raise_for_status()
+            stats.connected += 1
+            stats.connect_seconds.append(time.perf_counter() - started)
+            last = time.perf_counter()
+            try:
+                lines = response.aiter_lines()
+                while not stop.is_set():
+                    line = await lines.__anext__()
+                    if line.startswith(": heartbeat"):
+                        stats.heartbeats += 1
+                    elif line.startswith("event: notification"):
+                        stats.events += 1
+                    else:
+                        continue
+                    now = time.perf_counter()
+                    stats.max_gap = max(stats.max_gap, now - last)
+                    last = now
+            finally:
+                stats.connected -= 1
+            if not stop.is_set():
+                stats.dropped += 1
+    except StopAsyncIteration:
+        if not stop.is_set():
+            stats.dropped += 1
+    except Exception as e:
+        stats.error(e)
+
+
+def spawn_server(port: int, heartbeat: float) -> subprocess.Popen:
+    env = dict(os.environ, TOEPWAR_SSE_HEARTBEAT=str(heartbeat), TOEPWAR_GOAL_REMINDER_INTERVAL="0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--limit-concurrency", "1000000", "--backlog", "4096"],
+        env=env
+    )
+
+
+async def wait_for_server(url: str, seconds: float):
+    deadline = time.monotonic() + seconds
+    async with httpx.AsyncClient(base_url=url) as client:
+        while True:
+            try:
+                await client.get("/docs")
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+def create_soak_users(count: int) -> list:
+    run_id = f"{os.getpid()}-{int(time.time())}"
+    result = users_collection.insert_many([
+        {
+            "username": f"soak-{run_id}-{i}",
+            "email": f"soak-{run_id}-{i}@soak.invalid",
+            "password": "",
+            "status": "active"
+        }
+        for i in range(count)
+    ])
+    return result.inserted_ids
+
+
+async def run(args, pid: int | None, user_ids: list):
+    stats = Stats()
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    timeout = httpx.Timeout(30.0, read=None)
+
+    rss_before = rss_mb(pid) if pid else None
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client:
+        tasks = []
+        for index in range(args.connections):
+            user_id = user_ids[index % len(user_ids)]
+            tasks.append(asyncio.create_task(hold(client, user_id, stats, stop)))
+            if args.ramp and index % 100 == 99:
+                await asyncio.sleep(args.ramp / (args.connections / 100))
+
+        started = time.monotonic()
+        while time.monotonic() - started < args.duration:
+            await asyncio.sleep(args.report_every)
+            rss = rss_mb(pid) if pid else None
+            print(f"[{time.monotonic() - started:6.0f}s] connected={stats.connected} heartbeats={stats.heartbeats} "
+                  f"events={stats.events} dropped={stats.dropped} errors={sum(stats.errors.values())}"
+                  + (f" server_rss={rss:.0f}MB" if rss is not None else ""))
+
+        held = stats.connected
+        rss_after = rss_mb(pid) if pid else None
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(f"\nHeld {held}/{args.connections} connections for {args.duration}s")
+    if stats.connect_seconds:
+        connect = sorted(stats.connect_seconds)
+        print(f"Connect: p50={statistics.median(connect) * 1000:.1f}ms "
+              f"p99={connect[int(len(connect) * 0.99) - 1] * 1000:.1f}ms")
+    print(f"Heartbeats: {stats.heartbeats}, longest gap {stats.max_gap:.1f}s")
+    print(f"Dropped by server: {stats.dropped}")
+    for name, count in stats.errors.items():
+        print(f"Error {name}: {count}")
+    if rss_before is not None and rss_after is not None and held:
+        print(f"Server RSS {rss_before:.0f}MB -> {rss_after:.0f}MB "
+              f"({(rss_after - rss_before) * 1024 / held:.1f}KB per connection)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--connections", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=500, help="distinct user ids the connections are spread over")
+    parser.add_argument("--duration", type=float, default=120, help="seconds to hold the connections")
+    parser.add_argument("--ramp", type=float, default=10, help="seconds over which to open them")
+    parser.add_argument("--report-every", type=float, default=10)
+    parser.add_argument("--pid", type=int, help="server pid, to report its memory")
+    parser.add_argument("--spawn-server", action="store_true", help="start uvicorn on --port and soak it")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--heartbeat", type=float, default=5, help="heartbeat interval for a spawned server")
+    args = parser.parse_args()
+
+    server = None
+    pid = args.pid
+    if args.spawn_server:
+        args.url = f"http://127.0.0.1:{args.port}"
+        server = spawn_server(args.port, args.heartbeat)
+        pid = server.pid
+    user_ids = create_soak_users(args.users)
+    try:
+        if server:
+            asyncio.run(wait_for_server(args.url, 60))
+        asyncio.run(run(args, pid, [str(user_id) for user_id in user_ids]))
+    finally:
+        users_collection.delete_many({"_id": {"$in": user_ids}})
+        if server:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
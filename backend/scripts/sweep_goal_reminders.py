@@ -0,0 +1,33 @@
+"""
+Run one goal reminder sweep now and report its throughput.
+
+The app runs the same sweep every TOEPWAR_GOAL_REMINDER_INTERVAL seconds;
+use the goals/s figure to size that interval. This run ignores the
+scheduler's lease, and reminders already sent are never sent twice, so it
+is safe to run alongside the app.
+
+Run from the backend directory:
+    python -m scripts.sweep_goal_reminders
+    python -m scripts.sweep_goal_reminders --batch-size 5000
+"""
+import argparse
+
+import goal_reminders
+from notification_outbox import outbox
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=goal_reminders.SWEEP_BATCH_SIZE,
+                        help="open goals read and evaluated per batch")
+    args = parser.parse_args()
+
+    goal_reminders.SWEEP_BATCH_SIZE = args.batch_size
+    stats = goal_reminders.sweep_goal_reminders()
+    outbox.flush()
+    print(f"Swept {stats['goals']} open goals in {stats['seconds']:.2f}s "
+          f"({stats['goals_per_second']:.0f} goals/s), sent {stats['notifications']} reminders")
+
+
+if __name__ == "__main__":
+    main()
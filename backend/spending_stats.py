@@ -0,0 +1,194 @@
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from pymongo import ReplaceOne, UpdateOne
+from database import transactions_collection, spending_stats_collection
+
+# Running expense statistics per user, one document per category
+# ("<user_id>:<category>") and one across all expenses ("<user_id>:*").
+# Every expense contributes with weight exp(-age / DECAY_DAYS), so count, sum
+# and sum of squares describe roughly the last DECAY_DAYS of spending without
+# ever re-reading it. Documents store the state as of updated_at.
+DECAY_DAYS = 30
+DECAY_MS = DECAY_DAYS * 24 * 60 * 60 * 1000
+PEAK_WINDOW = timedelta(days=DECAY_DAYS)
+
+# Expenses older than this contribute less than e^-8 and are skipped on rebuild
+REBUILD_HORIZON = timedelta(days=DECAY_DAYS * 8)
+
+# "all" compares an expense with every recent expense, "category" with recent
+# expenses in the same category. Overridable per call.
+UNUSUAL_EXPENSE_SCOPE = os.getenv("TOEPWAR_UNUSUAL_EXPENSE_SCOPE", "all")
+
+# Below this decayed count there is too little history to judge against
+MIN_HISTORY_WEIGHT = 0.5
+
+ALL_CATEGORIES = "*"
+
+
+def stats_id(user_id: str, category: str = ALL_CATEGORIES) -> str:
+    return f"{user_id}:{category}"
+
+
+def _naive_utc(date: datetime) -> datetime:
+    if date.tzinfo is not None:
+        return date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def _weight(date: datetime, as_of: datetime) -> float:
+    age_ms = max(0.0, (as_of - _naive_utc(date)).total_seconds() * 1000)
+    return math.exp(-age_ms / DECAY_MS)
+
+
+def fold_expense(spending: dict, transaction: dict, sign: int, as_of: datetime):
+    """
+    Add one added (sign 1) or removed (sign -1) expense to a pending
+    {category: [count, sum, sum_sq, max, max_date]} delta, weighted as of `as_of`
+    """
+    date = _naive_utc(transaction["date"])
+    weight = _weight(date, as_of)
+    amount = float(transaction["amount"])
+    for category in (transaction["category"], ALL_CATEGORIES):
+        entry = spending.setdefault(category, [0.0, 0.0, 0.0, None, None])
+        entry[0] += sign * weight
+        entry[1] += sign * weight * amount
+        entry[2] += sign * weight * amount * amount
+        # The peak is the largest expense of the last DECAY_DAYS, undecayed.
+        # A removed expense can't be taken back out of it.
+        if sign > 0 and date >= as_of - PEAK_WINDOW and (entry[3] is None or amount > entry[3]):
+            entry[3], entry[4] = amount, date
+
+
+def _update_pipeline(user_id: str, category: str, entry: list, as_of: datetime) -> list:
+    d_count, d_sum, d_sum_sq, d_max, d_max_date = entry
+    # Decay the stored state forward to as_of, then add the delta
+    factor = {"$exp": {"$divide": [
+        {"$min": [0, {"$subtract": [{"$ifNull": ["$updated_at", as_of]}, as_of]}]},
+        DECAY_MS
+    ]}}
+
+    def decayed_plus(field: str, value: float) -> dict:
+        return {"$max": [0, {"$add": [{"$multiply": [{"$ifNull": [f"${field}", 0]}, "$_factor"]}, value]}]}
+
+    fields = {
+        "user_id": user_id,
+        "category": category,
+        "count": decayed_plus("count", d_count),
+        "sum": decayed_plus("sum", d_sum),
+        "sum_sq": decayed_plus("sum_sq", d_sum_sq),
+        "updated_at": {"$max": [{"$ifNull": ["$updated_at", as_of]}, as_of]}
+    }
+    if d_max is not None:
+        # Replace the peak when this one is larger or the stored one is stale
+        replace = {"$or": [
+            {"$gte": [d_max, {"$ifNull": ["$max", 0]}]},
+            {"$lt": [{"$ifNull": ["$max_date", datetime.min]}, as_of - PEAK_WINDOW]}
+        ]}
+        fields["max"] = {"$cond": [replace, d_max, "$max"]}
+        fields["max_date"] = {"$cond": [replace, d_max_date, "$max_date"]}
+
+    return [
+        {"$set": {"_factor": factor}},
+        {"$set": fields},
+        {"$project": {"_factor": 0}}
+    ]
+
+
+def apply_spending_delta(user_id: str, spending: dict, as_of: datetime):
+    """Apply a pending delta to the user's stats documents in one bulk_write"""
+    if not spending:
+        return
+    spending_stats_collection.bulk_write([
+        UpdateOne(
+            {"_id": stats_id(user_id, category)},
+            _update_pipeline(user_id, category, entry, as_of),
+            upsert=True
+        )
+        for category, entry in spending.items()
+    ], ordered=False)
+
+
+def rebuild_spending_stats(user_id: str) -> dict:
+    """
+    Recompute the user's stats from recent expenses and mark them ready.
+    Users whose history predates the stats are rebuilt on first detection.
+    Returns the stats documents by _id.
+    """
+    as_of = datetime.utcnow()
+    spending = {}
+    for transaction in transactions_collection.find(
+        {"user_id": user_id, "type": "expense", "date": {"$gte": as_of - REBUILD_HORIZON}},
+        {"amount": 1, "category": 1, "date": 1}
+    ):
+        fold_expense(spending, transaction, 1, as_of)
+
+    documents = {
+        stats_id(user_id, category): {
+            "_id": stats_id(user_id, category),
+            "user_id": user_id,
+            "category": category,
+            "count": count,
+            "sum": amount_sum,
+            "sum_sq": sum_sq,
+            "max": peak,
+            "max_date": peak_date,
+            "updated_at": as_of
+        }
+        for category, (count, amount_sum, sum_sq, peak, peak_date) in spending.items()
+    }
+    # The all-expenses document doubles as the readiness marker
+    documents.setdefault(stats_id(user_id), {
+        "_id": stats_id(user_id), "user_id": user_id, "category": ALL_CATEGORIES,
+        "count": 0.0, "sum": 0.0, "sum_sq": 0.0, "max": None, "max_date": None, "updated_at": as_of
+    })["ready"] = True
+
+    # Replaced in place rather than deleted and reinserted, so a concurrent
+    # apply_spending_delta upsert never meets a missing document or a
+    # duplicate _id; categories without recent expenses are dropped after
+    spending_stats_collection.bulk_write([
+        ReplaceOne({"_id": document_id}, document, upsert=True)
+        for document_id, document in documents.items()
+    ], ordered=False)
+    spending_stats_collection.delete_many({"user_id": user_id, "_id": {"$nin": list(documents)}})
+    return documents
+
+
+def ensure_spending_stats(user_id: str):
+    """Build the stats before writes whose expenses will be judged against them"""
+    if not spending_stats_collection.find_one({"_id": stats_id(user_id), "ready": True}, {"_id": 1}):
+        rebuild_spending_stats(user_id)
+
+
+def _decayed(stats: dict | None, now: datetime) -> tuple:
+    """
+    (count, sum, sum_sq) decayed from updated_at to now, and the peak of the
+    last DECAY_DAYS (None if there is no recent one)
+    """
+    if not stats:
+        return 0.0, 0.0, 0.0, None
+    factor = _weight(stats["updated_at"], now)
+    peak = stats.get("max")
+    if peak is not None and stats["max_date"] < now - PEAK_WINDOW:
+        peak = None
+    return stats["count"] * factor, stats["sum"] * factor, stats["sum_sq"] * factor, peak
+
+
+def get_spending_stats(user_id: str, category: str | None = None) -> tuple:
+    """
+    Decayed (count, sum, sum_sq) and recent peak of the user's recent expenses overall,
+    and for `category` when given (None otherwise), in a single read.
+    """
+    ids = [stats_id(user_id)]
+    if category is not None:
+        ids.append(stats_id(user_id, category))
+    documents = {document["_id"]: document for document in spending_stats_collection.find({"_id": {"$in": ids}})}
+
+    if not documents.get(stats_id(user_id), {}).get("ready"):
+        documents = rebuild_spending_stats(user_id)
+
+    now = datetime.utcnow()
+    overall = _decayed(documents.get(stats_id(user_id)), now)
+    if category is None:
+        return overall, None
+    return overall, _decayed(documents.get(stats_id(user_id, category)), now)
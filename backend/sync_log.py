@@ -0,0 +1,67 @@
+import os
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument, UpdateOne
+from database import data_versions_collection, tombstones_collection
+
+# Every write to a user's transactions, goals or notifications stamps the
+# documents with the next value of the user's sync_seq counter, kept next to
+# their data version. Deletes leave a tombstone with the same stamp. A
+# client holding a token for seq N fetches everything stamped above N.
+#
+# Values are reserved before the write lands, so a write with a lower value
+# can become visible after one with a higher value. A token only moves past
+# documents stamped at least SYNC_SETTLE ago, by which time every write
+# reserved before them has landed; newer ones are sent again next time.
+SYNC_SETTLE = timedelta(seconds=int(os.getenv("TOEPWAR_SYNC_SETTLE", "5")))
+
+# Days tombstones are kept; older tokens get a full resync instead
+TOMBSTONE_RETENTION = timedelta(days=int(os.getenv("TOEPWAR_SYNC_TOMBSTONE_DAYS", "30")))
+
+SYNCED_COLLECTIONS = ("transactions", "goals", "notifications")
+
+
+def sync_stamp(user_id: str) -> dict:
+    """Fields to set on documents written for the user, all sharing the next seq"""
+    now = datetime.utcnow()
+    document = data_versions_collection.find_one_and_update(
+        {"_id": user_id},
+        {"$inc": {"sync_seq": 1}},
+        projection={"sync_seq": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return {"sync_seq": document["sync_seq"], "sync_at": now}
+
+
+def sync_stamps(user_ids) -> dict:
+    """sync_stamp for many users in one bulk_write and one read. Returns the stamps by user."""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    now = datetime.utcnow()
+    data_versions_collection.bulk_write([
+        UpdateOne({"_id": user_id}, {"$inc": {"sync_seq": 1}}, upsert=True)
+        for user_id in user_ids
+    ], ordered=False)
+    # May read a value another write reserved since; sharing a seq is harmless
+    return {
+        document["_id"]: {"sync_seq": document["sync_seq"], "sync_at": now}
+        for document in data_versions_collection.find({"_id": {"$in": user_ids}}, {"sync_seq": 1})
+    }
+
+
+def record_deletions(user_id: str, collection: str, document_ids: list):
+    """Leave tombstones for documents deleted from one of SYNCED_COLLECTIONS. Call after the delete."""
+    if not document_ids:
+        return
+    stamp = sync_stamp(user_id)
+    tombstones_collection.insert_many([
+        {
+            "user_id": user_id,
+            "collection": collection,
+            "document_id": str(document_id),
+            **stamp,
+            "expires_at": stamp["sync_at"] + TOMBSTONE_RETENTION
+        }
+        for document_id in document_ids
+    ])
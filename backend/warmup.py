@@ -0,0 +1,38 @@
+import importlib
+import time
+from database import ping
+import report_rendering
+
+# Modules deferred until first use by the routes that need them.
+# Importing them up front moves their cost from the first request to startup.
+WARMUP_MODULES = (
+    "forecasting",          # numpy, for /financial-forecast
+)
+
+
+def warm_up() -> dict:
+    """
+    Ping the database, import the deferred modules and start the report
+    render processes, which import openpyxl and reportlab.
+    Returns the seconds spent on each step, for the startup log.
+    """
+    timings = {}
+
+    started = time.perf_counter()
+    ping()
+    timings["mongo_ping"] = time.perf_counter() - started
+
+    for module_name in WARMUP_MODULES:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(module_name)
+        except ImportError as e:
+            # The route will raise on first use instead; don't stop the worker
+            print(f"Warm-up could not import {module_name}: {e}")
+        timings[module_name] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    report_rendering.warm_pool()
+    timings["report_pool"] = time.perf_counter() - started
+
+    return timings